@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# Deterministic generator of synthetic activities: the same size always gives
+# the same activity, so that the benchmarks of different commits run on the
+# same data.
+
+import argparse, os
+
+import numpy
+
+import runner.model as model
+from runner.dumper import dumper_for_file
+from runner.timestamp import parse_timestamp, datetime_to_ns
+
+FORMATS = ('fit', 'gpx', 'runner', 'tcx')
+SIZES = (1000, 10000, 100000, 1000000)
+
+START = datetime_to_ns(parse_timestamp('2014-10-20T17:00:00Z'))
+LAP_DISTANCE = 1000 # in meters
+SEED = 42
+
+def generate_arrays(size, seed=SEED):
+    random = numpy.random.RandomState(seed + size)
+
+    # one point per second, at 3 m/s on average
+    time = START + numpy.arange(size, dtype='int64') * 10 ** 9
+    speed = 3 + 0.5 * numpy.sin(numpy.arange(size) / 300.0) + random.normal(0, 0.1, size)
+    distance = numpy.cumsum(speed)
+    altitude = 100 + numpy.cumsum(random.normal(0, 0.2, size))
+
+    # the effort follows the speed
+    heart_rate = numpy.clip(90 + speed * 25 + random.normal(0, 3, size), 60, 210).astype('int32')
+
+    # the course turns slowly around Lyon
+    heading = numpy.cumsum(random.normal(0, 0.05, size))
+    latitude = 45.75 + numpy.cumsum(speed * numpy.cos(heading)) / 111320.0
+    longitude = 4.85 + numpy.cumsum(speed * numpy.sin(heading)) / 77800.0
+
+    return {
+        'time': time,
+        'distance': distance,
+        'altitude': altitude,
+        'heart_rate': heart_rate,
+        'latitude': latitude,
+        'longitude': longitude,
+        'lap': (distance // LAP_DISTANCE).astype('int32'),
+    }
+
+def generate_activity(size, seed=SEED):
+    arrays = generate_arrays(size, seed)
+    activity = model.Activity.from_arrays(arrays)
+    activity.type = 'running'
+
+    for lap in activity.laps:
+        lap.duration = int(lap.trackpoints.summary.duration)
+        lap.distance = int(lap.trackpoints.summary.distance)
+        lap.calories = int(lap.distance * 0.07)
+        lap.trigger_method = 'distance'
+
+    return activity
+
+def generate_cardio_activity(size, seed=SEED):
+    # heart rate only, sampled every two seconds half a second after the
+    # points of the main activity: what a chest strap would record
+    arrays = generate_arrays(size, seed)
+
+    activity = model.Activity.from_arrays({
+        'time': arrays['time'][::2] + 5 * 10 ** 8,
+        'heart_rate': arrays['heart_rate'][::2],
+    })
+    activity.type = 'running'
+
+    for lap in activity.laps:
+        lap.duration = int(lap.trackpoints.summary.duration)
+        lap.trigger_method = 'manual'
+
+    return activity
+
+def filename(directory, size, extension, kind='activity'):
+    return os.path.join(directory, '%s-%d.%s' % (kind, size, extension))
+
+def generate_files(directory, sizes=SIZES, formats=FORMATS, force=False):
+    # returns the generated (or already existing) files
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    files = []
+
+    for size in sizes:
+        activities = {'activity': None, 'cardio': None}
+
+        for kind, generator in (('activity', generate_activity), ('cardio', generate_cardio_activity)):
+            for extension in formats:
+                path = filename(directory, size, extension, kind)
+                files.append(path)
+
+                if os.path.exists(path) and not force:
+                    continue
+
+                if activities[kind] is None:
+                    activities[kind] = generator(size)
+
+                dumper_for_file(path).dump_to_file(activities[kind], path)
+
+    return files
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic activities for the benchmarks'
+    )
+    parser.add_argument(
+        '-d', '--directory', type=str, default=os.path.join(os.path.dirname(__file__), 'data'),
+        help='Directory to write the activities to.',
+    )
+    parser.add_argument(
+        '-s', '--sizes', type=int, nargs='+', default=SIZES,
+        help='Number of trackpoints of the activities.',
+    )
+    parser.add_argument(
+        '-f', '--formats', type=str, nargs='+', default=FORMATS, choices=FORMATS,
+        help='Formats to write the activities in.',
+    )
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Generate the files even if they already exist.',
+    )
+
+    return parser.parse_args()
+
+def main():
+    options = parse_args()
+
+    for path in generate_files(options.directory, options.sizes, options.formats, options.force):
+        print(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+# Runs the benchmarks on the synthetic activities and stores the results by
+# commit, so that the results of two commits can be compared.
+#
+#   python -m benchmarks.run --sizes 1000 100000
+#   python -m benchmarks.run --compare <commit>
+
+import argparse, json, multiprocessing, os, platform, subprocess, sys, time, tracemalloc
+from argparse import Namespace
+
+from benchmarks.generate import FORMATS, filename, generate_files
+
+from runner import Fusion, Simplifier, TimeEditor
+from runner.analytics import analyze
+from runner.dumper import dumper_for_file
+from runner.parser import parse_from_file
+from runner.stats import format_bytes, peak_rss
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_RESULTS = os.path.join(os.path.dirname(__file__), 'results.json')
+DEFAULT_DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+# a case prepares its arguments (not measured) then runs the measured code
+def _parse_setup(extension):
+    return lambda directory, size: (filename(directory, size, extension),)
+
+def _parse(path):
+    parse_from_file(path, cache=False)
+
+def _activity_setup(directory, size):
+    # the native files are the fastest to read
+    return (parse_from_file(filename(directory, size, 'runner'), cache=False),)
+
+def _dump_setup(extension):
+    def setup(directory, size):
+        return _activity_setup(directory, size) + (os.path.join(directory, 'output.' + extension),)
+
+    return setup
+
+def _dump(activity, path):
+    dumper_for_file(path).dump_to_file(activity, path)
+
+def _edit(activity):
+    TimeEditor().edit(activity, Namespace(time='+2hour'))
+
+def _merge_setup(directory, size):
+    return _activity_setup(directory, size) + (
+        parse_from_file(filename(directory, size, 'runner', 'cardio'), cache=False),
+    )
+
+def _merge(main_activity, cardio_activity):
+    Fusion().merge_activities(main_activity, cardio_activity)
+
+def _analyze(activity):
+    analyze(activity)
+
+def _simplify(activity):
+    Simplifier(tolerance=5).simplify(activity)
+
+CASES = [('parse_%s' % extension, _parse_setup(extension), _parse) for extension in FORMATS] + [
+    ('dump_tcx', _dump_setup('tcx'), _dump),
+    ('dump_gpx', _dump_setup('gpx'), _dump),
+    ('dump_fit', _dump_setup('fit'), _dump),
+    ('edit_time', _activity_setup, _edit),
+    ('merge', _merge_setup, _merge),
+    ('analyze', _activity_setup, _analyze),
+    ('simplify', _activity_setup, _simplify),
+]
+
+def run_case(name, directory, size, repeat):
+    # runs in its own process so that the memory peaks are not shared
+    # between the cases
+    _, setup, function = [case for case in CASES if case[0] == name][0]
+    times = []
+
+    for _ in range(repeat):
+        args = setup(directory, size)
+
+        start = time.time()
+        function(*args)
+        times.append(time.time() - start)
+
+    # a separate run: tracing the allocations slows the code down
+    args = setup(directory, size)
+    tracemalloc.start()
+    function(*args)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(times)
+
+    return {
+        'size': size,
+        'time': best,
+        'times': times,
+        'points_per_second': size / best if best else None,
+        'peak_memory': peak_memory,
+        'max_rss': peak_rss(),
+    }
+
+def _run_case(args):
+    return run_case(*args)
+
+def current_commit():
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=directory).decode('utf-8').strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=directory)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+    return commit + ('-dirty' if status.strip() else '')
+
+def run(sizes, cases, directory, repeat):
+    generate_files(directory, sizes)
+    results = {}
+
+    for size in sizes:
+        for name, _, _ in CASES:
+            if cases and not any(case in name for case in cases):
+                continue
+
+            pool = multiprocessing.Pool(1, maxtasksperchild=1)
+            try:
+                result = pool.apply(_run_case, ((name, directory, size, repeat),))
+            finally:
+                pool.terminate()
+                pool.join()
+
+            results['%s/%d' % (name, size)] = result
+            print('%-14s %8d %9.3fs %12d points/s %9s' % (
+                name, size, result['time'], result['points_per_second'] or 0, format_bytes(result['peak_memory'])
+            ))
+
+    return results
+
+def load_results(path):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as source:
+        return json.load(source)
+
+def save_results(path, commit, results):
+    all_results = load_results(path)
+    all_results.setdefault(commit, {'results': {}})
+    all_results[commit].update({
+        'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+    })
+    all_results[commit]['results'].update(results)
+
+    with open(path, 'w') as output:
+        json.dump(all_results, output, indent=2, sort_keys=True)
+
+def compare(baseline, results, threshold):
+    # returns the cases that got slower than the threshold allows
+    regressions = []
+
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+
+        ratio = results[key]['time'] / baseline[key]['time'] if baseline[key]['time'] else 1
+        regression = ratio > 1 + threshold
+        print('%-22s %9.3fs -> %9.3fs  x%.2f%s' % (
+            key, baseline[key]['time'], results[key]['time'], ratio, '  REGRESSION' if regression else ''
+        ))
+
+        if regression:
+            regressions.append(key)
+
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run the benchmarks'
+    )
+    parser.add_argument(
+        '-s', '--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+        help='Number of trackpoints of the activities (1000 to 1000000).',
+    )
+    parser.add_argument(
+        '-c', '--cases', type=str, nargs='+', default=None,
+        help='Only run the cases whose name contains one of these strings.',
+    )
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='Number of runs of each case, the best one is kept.',
+    )
+    parser.add_argument(
+        '-d', '--data', type=str, default=DEFAULT_DATA,
+        help='Directory of the generated activities.',
+    )
+    parser.add_argument(
+        '-o', '--results', type=str, default=DEFAULT_RESULTS,
+        help='JSON file storing the results by commit.',
+    )
+    parser.add_argument(
+        '--compare', type=str, default=None,
+        help='Commit to compare the results with.',
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='Slowdown above which a case is reported as a regression.',
+    )
+
+    return parser.parse_args()
+
+def main():
+    options = parse_args()
+    commit = current_commit()
+    baseline = None
+
+    if options.compare is not None:
+        baseline = load_results(options.results).get(options.compare)
+
+        if baseline is None:
+            sys.exit('No results for commit %s' % options.compare)
+
+    print('commit %s' % commit)
+    results = run(options.sizes, options.cases, options.data, options.repeat)
+    save_results(options.results, commit, results)
+
+    if baseline is not None and compare(baseline['results'], results, options.threshold):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
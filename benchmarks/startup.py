@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# Measures the time taken by runner-convert to convert a tiny activity, on top
+# of the import of numpy that every format needs. The conversions between
+# formats that don't need lxml must stay within the budget, and must not
+# import lxml at all.
+#
+#   python -m benchmarks.startup
+#   python -m benchmarks.startup --budget 0.1 --repeat 10
+
+import argparse, os, subprocess, sys, time
+
+from benchmarks.generate import FORMATS, filename, generate_files
+
+SIZE = 100
+XML_FORMATS = ('gpx', 'tcx')
+SCRIPT = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'runner-convert')
+DEFAULT_DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+def _environment():
+    # the scripts must import this version of the package
+    environment = dict(os.environ)
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, [root, environment.get('PYTHONPATH')]))
+    environment.pop('RUNNER_CACHE_DIR', None)
+
+    return environment
+
+def best_time(command, repeat):
+    environment = _environment()
+    times = []
+
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call(command, env=environment)
+        times.append(time.time() - start)
+
+    return min(times)
+
+def imported_modules(command):
+    # the top-level packages imported by the command
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime'] + command[1:],
+        env=_environment(), stderr=subprocess.STDOUT
+    ).decode('utf-8')
+    modules = set()
+
+    for line in output.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            modules.add(line.rsplit('|', 1)[1].strip().split('.')[0])
+
+    return modules
+
+def run(directory, budget, repeat):
+    generate_files(directory, [SIZE], FORMATS)
+
+    baseline = best_time([sys.executable, '-c', 'import numpy'], repeat)
+    print('baseline (python + numpy): %.1fms' % (baseline * 1000))
+    print('%-16s %10s %10s %6s' % ('conversion', 'time', 'overhead', 'lxml'))
+
+    failures = 0
+
+    for source in FORMATS:
+        for target in FORMATS:
+            if source == target:
+                continue
+
+            output = os.path.join(directory, 'startup.' + target)
+            command = [sys.executable, SCRIPT, '-i', filename(directory, SIZE, source), '-o', output]
+            overhead = best_time(command, repeat) - baseline
+            lxml = 'lxml' in imported_modules(command)
+
+            # lxml is only allowed (and not budgeted) for the XML formats
+            checked = source not in XML_FORMATS and target not in XML_FORMATS
+            failed = checked and (overhead > budget or lxml)
+            failures += failed
+
+            print('%-16s %8.1fms %8.1fms %6s%s' % (
+                '%s -> %s' % (source, target), (baseline + overhead) * 1000, overhead * 1000,
+                'yes' if lxml else 'no', '  over budget' if failed else ''
+            ))
+
+    return failures
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measure the startup time of runner-convert'
+    )
+    parser.add_argument(
+        '--budget', type=float, default=0.1,
+        help='Maximum time (in seconds) on top of the import of numpy for the formats without lxml.',
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='Number of runs of each conversion (the best one is kept).',
+    )
+    parser.add_argument(
+        '-d', '--data', type=str, default=DEFAULT_DATA,
+        help='Directory of the synthetic activities.',
+    )
+
+    return parser.parse_args()
+
+def main():
+    options = parse_args()
+
+    if run(options.data, options.budget, options.repeat):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,31 @@
-from runner.dumper import dump_to_file
-from runner.editor import TimeEditor
-from runner.fusion import Fusion
-from runner.parser import parse_from_file
+import importlib
+
+# the modules are only imported when their names are used, so that the
+# command line tools only pay for what they need
+_LAZY_NAMES = {
+    'dump_to_file': 'runner.dumper',
+    'parse_from_file': 'runner.parser',
+    'Fusion': 'runner.fusion',
+    'Simplifier': 'runner.simplify',
+    'Stats': 'runner.stats',
+    'TimeEditor': 'runner.editor',
+    'LapEditor': 'runner.editor',
+}
 
 
 __version__ = '1.0.0'
 __all__ = [
-    'dump_to_file', 'parse_from_file', 'Fusion',
-    'TimeEditor'
+    'dump_to_file', 'parse_from_file', 'Fusion', 'Simplifier',
+    'Stats', 'TimeEditor', 'LapEditor'
 ]
+
+def __getattr__(name):
+    if name not in _LAZY_NAMES:
+        raise AttributeError("module 'runner' has no attribute '%s'" % name)
+
+    value = globals()[name] = getattr(importlib.import_module(_LAZY_NAMES[name]), name)
+
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_NAMES))
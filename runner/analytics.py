@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+# Analytics on the trackpoint series of an activity: best efforts over
+# distances, best averages over time windows, rolling averages and time in
+# heart rate zones. The series are integrated once with cumulative sums, so
+# that any window is then given by the difference of two interpolated values:
+# every computation is linear (or n log n for the binary searches) in the
+# number of trackpoints.
+
+from collections import namedtuple
+
+import numpy
+
+from runner.spatial import distances
+
+DEFAULT_EFFORTS = (1000, 5000, 10000) # in meters
+DEFAULT_WINDOWS = (60, 300, 1200) # in seconds
+# bounds of the heart rate zones, in percents of the maximum heart rate
+DEFAULT_ZONES = (50, 60, 70, 80, 90)
+# longer gaps between two samples are missing data (pauses...)
+MAX_GAP = 30 # in seconds
+
+class Effort(namedtuple('Effort', 'distance elapsed start end start_index end_index')):
+    # elapsed, start and end in seconds since the start of the activity
+    @property
+    def speed(self):
+        return self.distance / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def pace(self):
+        # in seconds per kilometer
+        return self.elapsed * 1000.0 / self.distance if self.distance > 0 else 0.0
+
+class Average(namedtuple('Average', 'window value start end')):
+    # start and end in seconds since the start of the activity
+    pass
+
+class Zone(namedtuple('Zone', 'low high time')):
+    # heart rates from low (included) to high (excluded, None for no limit)
+    pass
+
+def series(activity):
+    # (seconds since the start, cumulative distance, heart rate) of the
+    # trackpoints with a time, sorted by time
+    arrays = activity.to_arrays()
+    order = numpy.argsort(arrays['time'], kind='mergesort')
+    time = arrays['time'][order]
+
+    if len(time) == 0:
+        return numpy.empty(0), numpy.empty(0), numpy.empty(0)
+
+    distance = cumulative_distance(arrays['distance'][order], arrays['latitude'][order], arrays['longitude'][order])
+
+    return (time - time[0]) / 1e9, distance, arrays['heart_rate'][order].astype('float64')
+
+def cumulative_distance(distance, latitude, longitude):
+    # the distance of sorted trackpoints, computed from their positions for
+    # the files without distances (GPX...)
+    if not distance.any() and len(distance):
+        steps = distances(latitude[:-1], longitude[:-1], latitude[1:], longitude[1:])
+        distance = numpy.r_[0, numpy.cumsum(numpy.nan_to_num(steps))]
+
+    # the distance can't decrease, even with noisy devices
+    return numpy.maximum.accumulate(distance)
+
+def best_efforts(time, distance, lengths=DEFAULT_EFFORTS):
+    # the fastest segment covering each length (in meters), None when the
+    # activity is shorter. The end of a segment is interpolated between the
+    # two trackpoints around it.
+    efforts = []
+
+    for length in lengths:
+        starts = numpy.flatnonzero(distance + length <= distance[-1]) if len(distance) else []
+
+        if not len(starts):
+            efforts.append(None)
+            continue
+
+        # first trackpoint at the end of each segment, the distance being
+        # sorted (the two pointers are moved by a binary search)
+        targets = distance[starts] + length
+        after = numpy.maximum(numpy.searchsorted(distance, targets, side='left'), 1)
+        before = after - 1
+        steps = distance[after] - distance[before]
+        ratios = numpy.where(steps > 0, (targets - distance[before]) / numpy.where(steps > 0, steps, 1), 1)
+        ends = time[before] + ratios * (time[after] - time[before])
+
+        elapsed = ends - time[starts]
+        best = int(numpy.argmin(elapsed))
+        start = starts[best]
+
+        efforts.append(Effort(
+            length, float(elapsed[best]), float(time[start]), float(ends[best]), int(start), int(after[best])
+        ))
+
+    return efforts
+
+def _integral(time, values, valid):
+    # cumulative integrals of the values and of the time where they are
+    # valid, values being held until the next sample
+    durations = numpy.diff(time)
+    held = valid[:-1] & (durations <= MAX_GAP)
+
+    value_integral = numpy.r_[0, numpy.cumsum(numpy.where(held, values[:-1] * durations, 0))]
+    time_integral = numpy.r_[0, numpy.cumsum(numpy.where(held, durations, 0))]
+
+    return value_integral, time_integral
+
+def best_averages(time, values, windows=DEFAULT_WINDOWS, valid=None, coverage=0.9):
+    # the highest average of the values over each window (in seconds), None
+    # when the activity is too short. valid tells which values are known
+    # (all by default), a window is only used when they cover at least
+    # coverage of it.
+    valid = numpy.ones(len(values), dtype='bool') if valid is None else valid
+    averages = []
+
+    if len(time) < 2:
+        return [None] * len(windows)
+
+    value_integral, time_integral = _integral(time, values, valid)
+
+    for window in windows:
+        starts = time[time + window <= time[-1]]
+
+        if not len(starts):
+            averages.append(None)
+            continue
+
+        covered = numpy.interp(starts + window, time, time_integral) - numpy.interp(starts, time, time_integral)
+        total = numpy.interp(starts + window, time, value_integral) - numpy.interp(starts, time, value_integral)
+        kept = covered >= coverage * window
+
+        if not kept.any():
+            averages.append(None)
+            continue
+
+        means = numpy.where(kept, total / numpy.maximum(covered, 1e-9), -numpy.inf)
+        best = int(numpy.argmax(means))
+        averages.append(Average(window, float(means[best]), float(starts[best]), float(starts[best] + window)))
+
+    return averages
+
+def best_speeds(time, distance, windows=DEFAULT_WINDOWS):
+    # the highest average speed (in m/s) over each window (in seconds)
+    speeds = []
+
+    for window in windows:
+        starts = time[time + window <= time[-1]] if len(time) else []
+
+        if not len(starts):
+            speeds.append(None)
+            continue
+
+        covered = numpy.interp(starts + window, time, distance) - numpy.interp(starts, time, distance)
+        best = int(numpy.argmax(covered))
+        speeds.append(Average(window, float(covered[best] / window), float(starts[best]), float(starts[best] + window)))
+
+    return speeds
+
+def rolling_average(time, values, window, valid=None):
+    # average of the values over the window (in seconds) ending at each
+    # trackpoint, NaN where no value is known
+    valid = numpy.ones(len(values), dtype='bool') if valid is None else valid
+
+    if len(time) < 2:
+        return numpy.where(valid, values, numpy.nan).astype('float64')
+
+    value_integral, time_integral = _integral(time, values, valid)
+    starts = numpy.maximum(time - window, time[0])
+
+    covered = time_integral - numpy.interp(starts, time, time_integral)
+    total = value_integral - numpy.interp(starts, time, value_integral)
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        averages = total / covered
+
+    # the first trackpoint (or the ones after a pause) only have their value
+    return numpy.where(covered > 0, averages, numpy.where(valid, values, numpy.nan))
+
+def rolling_speed(time, distance, window):
+    # average speed (in m/s) over the window (in seconds) ending at each
+    # trackpoint
+    starts = numpy.maximum(time - window, time[0]) if len(time) else time
+    durations = time - starts
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.where(durations > 0, (distance - numpy.interp(starts, time, distance)) / durations, 0.0)
+
+def zone_bounds(max_heart_rate, percents=DEFAULT_ZONES):
+    return [max_heart_rate * percent / 100.0 for percent in percents]
+
+def time_in_zones(time, heart_rate, bounds):
+    # time (in seconds) spent in each zone, the heart rates being held until
+    # the next sample. The first zone is below the first bound and the last
+    # one above the last bound.
+    bounds = sorted(bounds)
+    low = [0] + bounds
+    high = bounds + [None]
+
+    if len(time) < 2:
+        return [Zone(l, h, 0.0) for l, h in zip(low, high)]
+
+    durations = numpy.diff(time)
+    held = (heart_rate[:-1] > 0) & (durations <= MAX_GAP)
+    zones = numpy.searchsorted(bounds, heart_rate[:-1], side='right')
+    times = numpy.bincount(zones[held], weights=durations[held], minlength=len(bounds) + 1)
+
+    return [Zone(l, h, float(t)) for l, h, t in zip(low, high, times)]
+
+def analyze(activity, efforts=DEFAULT_EFFORTS, windows=DEFAULT_WINDOWS, max_heart_rate=None, zones=None):
+    # the whole report of an activity, as a dict. The zones are given by
+    # their bounds or computed from the maximum heart rate (the highest one
+    # of the activity by default).
+    time, distance, heart_rate = series(activity)
+    has_distance = len(distance) > 0 and distance[-1] > 0
+    has_heart_rate = heart_rate > 0
+
+    if zones is None and has_heart_rate.any():
+        zones = zone_bounds(max_heart_rate or float(heart_rate.max()))
+
+    return {
+        'duration': float(time[-1]) if len(time) else 0.0,
+        'distance': float(distance[-1]) if len(distance) else 0.0,
+        'efforts': best_efforts(time, distance, efforts),
+        'speeds': best_speeds(time, distance, windows) if has_distance else [None] * len(windows),
+        'heart_rates': best_averages(time, heart_rate, windows, has_heart_rate) if has_heart_rate.any() else [None] * len(windows),
+        'zones': time_in_zones(time, heart_rate, zones) if zones else [],
+    }
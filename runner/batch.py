@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import glob, multiprocessing, os, time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+import runner.formats as formats
+from runner.dumper import dump_to_file
+from runner.parser import parse_from_file, parser_for_file, ParserNotFoundError
+
+class ConversionResult(namedtuple('ConversionResult', 'input output status trackpoints elapsed error')):
+    CONVERTED = 'converted'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+
+class ParseResult(namedtuple('ParseResult', 'filename activity elapsed error')):
+    pass
+
+# the formats decoded in python are parsed in processes, the other ones in
+# threads as lxml and the IO release the GIL
+PROCESS_FORMATS = ('fit',)
+
+def collect_inputs(patterns):
+    # expands globs and directories into (file, path relative to the
+    # output directory) pairs
+    inputs = []
+
+    for pattern in patterns:
+        paths = sorted(glob.glob(pattern)) or [pattern]
+
+        for path in paths:
+            if not os.path.isdir(path):
+                inputs.append((path, os.path.basename(path)))
+                continue
+
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+
+                for name in sorted(files):
+                    if _is_supported(name):
+                        filename = os.path.join(root, name)
+                        inputs.append((filename, os.path.relpath(filename, path)))
+
+    return inputs
+
+def _is_supported(filename):
+    try:
+        parser_for_file(filename)
+    except ParserNotFoundError:
+        return False
+
+    return True
+
+def plan_conversions(patterns, output_dir, extension):
+    conversions = []
+    outputs = set()
+
+    for filename, relative_path in collect_inputs(patterns):
+        output = os.path.join(output_dir, formats.strip_extension(relative_path) + '.' + extension)
+
+        # activity.tcx and activity.gpx would both be written to activity.<ext>
+        if output in outputs:
+            output = os.path.join(output_dir, relative_path + '.' + extension)
+
+        outputs.add(output)
+        conversions.append((filename, output))
+
+    return conversions
+
+def is_up_to_date(input_file, output_file):
+    try:
+        return os.path.getmtime(output_file) >= os.path.getmtime(input_file)
+    except OSError:
+        return False
+
+def convert_file(input_file, output_file, force=False, simplifier=None, precision=None):
+    # simplifier (see runner.simplify) and precision (see runner.dumper) are
+    # optional
+    start = time.time()
+
+    if not force and is_up_to_date(input_file, output_file):
+        return ConversionResult(input_file, output_file, ConversionResult.SKIPPED, 0, 0, None)
+
+    try:
+        activity = parse_from_file(input_file)
+
+        if simplifier is not None:
+            simplifier.simplify(activity)
+
+        directory = os.path.dirname(output_file)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created in the meantime by another worker
+                if not os.path.isdir(directory):
+                    raise
+
+        dump_to_file(activity, output_file, precision=precision)
+    except Exception as e:
+        return ConversionResult(input_file, output_file, ConversionResult.FAILED, 0, time.time() - start, '%s: %s' % (type(e).__name__, e))
+
+    trackpoints = sum(len(lap.trackpoints) for lap in activity.laps)
+
+    return ConversionResult(input_file, output_file, ConversionResult.CONVERTED, trackpoints, time.time() - start, None)
+
+def _convert(args):
+    return convert_file(*args)
+
+def map_unordered(function, tasks, jobs=None):
+    # yields the results of function (a module level one, that returns its
+    # errors) on the tasks in a pool of processes, as they complete
+    tasks = list(tasks)
+
+    if jobs == 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield function(task)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+
+    try:
+        chunksize = max(1, min(16, len(tasks) // (4 * (jobs or multiprocessing.cpu_count()))))
+
+        for result in pool.imap_unordered(function, tasks, chunksize):
+            yield result
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def convert_many(conversions, jobs=None, force=False, simplifier=None, precision=None):
+    # yields the results as the conversions complete
+    tasks = [(input_file, output_file, force, simplifier, precision) for input_file, output_file in conversions]
+
+    return map_unordered(_convert, tasks, jobs)
+
+def _parse_file(filename):
+    start = time.time()
+
+    try:
+        activity = parse_from_file(filename)
+    except Exception as e:
+        return ParseResult(filename, None, time.time() - start, '%s: %s' % (type(e).__name__, e))
+
+    return ParseResult(filename, activity, time.time() - start, None)
+
+def _in_process(filename):
+    return formats.split_extension(filename)[0] in PROCESS_FORMATS
+
+def parse_many(filenames, jobs=None):
+    # parses the files concurrently, the results are in the same order as the
+    # files and hold the error of the files that couldn't be parsed
+    filenames = list(filenames)
+    jobs = jobs or multiprocessing.cpu_count()
+
+    if jobs == 1 or len(filenames) <= 1:
+        return [_parse_file(filename) for filename in filenames]
+
+    in_process = [_in_process(filename) for filename in filenames]
+    processes = sum(in_process)
+    threads = len(filenames) - processes
+
+    process_pool = multiprocessing.Pool(min(jobs, processes)) if processes else None
+    thread_pool = ThreadPool(min(jobs, threads)) if threads else None
+
+    try:
+        pending = [
+            (process_pool if process else thread_pool).apply_async(_parse_file, (filename, ))
+            for filename, process in zip(filenames, in_process)
+        ]
+
+        return [result.get() for result in pending]
+    finally:
+        for pool in (process_pool, thread_pool):
+            if pool is not None:
+                pool.terminate()
+                pool.join()
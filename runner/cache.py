@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+import hashlib, os, tempfile
+
+class ActivityCache:
+    # bump when the parsers or the model change what a parsed file gives
+    VERSION = 4
+    EXTENSION = '.runner'
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024, hash_content=False):
+        self.directory = directory
+        self.max_size = max_size # in bytes
+        self.hash_content = hash_content
+
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError:
+            # the entries won't be written, the files are still parsed
+            pass
+
+    def get(self, filename):
+        # native is only imported when the cache is used
+        import runner.native as native
+
+        path = self._path(filename)
+
+        try:
+            # entries are memory-mapped native files
+            activity = native.read_activity(path)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            # corrupted or written by an incompatible version
+            self._remove(path)
+            return None
+
+        # the modification time of the entries tells which ones were the
+        # least recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return activity
+
+    def put(self, filename, activity):
+        # False when the entry couldn't be written (full disk, read-only
+        # directory...): the cache never makes a parse fail
+        import runner.native as native
+
+        tmp_path = None
+
+        try:
+            path = self._path(filename)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+            with os.fdopen(fd, 'wb') as entry:
+                native.write_activity(activity, entry)
+
+            os.rename(tmp_path, path)
+            self._evict()
+        except (IOError, OSError):
+            if tmp_path is not None:
+                self._remove(tmp_path)
+
+            return False
+        except Exception:
+            if tmp_path is not None:
+                self._remove(tmp_path)
+
+            raise
+
+        return True
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            self._remove(path)
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+
+        while entries and total > self.max_size:
+            path, size, _ = entries.pop(0)
+            self._remove(path)
+            total -= size
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.EXTENSION):
+                continue
+
+            path = os.path.join(self.directory, name)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            yield path, stat.st_size, stat.st_mtime
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _path(self, filename):
+        return os.path.join(self.directory, self._key(filename) + self.EXTENSION)
+
+    def _key(self, filename):
+        import runner
+
+        key = hashlib.sha1()
+        key.update(('%s:%d' % (runner.__version__, self.VERSION)).encode('utf-8'))
+
+        if self.hash_content:
+            with open(filename, 'rb') as source:
+                for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                    key.update(chunk)
+        else:
+            stat = os.stat(filename)
+            key.update(('%s:%d:%r' % (os.path.abspath(filename), stat.st_size, stat.st_mtime)).encode('utf-8'))
+
+        return key.hexdigest()
+
+def default_cache():
+    # the cache is opt-in: it is only used when RUNNER_CACHE_DIR is set
+    directory = os.environ.get('RUNNER_CACHE_DIR')
+
+    if not directory:
+        return None
+
+    max_size = int(os.environ.get('RUNNER_CACHE_MAX_SIZE', 1024)) * 1024 * 1024 # in MB
+    hash_content = os.environ.get('RUNNER_CACHE_HASH_CONTENT', '') not in ('', '0')
+
+    return ActivityCache(directory, max_size, hash_content)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+# A catalog of activity files: the summaries of the activities and of their
+# laps are stored in a SQLite database, so that the library can be queried
+# without parsing the files again. Only the new and modified files (by size
+# and modification time) are parsed when the catalog is updated.
+#
+# The cells of the spatial grid (see runner.spatial) each activity goes
+# through are stored as well, to find the activities passing through an area.
+
+import os, sqlite3, time
+from collections import namedtuple
+
+from runner.batch import collect_inputs, map_unordered
+from runner.parser import parse_from_file
+from runner.spatial import COLUMNS, TrackIndex, cell_bounds, circle_bbox, track_length
+
+# bump when the tables or what is stored in them change (CELL_SIZE...): the
+# catalogs of the previous versions are emptied and rebuilt when indexed
+VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    indexed_at REAL NOT NULL,
+    error TEXT
+);
+
+CREATE TABLE IF NOT EXISTS activities (
+    file_id INTEGER PRIMARY KEY REFERENCES files (id) ON DELETE CASCADE,
+    type TEXT,
+    started_at TEXT,
+    completed_at TEXT,
+    total_time REAL NOT NULL,
+    distance REAL NOT NULL,
+    calories INTEGER NOT NULL,
+    laps INTEGER NOT NULL,
+    trackpoints INTEGER NOT NULL,
+    avg_heart_rate REAL,
+    max_heart_rate INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS laps (
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    number INTEGER NOT NULL,
+    started_at TEXT,
+    total_time REAL NOT NULL,
+    distance REAL NOT NULL,
+    calories INTEGER NOT NULL,
+    trigger_method TEXT,
+    avg_heart_rate REAL,
+    max_heart_rate INTEGER,
+    PRIMARY KEY (file_id, number)
+);
+
+CREATE TABLE IF NOT EXISTS cells (
+    cell INTEGER NOT NULL,
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    trackpoints INTEGER NOT NULL,
+    PRIMARY KEY (cell, file_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS activities_started_at ON activities (started_at);
+CREATE INDEX IF NOT EXISTS cells_file_id ON cells (file_id);
+'''
+
+ACTIVITY_COLUMNS = (
+    'type', 'started_at', 'completed_at', 'total_time', 'distance', 'calories',
+    'laps', 'trackpoints', 'avg_heart_rate', 'max_heart_rate',
+)
+
+LAP_COLUMNS = (
+    'number', 'started_at', 'total_time', 'distance', 'calories',
+    'trigger_method', 'avg_heart_rate', 'max_heart_rate',
+)
+
+# the periods the totals can be grouped by, as SQLite expressions
+PERIODS = {
+    'day': "strftime('%Y-%m-%d', started_at)",
+    'week': "strftime('%Y-W%W', started_at)",
+    'month': "strftime('%Y-%m', started_at)",
+    'year': "strftime('%Y', started_at)",
+    'type': 'type',
+}
+
+class IndexResult(namedtuple('IndexResult', 'path status trackpoints elapsed error')):
+    INDEXED = 'indexed'
+    UNCHANGED = 'unchanged'
+    REMOVED = 'removed'
+    FAILED = 'failed'
+
+def _date(date):
+    # the dates are stored in UTC, in a format understood by SQLite
+    return None if date is None else date.strftime('%Y-%m-%d %H:%M:%S')
+
+def _lap_summary(number, lap):
+    summary = lap.trackpoints.summary
+    arrays = lap.trackpoints.arrays()
+
+    # the files without lap summaries (GPX...) only have their trackpoints
+    distance = lap.distance or summary.distance or track_length(arrays['latitude'], arrays['longitude'])
+
+    return {
+        'number': number,
+        'started_at': _date(lap.start_time),
+        'total_time': lap.duration or summary.duration,
+        'distance': distance,
+        'calories': lap.calories,
+        'trigger_method': lap.trigger_method,
+        'avg_heart_rate': lap.avg_heart_rate or None,
+        'max_heart_rate': lap.max_heart_rate or None,
+    }
+
+def summarize(activity):
+    # the catalog rows of an activity, of its laps and of its cells
+    laps = [_lap_summary(number, lap) for number, lap in enumerate(activity.laps)]
+    cells, counts = TrackIndex.from_activity(activity).cells()
+    trackpoints = [len(lap.trackpoints) for lap in activity.laps]
+    heart_rates = [(lap['avg_heart_rate'], count) for lap, count in zip(laps, trackpoints) if lap['avg_heart_rate']]
+    weight = sum(count for _, count in heart_rates)
+
+    summary = {
+        'type': activity.type,
+        'started_at': _date(activity.started_at),
+        'completed_at': _date(activity.completed_at),
+        'total_time': sum(lap['total_time'] for lap in laps),
+        'distance': sum(lap['distance'] for lap in laps),
+        'calories': sum(lap['calories'] for lap in laps),
+        'laps': len(laps),
+        'trackpoints': sum(trackpoints),
+        'avg_heart_rate': sum(rate * count for rate, count in heart_rates) / float(weight) if weight else None,
+        'max_heart_rate': max([lap['max_heart_rate'] for lap in laps if lap['max_heart_rate']] or [None]),
+        'cells': list(zip(cells.tolist(), counts.tolist())),
+    }
+
+    return summary, laps
+
+def _summarize_file(path):
+    # runs in the workers: only the summaries are sent back
+    start = time.time()
+
+    try:
+        summary, laps = summarize(parse_from_file(path, cache=False))
+    except Exception as e:
+        return path, None, None, time.time() - start, '%s: %s' % (type(e).__name__, e)
+
+    return path, summary, laps, time.time() - start, None
+
+class Catalog:
+    COMMIT_INTERVAL = 100 # in files
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA foreign_keys = ON')
+
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != VERSION:
+            self.connection.executescript('DROP TABLE IF EXISTS cells; DROP TABLE IF EXISTS laps; DROP TABLE IF EXISTS activities; DROP TABLE IF EXISTS files;')
+            self.connection.execute('PRAGMA user_version = %d' % VERSION)
+
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def index(self, patterns, jobs=None, force=False):
+        # updates the catalog with the files, globs and directories given and
+        # removes the files that don't exist anymore, yields an IndexResult
+        # per file
+        known = dict(
+            (row['path'], (row['size'], row['mtime']))
+            for row in self.connection.execute('SELECT path, size, mtime FROM files')
+        )
+        stats = {}
+        changed = []
+
+        for filename, _ in collect_inputs(patterns):
+            path = os.path.abspath(filename)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            stats[path] = (stat.st_size, stat.st_mtime)
+
+            if force or known.get(path) != stats[path]:
+                changed.append(path)
+            else:
+                yield IndexResult(path, IndexResult.UNCHANGED, 0, 0, None)
+
+        for path in known:
+            if not os.path.exists(path):
+                with self.connection:
+                    self.connection.execute('DELETE FROM files WHERE path = ?', (path, ))
+
+                yield IndexResult(path, IndexResult.REMOVED, 0, 0, None)
+
+        # the files are stored by batches, a transaction per file would be
+        # much slower
+        try:
+            for i, (path, summary, laps, elapsed, error) in enumerate(map_unordered(_summarize_file, changed, jobs)):
+                self._store(path, stats[path], summary, laps, error)
+
+                if i % self.COMMIT_INTERVAL == self.COMMIT_INTERVAL - 1:
+                    self.connection.commit()
+
+                if error is not None:
+                    yield IndexResult(path, IndexResult.FAILED, 0, elapsed, error)
+                else:
+                    yield IndexResult(path, IndexResult.INDEXED, summary['trackpoints'], elapsed, None)
+        finally:
+            self.connection.commit()
+
+    def _store(self, path, stat, summary, laps, error):
+        # the failed files are stored too, so that they are only parsed again
+        # when they change
+        self.connection.execute('DELETE FROM files WHERE path = ?', (path, ))
+        cursor = self.connection.execute(
+            'INSERT INTO files (path, size, mtime, indexed_at, error) VALUES (?, ?, ?, ?, ?)',
+            (path, stat[0], stat[1], time.time(), error)
+        )
+
+        if error is not None:
+            return
+
+        file_id = cursor.lastrowid
+        self.connection.execute(
+            'INSERT INTO activities (file_id, %s) VALUES (?%s)' % (', '.join(ACTIVITY_COLUMNS), ', ?' * len(ACTIVITY_COLUMNS)),
+            [file_id] + [summary[name] for name in ACTIVITY_COLUMNS]
+        )
+        self.connection.executemany(
+            'INSERT INTO laps (file_id, %s) VALUES (?%s)' % (', '.join(LAP_COLUMNS), ', ?' * len(LAP_COLUMNS)),
+            [[file_id] + [lap[name] for name in LAP_COLUMNS] for lap in laps]
+        )
+        self.connection.executemany(
+            'INSERT INTO cells (cell, file_id, trackpoints) VALUES (?, ?, ?)',
+            [(cell, file_id, count) for cell, count in summary['cells']]
+        )
+
+    def _filters(self, since=None, until=None, type=None, min_distance=None, max_distance=None, bbox=None, near=None):
+        # since and until are dates (or datetimes) in UTC, until is excluded.
+        # bbox is (min_latitude, min_longitude, max_latitude, max_longitude)
+        # and near (latitude, longitude, radius in meters): the activities
+        # going through the cells of the grid covering them are kept.
+        conditions, parameters = [], []
+
+        for condition, value in (
+            ('started_at >= ?', since), ('started_at < ?', until), ('type = ? COLLATE NOCASE', type),
+            ('distance >= ?', min_distance), ('distance <= ?', max_distance),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value if not hasattr(value, 'strftime') else _date(value))
+
+        for area in (bbox, near and circle_bbox(*near)):
+            if area:
+                # the rows give a range of cells (which uses the index), then
+                # the columns are checked: the query doesn't grow with the area
+                first_cell, last_cell, columns = cell_bounds(*area)
+                conditions.append('file_id IN (SELECT file_id FROM cells WHERE cell BETWEEN ? AND ? AND (%s))' % (
+                    ' OR '.join(['cell %% %d BETWEEN ? AND ?' % COLUMNS] * len(columns))
+                ))
+                parameters.extend([first_cell, last_cell] + [column for column_range in columns for column in column_range])
+
+        return ' AND '.join(conditions) or '1', parameters
+
+    def activities(self, order='started_at', limit=None, exact=False, **filters):
+        # the summaries of the activities, as dicts with their path. With
+        # exact, the files of the activities found with bbox or near are
+        # parsed to only keep the ones with trackpoints in the area.
+        where, parameters = self._filters(**filters)
+        if order.lstrip('-') not in ACTIVITY_COLUMNS:
+            raise ValueError('Unknown order: ' + order)
+
+        query = 'SELECT files.path, activities.* FROM activities JOIN files ON files.id = activities.file_id WHERE %s ORDER BY %s %s' % (
+            where, order.lstrip('-'), 'DESC' if order.startswith('-') else 'ASC'
+        )
+        if limit is not None and not exact:
+            query += ' LIMIT %d' % limit
+
+        rows = [self._row(row) for row in self.connection.execute(query, parameters)]
+
+        if exact and (filters.get('bbox') or filters.get('near')):
+            rows = [row for row in rows if self._in_area(row['path'], filters.get('bbox'), filters.get('near'))]
+
+        return rows[:limit] if limit is not None else rows
+
+    def _in_area(self, path, bbox, near):
+        try:
+            index = TrackIndex.from_activity(parse_from_file(path))
+        except Exception:
+            return False
+
+        if bbox and not len(index.in_bbox(*bbox)):
+            return False
+
+        return not near or len(index.near(*near)) > 0
+
+    def laps(self, path):
+        rows = self.connection.execute(
+            'SELECT laps.* FROM laps JOIN files ON files.id = laps.file_id WHERE files.path = ? ORDER BY number',
+            (os.path.abspath(path), )
+        )
+
+        return [self._row(row) for row in rows]
+
+    def totals(self, by=None, **filters):
+        # the number of activities, their time, distance and calories, in
+        # total or by period (see PERIODS)
+        where, parameters = self._filters(**filters)
+        group = PERIODS[by] if by is not None else "'total'"
+
+        rows = self.connection.execute(
+            'SELECT %s AS period, COUNT(*) AS activities, SUM(total_time) AS total_time, SUM(distance) AS distance, SUM(calories) AS calories '
+            'FROM activities WHERE %s GROUP BY period ORDER BY period' % (group, where),
+            parameters
+        )
+
+        return [self._row(row) for row in rows]
+
+    def failures(self):
+        rows = self.connection.execute('SELECT path, error FROM files WHERE error IS NOT NULL ORDER BY path')
+
+        return [self._row(row) for row in rows]
+
+    def _row(self, row):
+        row = dict(zip(row.keys(), row))
+        row.pop('file_id', None)
+
+        return row
+
+def default_catalog_path():
+    return os.environ.get('RUNNER_CATALOG') or os.path.join(os.path.expanduser('~'), '.runner', 'catalog.sqlite')
@@ -1,31 +1,145 @@
 #!/usr/bin/env python
 
-import os
+import io, tempfile
+
+import runner.formats as formats
+import runner.model as model
+from runner.events import activities_from_events
+from runner.timestamp import format_timestamp, format_timestamps
+
+# number of timestamps formatted at once for columnar trackpoints
+TIMESTAMPS_CHUNK_SIZE = 4096
+# number of decimals of the coordinates in the text formats, 5 is about a
+# meter
+DEFAULT_PRECISION = 16
 
 def dump_date(date):
-    return date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    return format_timestamp(date)
+
+def with_dumped_dates(trackpoints):
+    # yields (trackpoint, formatted time) pairs
+    if isinstance(trackpoints, model.TrackpointColumns):
+        times = trackpoints.column('time')
+
+        for start in range(0, len(times), TIMESTAMPS_CHUNK_SIZE):
+            dates = format_timestamps(times[start:start + TIMESTAMPS_CHUNK_SIZE])
+
+            for i, date in enumerate(dates):
+                yield trackpoints[start + i], date
+    else:
+        for trackpoint in trackpoints:
+            yield trackpoint, dump_date(trackpoint.time)
+
+def stream_writer(stream):
+    # returns a function writing text chunks to a text or binary stream
+    mode = getattr(stream, 'mode', 'b') # an integer for gzip files
+
+    if isinstance(stream, io.TextIOBase) or (isinstance(mode, str) and 'b' not in mode):
+        return stream.write
+
+    return lambda chunk: stream.write(chunk.encode('utf-8'))
 
 class DumperNotFoundError(RuntimeError):
     pass
 
-class GPXDumper:
+class XMLDumper:
     TAB = '  '
 
+    def __init__(self, precision=None):
+        self.precision = DEFAULT_PRECISION if precision is None else precision
+
     def dump(self, activity):
-        buffer = []
+        buffer = io.StringIO()
 
-        buffer.append('<?xml version="1.0" encoding="UTF-8"?>\n')
-        buffer.append(self._dump_training_database(activity))
+        self.dump_to_stream(activity, buffer)
 
-        return ''.join(buffer)
+        return buffer.getvalue()
 
     def dump_to_file(self, activity, filename):
-        open(filename, 'w').write(self.dump(activity))
+        with formats.open_file(filename, 'w') as output:
+            self.dump_to_stream(activity, output)
 
-    def _dump_training_database(self, activity):
-        buffer = []
+    def dump_events_to_file(self, events, filename):
+        with formats.open_file(filename, 'w') as output:
+            self.dump_events(events, output)
+
+    def dump_to_stream(self, activity, stream):
+        raise NotImplementedError()
 
-        buffer.append("""<gpx version="1.1" creator="runner" xsi:schemaLocation="http://www.topografix.com/GPX/1/1
+    def dump_trackpoints(self, trackpoints, stream, activity_type=None):
+        raise NotImplementedError()
+
+    def dump_events(self, events, stream):
+        # dumps the first activity of a stream of events (see runner.events)
+        raise NotImplementedError()
+
+class GPXDumper(XMLDumper):
+    def dump_to_stream(self, activity, stream):
+        write = stream_writer(stream)
+
+        self._dump_header(activity.identifier, write)
+        for lap in activity.laps:
+            self._dump_lap(lap.trackpoints, write)
+        self._dump_footer(write)
+
+    def dump_trackpoints(self, trackpoints, stream, activity_type=None):
+        write = stream_writer(stream)
+        trackpoints = iter(trackpoints)
+        first = next(trackpoints, None)
+
+        self._dump_header(None if first is None else first.time, write)
+        if first is not None:
+            self._dump_lap(self._chain(first, trackpoints), write)
+        self._dump_footer(write)
+
+    def dump_events(self, events, stream):
+        write = stream_writer(stream)
+        header_written = lap_opened = False
+
+        for event, item in events:
+            if event == 'trackpoint':
+                # the identifier of the activity is the start time of its
+                # first lap, or the time of its first point
+                if not header_written:
+                    self._dump_header(item.time, write)
+                    header_written = True
+
+                if not lap_opened:
+                    write(self._dump_lap_header())
+                    lap_opened = True
+
+                write(self._dump_trackpoint(item, dump_date(item.time)))
+            elif event == 'start_lap':
+                lap_opened = False
+
+                if not header_written and item.start_time is not None:
+                    self._dump_header(item.start_time, write)
+                    header_written = True
+            elif event == 'end_lap':
+                if not header_written:
+                    self._dump_header(None, write)
+                    header_written = True
+
+                if not lap_opened:
+                    write(self._dump_lap_header())
+
+                write(self._dump_lap_footer())
+            elif event == 'end_activity':
+                if not header_written:
+                    self._dump_header(None, write)
+
+                self._dump_footer(write)
+                break
+
+    def _chain(self, first, trackpoints):
+        yield first
+
+        for trackpoint in trackpoints:
+            yield trackpoint
+
+    def _dump_header(self, identifier, write):
+        write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        write("""<gpx version="1.1" creator="runner" xsi:schemaLocation="http://www.topografix.com/GPX/1/1
                                 http://www.topografix.com/GPX/1/1/gpx.xsd
                                 http://www.garmin.com/xmlschemas/GpxExtensions/v3
                                 http://www.garmin.com/xmlschemas/GpxExtensionsv3.xsd
@@ -37,77 +151,166 @@ class GPXDumper:
     xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
 """)
 
-        buffer.append(self._dump_metadata(activity))
-        buffer.append(self._dump_activity(activity))
-        buffer.append('</gpx>')
+        if identifier is not None:
+            write(self._dump_metadata(identifier))
 
-        return ''.join(buffer)
+    def _dump_footer(self, write):
+        write('</gpx>')
 
-    def _dump_metadata(self, activity):
+    def _dump_metadata(self, identifier):
         buffer = []
 
         buffer.append(self.TAB + '<metadata>\n')
-        buffer.append(2*self.TAB + '<time>%s</time>\n' % dump_date(activity.identifier))
+        buffer.append(2*self.TAB + '<time>%s</time>\n' % dump_date(identifier))
         buffer.append(self.TAB + '</metadata>\n')
 
         return ''.join(buffer)
 
-    def _dump_activity(self, activity):
-        buffer = []
+    def _dump_lap(self, trackpoints, write):
+        write(self._dump_lap_header())
 
-        for lap in activity.laps:
-            buffer.append(self._dump_lap(lap))
+        for trackpoint, date in with_dumped_dates(trackpoints):
+            write(self._dump_trackpoint(trackpoint, date))
 
-        return ''.join(buffer)
+        write(self._dump_lap_footer())
 
-    def _dump_lap(self, lap):
-        buffer = []
+    def _dump_lap_header(self):
+        return self.TAB + '<trk>\n' + 2*self.TAB + '<trkseg>\n'
 
-        buffer.append(self.TAB + '<trk>\n')
-        buffer.append(2*self.TAB + '<trkseg>\n')
-
-        for trackpoint in lap.trackpoints:
-            buffer.append(self._dump_trackpoint(trackpoint))
-
-        buffer.append(2*self.TAB + '</trkseg>\n')
-        buffer.append(self.TAB + '</trk>\n')
-
-        return ''.join(buffer)
+    def _dump_lap_footer(self):
+        return 2*self.TAB + '</trkseg>\n' + self.TAB + '</trk>\n'
 
-    def _dump_trackpoint(self, trackpoint):
+    def _dump_trackpoint(self, trackpoint, date):
         buffer = []
 
-        attrs = '' if trackpoint.position is None else ' lat="%.16f" lon="%.16f"' % (trackpoint.position.latitude, trackpoint.position.longitude)
+        attrs = '' if trackpoint.position is None else ' lat="%.*f" lon="%.*f"' % (
+            self.precision, trackpoint.position.latitude, self.precision, trackpoint.position.longitude
+        )
 
         buffer.append(3*self.TAB + '<trkpt%s>\n' % attrs)
-        buffer.append(4*self.TAB + '<time>%s</time>\n' % dump_date(trackpoint.time))
         buffer.append(4*self.TAB + '<ele>%d</ele>\n' % trackpoint.altitude)
-        buffer.append(4*self.TAB + '<gpxtpx:TrackPointExtension>\n')
-        buffer.append(5*self.TAB + '<gpxtpx:hr>%d</gpxtpx:hr>\n' % trackpoint.heart_rate)
-        buffer.append(4*self.TAB + '</gpxtpx:TrackPointExtension>\n')
+        buffer.append(4*self.TAB + '<time>%s</time>\n' % date)
+        buffer.append(4*self.TAB + '<extensions>\n')
+        buffer.append(5*self.TAB + '<gpxtpx:TrackPointExtension>\n')
+        buffer.append(6*self.TAB + '<gpxtpx:hr>%d</gpxtpx:hr>\n' % trackpoint.heart_rate)
+        buffer.append(5*self.TAB + '</gpxtpx:TrackPointExtension>\n')
+        buffer.append(4*self.TAB + '</extensions>\n')
         buffer.append(3*self.TAB + '</trkpt>\n')
 
         return ''.join(buffer)
 
 
-class TCXDumper:
-    TAB = '  '
-
-    def dump(self, activity):
-        buffer = []
+class TCXDumper(XMLDumper):
+    # trackpoints of a lap whose summary isn't known yet are kept in memory
+    # up to this size, then on disk
+    SPOOL_SIZE = 4 * 1024 * 1024
 
-        buffer.append('<?xml version="1.0" encoding="UTF-8"?>\n')
-        buffer.append(self._dump_training_database(activity))
-
-        return ''.join(buffer)
-
-    def dump_to_file(self, activity, filename):
-        open(filename, 'w').write(self.dump(activity))
+    def dump_to_stream(self, activity, stream):
+        write = stream_writer(stream)
 
-    def _dump_training_database(self, activity):
-        buffer = []
-
-        buffer.append("""<TrainingCenterDatabase
+        self._dump_header(activity.identifier, activity.type, write)
+        for lap in activity.laps:
+            self._dump_lap(lap, write)
+        self._dump_footer(write)
+
+    def dump_trackpoints(self, trackpoints, stream, activity_type=None):
+        write = stream_writer(stream)
+        spool = tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE, mode='w+')
+        summary = model.TrackpointsSummary()
+
+        # the lap summary precedes the track: the trackpoints are spooled
+        # while the summary is computed
+        with spool:
+            for trackpoint, date in with_dumped_dates(trackpoints):
+                summary.add_trackpoint(trackpoint)
+                spool.write(self._dump_trackpoint(trackpoint, date))
+
+            self._dump_header(summary.start_time, activity_type, write)
+
+            if summary.count:
+                write(self._dump_lap_header(
+                    summary.start_time, summary.duration, summary.distance,
+                    0, 0, summary.avg_heart_rate, summary.max_heart_rate, None
+                ))
+
+                spool.seek(0)
+                for chunk in iter(lambda: spool.read(64 * 1024), ''):
+                    write(chunk)
+
+                write(self._dump_lap_footer())
+
+            self._dump_footer(write)
+
+    def dump_events(self, events, stream):
+        write = stream_writer(stream)
+        activity_type = None
+        header_written = False
+        lap = summary = spool = None
+
+        for event, item in events:
+            if event == 'trackpoint':
+                summary.add_trackpoint(item)
+                chunk = self._dump_trackpoint(item, dump_date(item.time))
+
+                if spool is None:
+                    write(chunk)
+                else:
+                    spool.write(chunk)
+            elif event == 'start_lap':
+                lap, summary = item, model.TrackpointsSummary()
+
+                if self._has_summary(lap):
+                    if not header_written:
+                        self._dump_header(lap.start_time, activity_type, write)
+                        header_written = True
+
+                    write(self._dump_streamed_lap_header(lap, summary))
+                else:
+                    # the values missing from the lap summary are computed
+                    # from its trackpoints, which are spooled meanwhile
+                    spool = tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE, mode='w+')
+            elif event == 'end_lap':
+                if spool is not None:
+                    if not header_written:
+                        self._dump_header(lap.start_time or summary.start_time, activity_type, write)
+                        header_written = True
+
+                    write(self._dump_streamed_lap_header(lap, summary))
+
+                    with spool:
+                        spool.seek(0)
+                        for chunk in iter(lambda: spool.read(64 * 1024), ''):
+                            write(chunk)
+                    spool = None
+
+                write(self._dump_lap_footer())
+            elif event == 'start_activity':
+                activity_type = item.type
+            elif event == 'end_activity':
+                if not header_written:
+                    self._dump_header(None, activity_type, write)
+
+                self._dump_footer(write)
+                break
+
+    def _has_summary(self, lap):
+        # whether the lap summary can be dumped without its trackpoints
+        return lap.start_time is not None and lap.avg_heart_rate != 0 and lap.max_heart_rate != 0
+
+    def _dump_streamed_lap_header(self, lap, summary):
+        # same values as for a lap in memory: the missing ones come from the
+        # trackpoints
+        return self._dump_lap_header(
+            lap.start_time or summary.start_time, lap.duration, lap.distance,
+            lap.calories, lap.max_speed,
+            lap.avg_heart_rate or summary.avg_heart_rate,
+            lap.max_heart_rate or summary.max_heart_rate,
+            lap.trigger_method
+        )
+
+    def _dump_header(self, identifier, activity_type, write):
+        write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        write("""<TrainingCenterDatabase
     xsi:schemaLocation="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd"
     xmlns:ns5="http://www.garmin.com/xmlschemas/ActivityGoals/v1"
     xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2"
@@ -116,61 +319,56 @@ class TCXDumper:
     xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
     xmlns:ns4="http://www.garmin.com/xmlschemas/ProfileExtension/v1">
 """)
+        write(self.TAB + '<Activities>\n')
+        write(2*self.TAB + '<Activity Sport="%s">\n' % ("Running" if activity_type is None else activity_type))
 
-        buffer.append(self._dump_activities(activity))
-        buffer.append('</TrainingCenterDatabase>')
+        if identifier is not None:
+            write(3*self.TAB + '<Id>%s</Id>\n' % dump_date(identifier))
 
-        return ''.join(buffer)
+    def _dump_footer(self, write):
+        write(2*self.TAB + '</Activity>\n')
+        write(self.TAB + '</Activities>\n')
+        write('</TrainingCenterDatabase>')
 
-    def _dump_activities(self, activity):
-        buffer = []
+    def _dump_lap(self, lap, write):
+        write(self._dump_lap_header(
+            lap.start_time, lap.duration, lap.distance, lap.calories,
+            lap.max_speed, lap.avg_heart_rate, lap.max_heart_rate,
+            lap.trigger_method
+        ))
 
-        buffer.append(self.TAB + '<Activities>\n')
+        for trackpoint, date in with_dumped_dates(lap.trackpoints):
+            write(self._dump_trackpoint(trackpoint, date))
 
-        buffer.append(self._dump_activity(activity))
+        write(self._dump_lap_footer())
 
-        buffer.append(self.TAB + '</Activities>\n')
-
-        return ''.join(buffer)
-
-    def _dump_activity(self, activity):
+    def _dump_lap_header(self, start_time, duration, distance, calories,
+                         max_speed, avg_heart_rate, max_heart_rate,
+                         trigger_method):
         buffer = []
 
-        buffer.append(2*self.TAB + '<Activity Sport="%s">\n' % "Running" if activity.type is None else activity.type)
-        buffer.append(3*self.TAB + '<Id>%s</Id>\n' % dump_date(activity.identifier))
-        for lap in activity.laps:
-            buffer.append(self._dump_lap(lap))
-        buffer.append(2*self.TAB + '</Activity>\n')
-
-        return ''.join(buffer)
-
-    def _dump_lap(self, lap):
-        buffer = []
-
-        buffer.append(3*self.TAB + '<Lap StartTime="%s">\n' % dump_date(lap.start_time))
-        buffer.append(4*self.TAB + '<TotalTimeSeconds>%d</TotalTimeSeconds>\n' % lap.duration)
-        buffer.append(4*self.TAB + '<DistanceMeters>%d</DistanceMeters>\n' % lap.distance)
-        buffer.append(4*self.TAB + '<Calories>%d</Calories>\n' % lap.calories)
-        buffer.append(4*self.TAB + '<MaximumSpeed>%f</MaximumSpeed>\n' % lap.max_speed)
-        buffer.append(4*self.TAB + '<AverageHeartRateBpm><Value>%d</Value></AverageHeartRateBpm>\n' % lap.avg_heart_rate)
-        buffer.append(4*self.TAB + '<MaximumHeartRateBpm><Value>%d</Value></MaximumHeartRateBpm>\n' % lap.max_heart_rate)
-        if lap.trigger_method is not None:
-            buffer.append(4*self.TAB + '<TriggerMethod>%s</TriggerMethod>\n' % lap.trigger_method)
+        buffer.append(3*self.TAB + '<Lap StartTime="%s">\n' % dump_date(start_time))
+        buffer.append(4*self.TAB + '<TotalTimeSeconds>%d</TotalTimeSeconds>\n' % duration)
+        buffer.append(4*self.TAB + '<DistanceMeters>%d</DistanceMeters>\n' % distance)
+        buffer.append(4*self.TAB + '<Calories>%d</Calories>\n' % calories)
+        buffer.append(4*self.TAB + '<MaximumSpeed>%f</MaximumSpeed>\n' % max_speed)
+        buffer.append(4*self.TAB + '<AverageHeartRateBpm><Value>%d</Value></AverageHeartRateBpm>\n' % avg_heart_rate)
+        buffer.append(4*self.TAB + '<MaximumHeartRateBpm><Value>%d</Value></MaximumHeartRateBpm>\n' % max_heart_rate)
+        if trigger_method is not None:
+            buffer.append(4*self.TAB + '<TriggerMethod>%s</TriggerMethod>\n' % trigger_method)
 
         buffer.append(4*self.TAB + '<Track>\n')
-        for trackpoint in lap.trackpoints:
-            buffer.append(self._dump_trackpoint(trackpoint))
-        buffer.append(4*self.TAB + '</Track>\n')
-
-        buffer.append(3*self.TAB + '</Lap>\n')
 
         return ''.join(buffer)
 
-    def _dump_trackpoint(self, trackpoint):
+    def _dump_lap_footer(self):
+        return 4*self.TAB + '</Track>\n' + 3*self.TAB + '</Lap>\n'
+
+    def _dump_trackpoint(self, trackpoint, date):
         buffer = []
 
         buffer.append(5*self.TAB + '<Trackpoint>\n')
-        buffer.append(6*self.TAB + '<Time>%s</Time>\n' % dump_date(trackpoint.time))
+        buffer.append(6*self.TAB + '<Time>%s</Time>\n' % date)
         buffer.append(6*self.TAB + '<DistanceMeters>%d</DistanceMeters>\n' % trackpoint.distance)
         buffer.append(6*self.TAB + '<AltitudeMeters>%d</AltitudeMeters>\n' % trackpoint.altitude)
         buffer.append(6*self.TAB + '<HeartRateBpm><Value>%d</Value></HeartRateBpm>\n' % trackpoint.heart_rate)
@@ -186,27 +384,71 @@ class TCXDumper:
         buffer = []
 
         buffer.append(6*self.TAB + '<Position>\n')
-        buffer.append(7*self.TAB + '<LatitudeDegrees>%.16f</LatitudeDegrees>\n' % position.latitude)
-        buffer.append(7*self.TAB + '<LongitudeDegrees>%.16f</LongitudeDegrees>\n' % position.longitude)
+        buffer.append(7*self.TAB + '<LatitudeDegrees>%.*f</LatitudeDegrees>\n' % (self.precision, position.latitude))
+        buffer.append(7*self.TAB + '<LongitudeDegrees>%.*f</LongitudeDegrees>\n' % (self.precision, position.longitude))
         buffer.append(6*self.TAB + '</Position>\n')
 
         return ''.join(buffer)
 
-def dumper_for_file(filename):
-    parsers_map = {
-        'tcx': TCXDumper,
-        'gpx': GPXDumper
-    }
+class BinaryDumper:
+    def __init__(self, precision=None):
+        # the coordinates are written at the precision of the format
+        if precision is not None:
+            raise ValueError('The precision of the coordinates can only be set for the text formats')
 
-    _, extension = os.path.splitext(filename)
-    extension = extension[1:] # remove the leading '.'
+    def dump(self, activity):
+        buffer = io.BytesIO()
 
-    try:
-        return parsers_map[extension]()
-    except KeyError:
+        self.dump_to_stream(activity, buffer)
+
+        return buffer.getvalue()
+
+    def dump_to_file(self, activity, filename):
+        with formats.open_file(filename, 'wb') as output:
+            self.dump_to_stream(activity, output)
+
+    def dump_events_to_file(self, events, filename):
+        with formats.open_file(filename, 'wb') as output:
+            self.dump_events(events, output)
+
+    def dump_to_stream(self, activity, stream):
+        raise NotImplementedError()
+
+    def dump_events(self, events, stream):
+        # the binary formats need the whole activity
+        for activity in activities_from_events(events):
+            self.dump_to_stream(activity, stream)
+            break
+
+class FITDumper(BinaryDumper):
+    def dump_to_stream(self, activity, stream):
+        # the binary formats are only imported when they are written
+        import runner.fit as fit
+
+        fit.write_activity(activity, stream)
+
+class NativeDumper(BinaryDumper):
+    def dump_to_stream(self, activity, stream):
+        import runner.native as native
+
+        native.write_activity(activity, stream)
+
+def dumper_for_file(filename, **options):
+    extension, _ = formats.split_extension(filename)
+
+    dumper = formats.dumpers.get(extension)
+
+    if dumper is None:
         raise DumperNotFoundError('Not dumper for extension: ' + extension)
 
-def dump_to_file(activity, filename):
-    dumper = dumper_for_file(filename)
+    return dumper(**options)
+
+def dump_to_file(activity, filename, **options):
+    dumper = dumper_for_file(filename, **options)
 
     return dumper.dump_to_file(activity, filename)
+
+def dump_events_to_file(events, filename, **options):
+    dumper = dumper_for_file(filename, **options)
+
+    return dumper.dump_events_to_file(events, filename)
@@ -3,8 +3,37 @@
 import operator, re
 from datetime import timedelta
 
+import numpy
+
+import runner.model as model
+from runner.analytics import cumulative_distance
+from runner.spatial import distances
+from runner.timestamp import ns_to_datetime
+
+TIME_REGEX = r'(?P<sign>(\+|\-)?)((?P<hours>\d+?)hour)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?'
+
+DEFAULT_RADIUS = 25 # in meters
+
+def parse_time_delta(string):
+    # '+1hour5m' gives (operator.add, timedelta(hours=1, minutes=5))
+    parts = re.match(TIME_REGEX, string)
+
+    if not parts:
+        raise RuntimeError('Invalid time delta given: ' + string)
+
+    parts = parts.groupdict()
+    sign = operator.sub if parts['sign'] == '-' else operator.add
+    del parts['sign']
+
+    time_params = {}
+    for (name, param) in parts.items():
+        if param:
+            time_params[name] = int(param)
+
+    return sign, timedelta(**time_params)
+
 class TimeEditor:
-    TIME_REGEX = r'(?P<sign>(\+|\-)?)((?P<hours>\d+?)hour)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?'
+    TIME_REGEX = TIME_REGEX
 
     @classmethod
     def configure_args_parser(cls, parser):
@@ -18,25 +47,178 @@ class TimeEditor:
         operator, delta = self._parse_time_delta(options.time)
 
         for lap in activity.laps:
-            lap.start_time = operator(lap.start_time, delta)
+            self._edit_lap(lap, operator, delta)
 
             for trackpoint in lap.trackpoints:
-                trackpoint.time = operator(trackpoint.time, delta)
+                self._edit_trackpoint(trackpoint, operator, delta)
+
+    def edit_events(self, events, options):
+        # edits a stream of events (see runner.events) as it flows
+        operator, delta = self._parse_time_delta(options.time)
+
+        for event, item in events:
+            if event == 'trackpoint':
+                self._edit_trackpoint(item, operator, delta)
+            elif event == 'start_lap':
+                self._edit_lap(item, operator, delta)
+
+            yield event, item
+
+    def _edit_lap(self, lap, operator, delta):
+        # without trackpoints yet, a streamed lap may not have a start time
+        if lap.start_time is not None:
+            lap.start_time = operator(lap.start_time, delta)
+
+    def _edit_trackpoint(self, trackpoint, operator, delta):
+        trackpoint.time = operator(trackpoint.time, delta)
 
     def _parse_time_delta(self, string):
-        regex = re.compile(TimeEditor.TIME_REGEX)
-        parts = regex.match(string)
+        return parse_time_delta(string)
+
+class LapEditor:
+    # splits the whole activity again into laps of a given distance or
+    # duration, or at each pass through a position. The laps need the whole
+    # activity: they can't be edited as a stream.
+    @classmethod
+    def configure_args_parser(cls, parser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument(
+            '-d', '--distance', type=float, default=None,
+            help='Length of the laps (in km).',
+        )
+        group.add_argument(
+            '-t', '--time', type=str, default=None,
+            help='Duration of the laps (5m, 1hour...).',
+        )
+        group.add_argument(
+            '-p', '--position', type=float, nargs=2, default=None, metavar=('LAT', 'LON'),
+            help='Start a new lap each time the track goes through this position.',
+        )
+        parser.add_argument(
+            '-r', '--radius', type=float, default=DEFAULT_RADIUS,
+            help='With --position, distance (in meters) under which the track goes through the position.',
+        )
+        parser.set_defaults(editor=lambda: LapEditor())
+
+    def edit(self, activity, options):
+        arrays = activity.to_arrays()
+        order = numpy.argsort(arrays['time'], kind='mergesort')
+        arrays = dict((name, values[order]) for name, values in arrays.items())
+
+        if not len(order):
+            return
+
+        if options.distance is not None:
+            if options.distance <= 0:
+                raise RuntimeError('Invalid lap distance given: %s' % options.distance)
+
+            distance = cumulative_distance(arrays['distance'], arrays['latitude'], arrays['longitude'])
+            starts, trigger_method = split_by_distance(distance, options.distance * 1000), 'Distance'
+        elif options.time is not None:
+            seconds = parse_time_delta(options.time)[1].total_seconds()
+
+            if seconds <= 0:
+                raise RuntimeError('Invalid lap duration given: ' + options.time)
+
+            starts, trigger_method = split_by_time((arrays['time'] - arrays['time'][0]) / 1e9, seconds), 'Time'
+        else:
+            latitude, longitude = options.position
+            starts = split_by_position(arrays['latitude'], arrays['longitude'], latitude, longitude, options.radius)
+            trigger_method = 'Location'
+
+        activity.laps = build_laps(arrays, starts, trigger_method, activity.calories)
+
+def _split(values, step):
+    # first trackpoint at or after each multiple of step, values being sorted
+    targets = numpy.arange(1, int(numpy.ceil(values[-1] / step))) * step
+    starts = numpy.searchsorted(values, targets, side='left')
+
+    return numpy.unique(numpy.r_[0, starts[starts < len(values)]])
+
+def split_by_distance(distance, length):
+    # the indices of the first trackpoints of laps of length meters, the
+    # cumulative distance being sorted
+    return _split(distance, length)
+
+def split_by_time(time, duration):
+    # the indices of the first trackpoints of laps of duration seconds
+    return _split(time, duration)
+
+def split_by_position(latitudes, longitudes, latitude, longitude, radius=DEFAULT_RADIUS):
+    # the indices of the first trackpoints of the laps starting each time the
+    # track goes at most radius meters away from the position. The track has
+    # to go more than twice as far before the next lap, so that the GPS noise
+    # around the position doesn't start several laps.
+    away = distances(latitude, longitude, latitudes, longitudes)
+    events = numpy.where(away <= radius, 1, numpy.where(away > 2 * radius, -1, 0))
+
+    # state of each trackpoint: the last event before it (unknown positions
+    # and the ones between the two radiuses don't change it)
+    last = numpy.maximum.accumulate(numpy.where(events != 0, numpy.arange(len(events)), 0))
+    state = events[last]
+
+    inside = numpy.r_[state == 1, False]
+    entries = numpy.flatnonzero(inside[1:-1] & ~inside[:-2]) + 1
+    exits = numpy.flatnonzero(inside[:-1] & ~inside[1:]) + 1
+
+    # a lap starts at the closest trackpoint of each pass coming from away
+    starts = [
+        start + int(numpy.nanargmin(away[start:end]))
+        for start, end in zip(entries, exits[exits > entries[0]] if len(entries) else [])
+        if state[start - 1] == -1
+    ]
+
+    return numpy.unique(numpy.r_[0, numpy.asarray(starts, dtype='int64')])
+
+def build_laps(arrays, starts, trigger_method=None, calories=0):
+    # laps of the sorted trackpoint arrays, each one going from its first
+    # trackpoint to the first one of the next lap. Their statistics are
+    # computed for all the laps at once, the calories are shared by distance
+    # (or by duration without distance).
+    starts = numpy.asarray(starts, dtype='int64')
+    ends = numpy.r_[starts[1:], len(arrays['time'])]
+
+    time = (arrays['time'] - arrays['time'][0]) / 1e9
+    distance = cumulative_distance(arrays['distance'], arrays['latitude'], arrays['longitude'])
+    heart_rate = arrays['heart_rate']
+
+    durations = numpy.diff(numpy.r_[time[starts], time[-1]])
+    lengths = numpy.diff(numpy.r_[distance[starts], distance[-1]])
+
+    # speed from each trackpoint to the next one
+    steps = numpy.diff(time)
+    speeds = numpy.r_[numpy.diff(distance) / numpy.where(steps > 0, steps, numpy.inf), 0]
+    max_speeds = numpy.maximum.reduceat(speeds, starts)
+
+    known = heart_rate > 0
+    heart_rate_sums = numpy.add.reduceat(numpy.where(known, heart_rate, 0).astype('int64'), starts)
+    heart_rate_counts = numpy.add.reduceat(known.astype('int64'), starts)
+    max_heart_rates = numpy.maximum.reduceat(heart_rate, starts)
+
+    shares = lengths if lengths.sum() > 0 else durations
+    total = shares.sum()
+    # rounded on the cumulative sum, so that the total is kept
+    shared = numpy.round(numpy.cumsum(shares) * calories / total) if total > 0 else numpy.zeros(len(starts))
+    lap_calories = numpy.diff(numpy.r_[0, shared]).astype('int64')
+
+    laps = []
+
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        lap = model.Lap(ns_to_datetime(int(arrays['time'][start])))
+        lap.trackpoints = model.TrackpointColumns.from_arrays(dict(
+            (name, arrays[name][start:end]) for name, _ in model.TrackpointColumns.COLUMNS
+        ))
 
-        if not parts:
-            raise RuntimeError('Invalid time delta given: ' + string)
+        lap.duration = float(durations[i])
+        lap.distance = float(lengths[i])
+        lap.max_speed = float(max_speeds[i])
+        lap.calories = int(lap_calories[i])
+        lap.max_heart_rate = int(max_heart_rates[i])
+        lap.avg_heart_rate = heart_rate_sums[i] / float(heart_rate_counts[i]) if heart_rate_counts[i] else 0
 
-        parts = parts.groupdict()
-        sign = operator.sub if parts['sign'] == '-' else operator.add
-        del parts['sign']
+        if trigger_method is not None:
+            lap.trigger_method = trigger_method
 
-        time_params = {}
-        for (name, param) in parts.items():
-            if param:
-                time_params[name] = int(param)
+        laps.append(lap)
 
-        return sign, timedelta(**time_params)
+    return laps
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+# Activities as streams of (event, item) pairs, as given by the streaming
+# parsers:
+#
+#   ('start_activity', activity)
+#     ('start_lap', lap)
+#       ('trackpoint', trackpoint)...
+#     ('end_lap', lap)
+#   ('end_activity', activity)
+#
+# The activity and laps given with the events don't hold their laps and
+# trackpoints.
+
+import copy
+
+import runner.model as model
+
+def activity_events(activity):
+    # events of an activity that is already in memory
+    empty_activity = copy.copy(activity)
+    empty_activity.laps = []
+
+    yield 'start_activity', empty_activity
+
+    for lap in activity.laps:
+        empty_lap = copy.copy(lap)
+        empty_lap.trackpoints = model.TrackpointColumns()
+
+        yield 'start_lap', empty_lap
+
+        for trackpoint in lap.trackpoints:
+            yield 'trackpoint', trackpoint
+
+        yield 'end_lap', empty_lap
+
+    yield 'end_activity', empty_activity
+
+def activities_from_events(events):
+    activity = lap = None
+
+    for event, item in events:
+        if event == 'trackpoint':
+            lap.trackpoints.append(item)
+        elif event == 'start_lap':
+            lap = item
+        elif event == 'end_lap':
+            activity.laps.append(lap)
+        elif event == 'start_activity':
+            activity = item
+        elif event == 'end_activity':
+            yield activity
@@ -0,0 +1,627 @@
+#!/usr/bin/env python
+
+# Minimal FIT decoder: only the messages and fields listed in the profile
+# are decoded, the other messages are skipped using the size given by their
+# definition.
+
+import struct
+from datetime import datetime, timedelta
+
+import numpy
+
+from runner.timestamp import datetime_to_ns
+
+# seconds between the unix epoch and the FIT epoch (1989-12-31 00:00 UTC)
+FIT_EPOCH = 631065600
+
+SEMICIRCLES = 2 ** 31 / 180.0
+
+TIMESTAMP_FIELD = 253
+
+# global message number: (name, {field number: (name, scale, offset)})
+PROFILE = {
+    0: ('file_id', {
+        0: ('type', 1, 0),
+        1: ('manufacturer', 1, 0),
+        2: ('product', 1, 0),
+        3: ('serial_number', 1, 0),
+        4: ('time_created', 1, 0),
+    }),
+    18: ('session', {
+        253: ('timestamp', 1, 0),
+        2: ('start_time', 1, 0),
+        5: ('sport', 1, 0),
+        7: ('total_elapsed_time', 1000, 0),
+        8: ('total_timer_time', 1000, 0),
+        9: ('total_distance', 100, 0),
+        11: ('total_calories', 1, 0),
+        26: ('num_laps', 1, 0),
+    }),
+    19: ('lap', {
+        254: ('message_index', 1, 0),
+        253: ('timestamp', 1, 0),
+        2: ('start_time', 1, 0),
+        7: ('total_elapsed_time', 1000, 0),
+        8: ('total_timer_time', 1000, 0),
+        9: ('total_distance', 100, 0),
+        11: ('total_calories', 1, 0),
+        14: ('max_speed', 1000, 0),
+        15: ('avg_heart_rate', 1, 0),
+        16: ('max_heart_rate', 1, 0),
+        24: ('lap_trigger', 1, 0),
+        25: ('sport', 1, 0),
+        111: ('enhanced_max_speed', 1000, 0),
+    }),
+    20: ('record', {
+        253: ('timestamp', 1, 0),
+        0: ('position_lat', SEMICIRCLES, 0),
+        1: ('position_long', SEMICIRCLES, 0),
+        2: ('altitude', 5, 500),
+        3: ('heart_rate', 1, 0),
+        5: ('distance', 100, 0),
+        6: ('speed', 1000, 0),
+        73: ('enhanced_speed', 1000, 0),
+        78: ('enhanced_altitude', 5, 500),
+    }),
+    34: ('activity', {
+        253: ('timestamp', 1, 0),
+        0: ('total_timer_time', 1000, 0),
+        1: ('num_sessions', 1, 0),
+        2: ('type', 1, 0),
+    }),
+}
+
+MESSAGES_NUMBERS = dict((name, number) for number, (name, _) in PROFILE.items())
+
+# base type number: (struct format, size, invalid value)
+BASE_TYPES = {
+    0x00: ('B', 1, 0xFF), # enum
+    0x01: ('b', 1, 0x7F),
+    0x02: ('B', 1, 0xFF),
+    0x03: ('h', 2, 0x7FFF),
+    0x04: ('H', 2, 0xFFFF),
+    0x05: ('i', 4, 0x7FFFFFFF),
+    0x06: ('I', 4, 0xFFFFFFFF),
+    0x08: ('f', 4, None), # invalid floats are NaN
+    0x09: ('d', 8, None),
+    0x0A: ('B', 1, 0x00), # uint8z
+    0x0B: ('H', 2, 0x0000),
+    0x0C: ('I', 4, 0x00000000),
+    0x0D: ('B', 1, 0xFF), # byte
+    0x0E: ('q', 8, 0x7FFFFFFFFFFFFFFF),
+    0x0F: ('Q', 8, 0xFFFFFFFFFFFFFFFF),
+    0x10: ('Q', 8, 0x0000000000000000),
+}
+
+ENUM = 0x00
+UINT8 = 0x02
+UINT16 = 0x84
+SINT32 = 0x85
+UINT32 = 0x86
+
+SPORTS = {
+    0: 'generic', 1: 'running', 2: 'cycling', 3: 'transition',
+    4: 'fitness_equipment', 5: 'swimming', 6: 'basketball', 7: 'soccer',
+    8: 'tennis', 9: 'american_football', 10: 'training', 11: 'walking',
+    12: 'cross_country_skiing', 13: 'alpine_skiing', 14: 'snowboarding',
+    15: 'rowing', 16: 'mountaineering', 17: 'hiking', 18: 'multisport',
+    19: 'paddling',
+}
+
+ACTIVITY_TYPES = {0: 'manual', 1: 'auto_multi_sport'}
+
+LAP_TRIGGERS = {
+    0: 'manual', 1: 'time', 2: 'distance', 3: 'position_start',
+    4: 'position_lap', 5: 'position_waypoint', 6: 'position_marked',
+    7: 'session_end', 8: 'fitness_equipment',
+}
+
+class InvalidFITFileError(RuntimeError):
+    pass
+
+class _Definition:
+    def __init__(self, name, size, fields, struct_format, dtype, columnar):
+        self.name = name
+        self.size = size # size of the data messages
+        self.fields = fields # list of (name, scale, offset, invalid value)
+        self.struct = struct.Struct(struct_format) if fields or name else None
+        self.dtype = dtype # the decoded fields, as a numpy record
+        self.timestamp_index = None
+
+        # values of the columnar messages, converted once the whole file is
+        # read: single messages are unpacked as rows, runs of consecutive
+        # messages are kept as views of the data
+        self.rows = [] if columnar else None
+        self.positions = [] # (offset in the file, timestamp) of the rows
+        self.runs = [] # (offsets, timestamps, records)
+
+        for i, (field_name, _, _, _) in enumerate(fields):
+            if field_name == 'timestamp':
+                self.timestamp_index = i
+
+def fit_timestamp_to_datetime(timestamp):
+    return datetime(1989, 12, 31) + timedelta(seconds=timestamp)
+
+class FITDecoder:
+    def __init__(self, messages=None, columnar=('record',)):
+        # messages: {message name: field names} to decode, defaults to the
+        # whole profile. The messages listed in columnar are returned as
+        # numpy arrays instead of dicts.
+        if messages is None:
+            messages = dict((name, [field[0] for field in fields.values()]) for name, fields in PROFILE.values())
+
+        self.messages = {}
+        for name, field_names in messages.items():
+            number = MESSAGES_NUMBERS[name]
+            self.messages[number] = dict(
+                (field_number, field) for field_number, field in PROFILE[number][1].items()
+                if field[0] in field_names
+            )
+
+        self.columnar = set(columnar)
+
+    def decode(self, fit_file):
+        if hasattr(fit_file, 'read'):
+            data = fit_file.read()
+        else:
+            with open(fit_file, 'rb') as source:
+                data = source.read()
+
+        # indexing a bytearray gives integers
+        data = bytearray(data)
+        messages = dict((PROFILE[number][0], []) for number in self.messages)
+        columnar_definitions = []
+        offset = 0
+
+        # a file can contain several chained FIT files
+        while offset < len(data):
+            offset = self._decode_file(data, offset, messages, columnar_definitions)
+
+        for name in self.columnar:
+            if name in messages:
+                messages[name] = self._to_columns(name, [d for d in columnar_definitions if d.name == name])
+
+        return messages
+
+    def _decode_file(self, data, offset, messages, columnar_definitions):
+        if len(data) - offset < 12 or data[offset + 8:offset + 12] != b'.FIT':
+            raise InvalidFITFileError('Invalid FIT header')
+
+        start = offset
+        header_size = data[offset]
+        data_size, = struct.unpack_from('<I', data, offset + 4)
+        offset += header_size
+        end = offset + data_size
+
+        if end + 2 > len(data):
+            raise InvalidFITFileError('Truncated FIT file')
+
+        self._check_crc(data, start, header_size, end)
+
+        headers = numpy.frombuffer(data, dtype='uint8')
+        definitions = {}
+        last_timestamp = None
+
+        while offset < end:
+            header = data[offset]
+            offset += 1
+
+            if header & 0x80: # compressed timestamp header
+                if last_timestamp is None:
+                    raise InvalidFITFileError('Compressed timestamp without a previous timestamp')
+
+                definition = definitions.get((header >> 5) & 0x03)
+                time_offset = header & 0x1F
+                timestamp = (last_timestamp & ~0x1F) + time_offset
+                if time_offset < (last_timestamp & 0x1F):
+                    timestamp += 0x20
+                last_timestamp = timestamp
+            elif header & 0x40: # definition message
+                definition, offset = self._decode_definition(data, offset, header & 0x20)
+                definitions[header & 0x0F] = definition
+                if definition.rows is not None:
+                    columnar_definitions.append(definition)
+                continue
+            else:
+                definition = definitions.get(header & 0x0F)
+                timestamp = None
+
+            if definition is None:
+                raise InvalidFITFileError('Data message without definition')
+
+            following = offset + definition.size
+
+            if definition.rows is not None and following < end and self._continues(header, data[following]):
+                # the next message has the same definition: decode all the
+                # consecutive ones at once
+                offset, last_timestamp = self._decode_run(data, headers, offset, end, header, definition, timestamp)
+                continue
+
+            if definition.struct is not None:
+                values = definition.struct.unpack_from(data, offset)
+
+                if definition.timestamp_index is not None:
+                    last_timestamp = timestamp = values[definition.timestamp_index]
+
+                if definition.rows is not None:
+                    definition.rows.append(values)
+                    definition.positions.append((offset, -1 if timestamp is None else timestamp))
+                elif definition.name is not None:
+                    messages[definition.name].append(self._to_dict(definition, timestamp, values))
+
+            offset = following
+
+        # skip the CRC, checked beforehand
+        return end + 2
+
+    def _check_crc(self, data, start, header_size, end):
+        view = memoryview(data)
+
+        # the CRC of the 14 bytes headers is optional (0 when missing)
+        if header_size >= 14:
+            header_crc, = struct.unpack_from('<H', data, start + 12)
+
+            if header_crc != 0 and header_crc != crc16(view[start:start + 12]):
+                raise InvalidFITFileError('Invalid FIT header CRC')
+
+        crc, = struct.unpack_from('<H', data, end)
+
+        if crc != crc16(view[start:end]):
+            raise InvalidFITFileError('Invalid FIT file CRC')
+
+    def _continues(self, header, next_header):
+        if header & 0x80:
+            return next_header & 0xE0 == header & 0xE0
+
+        return next_header == header
+
+    def _decode_run(self, data, headers, offset, end, header, definition, timestamp):
+        stride = definition.size + 1
+        count = (end - offset + 1) // stride
+        run_headers = headers[offset - 1:offset - 1 + count * stride:stride]
+
+        if header & 0x80:
+            same = (run_headers & 0xE0) == (header & 0xE0)
+        else:
+            same = run_headers == header
+
+        if not same.all():
+            count = int(numpy.argmin(same))
+
+        records = numpy.ndarray((count,), dtype=definition.dtype, buffer=data, offset=offset, strides=(stride,))
+        offsets = offset + stride * numpy.arange(count, dtype='int64')
+
+        if header & 0x80:
+            # the timestamps are offsets rolling over every 32 seconds
+            time_offsets = run_headers[:count].astype('int64') & 0x1F
+            timestamps = timestamp + numpy.r_[0, numpy.cumsum(numpy.diff(time_offsets) & 0x1F)]
+        elif definition.timestamp_index is not None:
+            timestamps = records['timestamp'].astype('int64')
+        else:
+            timestamps = numpy.full(count, -1, dtype='int64')
+
+        definition.runs.append((offsets, timestamps, records))
+
+        last_timestamp = int(timestamps[-1]) if timestamps[-1] >= 0 else timestamp
+
+        return offset - 1 + count * stride, last_timestamp
+
+    def _decode_definition(self, data, offset, has_developer_fields):
+        big_endian = data[offset + 1] == 1
+        number, = struct.unpack_from('>H' if big_endian else '<H', data, offset + 2)
+        fields_count = data[offset + 4]
+        offset += 5
+
+        wanted = self.messages.get(number)
+        size = 0
+        fields = []
+        struct_format = '>' if big_endian else '<'
+        dtype = {'names': [], 'formats': [], 'offsets': []}
+
+        for _ in range(fields_count):
+            field_number = data[offset]
+            field_size = data[offset + 1]
+            base_type = BASE_TYPES.get(data[offset + 2] & 0x1F)
+            offset += 3
+
+            if base_type is None or base_type[1] != field_size:
+                field = None
+            elif wanted is not None and field_number in wanted:
+                name, scale, value_offset = wanted[field_number]
+                field = (name, scale, value_offset, base_type[2])
+            elif field_number == TIMESTAMP_FIELD:
+                # needed to decode the compressed timestamps that follow
+                field = ('timestamp', 1, 0, base_type[2])
+            else:
+                field = None
+
+            if field is None:
+                struct_format += '%dx' % field_size
+            else:
+                fields.append(field)
+                struct_format += base_type[0]
+                dtype['names'].append(field[0])
+                dtype['formats'].append(struct_format[0] + base_type[0])
+                dtype['offsets'].append(size)
+
+            size += field_size
+
+        if has_developer_fields:
+            developer_fields_count = data[offset]
+            offset += 1
+
+            for _ in range(developer_fields_count):
+                size += data[offset + 1]
+                offset += 3
+
+        name = None if wanted is None else PROFILE[number][0]
+        dtype['itemsize'] = size
+
+        return _Definition(name, size, fields, struct_format, numpy.dtype(dtype), name in self.columnar), offset
+
+    def _to_dict(self, definition, timestamp, values):
+        message = dict((field[0], None) for field in self.messages[MESSAGES_NUMBERS[definition.name]].values())
+
+        for (name, scale, offset, invalid), value in zip(definition.fields, values):
+            if value == invalid or value != value:
+                continue
+
+            message[name] = value if scale == 1 and offset == 0 else value / float(scale) - offset
+
+        if message.get('timestamp') is None and timestamp is not None:
+            message['timestamp'] = timestamp
+
+        return message
+
+    def _to_columns(self, name, definitions):
+        parts = []
+
+        for definition in definitions:
+            names = [field[0] for field in definition.fields]
+
+            if definition.rows:
+                positions = numpy.array(definition.positions, dtype='int64')
+                values = numpy.array(definition.rows, dtype='float64').reshape(len(definition.rows), len(names))
+                parts.append((definition, positions[:, 0], positions[:, 1], values))
+
+            for offsets, timestamps, records in definition.runs:
+                values = numpy.empty((len(records), len(names)))
+                for j, field_name in enumerate(names):
+                    values[:, j] = records[field_name]
+                parts.append((definition, offsets, timestamps, values))
+
+        count = sum(len(part[1]) for part in parts)
+        columns = dict((field[0], numpy.full(count, numpy.nan)) for field in self.messages[MESSAGES_NUMBERS[name]].values())
+        columns['timestamp'] = numpy.full(count, -1, dtype='int64')
+        offsets = numpy.empty(count, dtype='int64')
+        start = 0
+
+        # the messages sharing a definition are converted together
+        for definition, part_offsets, timestamps, values in parts:
+            stop = start + len(part_offsets)
+            offsets[start:stop] = part_offsets
+            columns['timestamp'][start:stop] = timestamps
+
+            for j, (field_name, scale, offset, invalid) in enumerate(definition.fields):
+                if field_name == 'timestamp':
+                    continue
+
+                column = values[:, j]
+                if invalid is not None:
+                    column[column == invalid] = numpy.nan
+
+                columns[field_name][start:stop] = column / scale - offset
+
+            start = stop
+
+        # back to the order of the file
+        order = numpy.argsort(offsets, kind='mergesort')
+
+        return dict((field_name, column[order]) for field_name, column in columns.items())
+
+# CRC-16 used by the FIT files, one entry per byte
+CRC_TABLE = numpy.zeros(256, dtype='int64')
+for _byte in range(256):
+    _crc = _byte
+    for _ in range(8):
+        _crc = (_crc >> 1) ^ 0xA001 if _crc & 1 else _crc >> 1
+    CRC_TABLE[_byte] = _crc
+
+CRC_BLOCK_SIZE = 64
+
+def crc16(data):
+    # The CRC starts at 0 and is linear: the CRC of a block followed by
+    # another one is the CRC of the second block xor the CRC of the first
+    # one shifted through as many zero bytes. This computes the CRC of all the
+    # blocks at once, then combines them pairwise.
+    data = numpy.frombuffer(data, dtype='uint8')
+
+    # leading zero bytes do not change the CRC
+    padding = -len(data) % CRC_BLOCK_SIZE
+    blocks = numpy.concatenate([numpy.zeros(padding, dtype='uint8'), data]).reshape(-1, CRC_BLOCK_SIZE)
+    crcs = numpy.zeros(len(blocks), dtype='int64')
+
+    for i in range(CRC_BLOCK_SIZE):
+        crcs = (crcs >> 8) ^ CRC_TABLE[(crcs ^ blocks[:, i]) & 0xFF]
+
+    # shift[state] gives the CRC after a block of zeros, for the low and
+    # high bytes of the state
+    states = numpy.arange(256, dtype='int64')
+    low, high = states, states << 8
+    for _ in range(CRC_BLOCK_SIZE):
+        low = (low >> 8) ^ CRC_TABLE[low & 0xFF]
+        high = (high >> 8) ^ CRC_TABLE[high & 0xFF]
+
+    while len(crcs) > 1:
+        if len(crcs) % 2:
+            crcs = numpy.r_[0, crcs]
+
+        crcs = low[crcs[0::2] & 0xFF] ^ high[crcs[0::2] >> 8] ^ crcs[1::2]
+
+        # the blocks are now twice as long
+        low, high = low[low & 0xFF] ^ high[low >> 8], low[high & 0xFF] ^ high[high >> 8]
+
+    return int(crcs[0]) if len(crcs) else 0
+
+# fields written for each message: (field number, base type)
+FILE_ID_FIELDS = [(0, ENUM), (1, UINT16), (2, UINT16), (4, UINT32)]
+RECORD_FIELDS = [(253, UINT32), (0, SINT32), (1, SINT32), (5, UINT32), (78, UINT32), (3, UINT8)]
+LAP_FIELDS = [
+    (254, UINT16), (253, UINT32), (2, UINT32), (7, UINT32), (8, UINT32), (9, UINT32),
+    (11, UINT16), (14, UINT16), (111, UINT32), (15, UINT8), (16, UINT8), (24, ENUM), (25, ENUM),
+]
+SESSION_FIELDS = [(253, UINT32), (2, UINT32), (7, UINT32), (8, UINT32), (9, UINT32), (11, UINT16), (5, ENUM), (26, UINT16)]
+ACTIVITY_FIELDS = [(253, UINT32), (0, UINT32), (1, UINT16), (2, ENUM)]
+
+FILE_TYPE_ACTIVITY = 4
+MANUFACTURER_DEVELOPMENT = 255
+PROFILE_VERSION = 2093
+
+def _reverse(enum):
+    return dict((name, value) for value, name in enum.items())
+
+def to_fit_timestamp(time):
+    # time is a datetime or a number of nanoseconds since the unix epoch
+    if not isinstance(time, (int, float, numpy.ndarray, numpy.integer)):
+        time = datetime_to_ns(time)
+
+    return numpy.floor_divide(time, 10 ** 9) - FIT_EPOCH
+
+def _missing_as_nan(column):
+    # the model uses 0 for missing values
+    return numpy.where(column != 0, column, numpy.nan)
+
+def _definition(local_type, number, fields):
+    message = struct.pack('<BBBHB', 0x40 | local_type, 0, 0, number, len(fields))
+
+    for field_number, base_type in fields:
+        message += struct.pack('<BBB', field_number, BASE_TYPES[base_type & 0x1F][1], base_type)
+
+    return message
+
+def _messages(local_type, number, fields, values):
+    # values: {field number: scalar or array in the units of the profile},
+    # None and NaN are written as invalid values
+    count = max([len(value) for value in values.values() if isinstance(value, numpy.ndarray)] or [1])
+    dtype = [('header', 'u1')]
+
+    for field_number, base_type in fields:
+        dtype.append(('f%d' % field_number, '<' + BASE_TYPES[base_type & 0x1F][0]))
+
+    messages = numpy.zeros(count, dtype=dtype)
+    messages['header'] = local_type
+
+    for field_number, base_type in fields:
+        _, scale, offset = PROFILE[number][1][field_number]
+        invalid = BASE_TYPES[base_type & 0x1F][2]
+        info = numpy.iinfo(messages.dtype['f%d' % field_number])
+        value = values.get(field_number)
+        value = numpy.asarray(numpy.nan if value is None else value, dtype='float64')
+
+        raw = numpy.round((value + offset) * scale)
+        valid = ~numpy.isnan(raw)
+        messages['f%d' % field_number] = numpy.where(valid, numpy.clip(numpy.where(valid, raw, 0), info.min, info.max), invalid)
+
+    return messages.tobytes()
+
+def write_activity(activity, stream):
+    sports = _reverse(SPORTS)
+    lap_triggers = _reverse(LAP_TRIGGERS)
+    activity_types = _reverse(ACTIVITY_TYPES)
+
+    sport = None if activity.type is None else sports.get(activity.type.lower(), 0)
+    start_time = activity.started_at
+    end_time = activity.completed_at
+
+    chunks = [
+        _definition(0, 0, FILE_ID_FIELDS),
+        _messages(0, 0, FILE_ID_FIELDS, {
+            0: FILE_TYPE_ACTIVITY, 1: MANUFACTURER_DEVELOPMENT, 2: 0,
+            4: None if start_time is None else to_fit_timestamp(start_time),
+        }),
+        _definition(2, 19, LAP_FIELDS),
+    ]
+
+    total = {'duration': 0, 'distance': 0, 'calories': 0}
+    trigger_method = None
+
+    for i, lap in enumerate(activity.laps):
+        trackpoints = lap.trackpoints
+
+        if len(trackpoints):
+            # the whole lap is encoded at once, without the fields that none
+            # of its trackpoints have
+            values = {
+                253: to_fit_timestamp(trackpoints.column('time')),
+                0: trackpoints.column('latitude'),
+                1: trackpoints.column('longitude'),
+                5: _missing_as_nan(trackpoints.column('distance')),
+                78: _missing_as_nan(trackpoints.column('altitude')),
+                3: _missing_as_nan(trackpoints.column('heart_rate')),
+            }
+            fields = [field for field in RECORD_FIELDS if not numpy.isnan(values[field[0]]).all()]
+
+            chunks.append(_definition(1, 20, fields))
+            chunks.append(_messages(1, 20, fields, values))
+
+        lap_start = lap.start_time
+        lap_end = lap.end_time
+
+        if lap_end is None and lap_start is not None:
+            lap_end = to_fit_timestamp(lap_start) + lap.duration
+        elif lap_end is not None:
+            lap_end = to_fit_timestamp(lap_end)
+
+        if lap.trigger_method is not None:
+            trigger_method = lap.trigger_method.lower()
+
+        chunks.append(_messages(2, 19, LAP_FIELDS, {
+            254: i,
+            253: lap_end,
+            2: None if lap_start is None else to_fit_timestamp(lap_start),
+            7: lap.duration,
+            8: lap.duration,
+            9: lap.distance,
+            11: lap.calories,
+            14: lap.max_speed,
+            111: lap.max_speed,
+            15: lap.avg_heart_rate or None,
+            16: lap.max_heart_rate or None,
+            24: lap_triggers.get(trigger_method),
+            25: sport,
+        }))
+
+        total['duration'] += lap.duration or 0
+        total['distance'] += lap.distance or 0
+        total['calories'] += lap.calories or 0
+
+    end = None if end_time is None else to_fit_timestamp(end_time)
+
+    chunks.extend([
+        _definition(3, 18, SESSION_FIELDS),
+        _messages(3, 18, SESSION_FIELDS, {
+            253: end,
+            2: None if start_time is None else to_fit_timestamp(start_time),
+            7: total['duration'],
+            8: total['duration'],
+            9: total['distance'],
+            11: total['calories'],
+            5: sport,
+            26: len(activity.laps),
+        }),
+        _definition(4, 34, ACTIVITY_FIELDS),
+        _messages(4, 34, ACTIVITY_FIELDS, {
+            253: end,
+            0: total['duration'],
+            1: 1,
+            2: activity_types.get(trigger_method),
+        }),
+    ])
+
+    data = b''.join(chunks)
+    header = struct.pack('<BBHI4s', 14, 0x10, PROFILE_VERSION, len(data), b'.FIT')
+    header += struct.pack('<H', crc16(header))
+
+    stream.write(header)
+    stream.write(data)
+    stream.write(struct.pack('<H', crc16(header + data)))
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+# Parsers and dumpers, by file extension. The built-in ones are given as
+# 'module:class' and only imported when a file with their extension is read
+# or written, so that a conversion doesn't pay for the imports of the other
+# formats (lxml for instance).
+#
+# Other packages can add formats with the 'runner.parsers' and
+# 'runner.dumpers' entry points, in their setup.py:
+#
+#   entry_points={
+#       'runner.parsers': ['kml = my_package.kml:KMLParser'],
+#       'runner.dumpers': ['kml = my_package.kml:KMLDumper'],
+#   }
+#
+# The files can also be compressed (activity.tcx.gz), and their format is
+# sniffed from their content when it isn't known from their name.
+
+import bz2, gzip, importlib, io, lzma, os
+
+PARSERS = {
+    'fit': 'runner.parser:FITParser',
+    'gpx': 'runner.parser:GPXParser',
+    'runner': 'runner.parser:NativeParser',
+    'tcx': 'runner.parser:TCXParser',
+}
+
+DUMPERS = {
+    'fit': 'runner.dumper:FITDumper',
+    'gpx': 'runner.dumper:GPXDumper',
+    'runner': 'runner.dumper:NativeDumper',
+    'tcx': 'runner.dumper:TCXDumper',
+}
+
+# compressions by extension, with the magic bytes starting their streams
+COMPRESSIONS = {
+    'bz2': (b'BZh', bz2.open),
+    'gz': (b'\x1f\x8b', gzip.open),
+    'xz': (b'\xfd7zXZ\x00', lzma.open),
+}
+
+# number of bytes read to sniff the compression and the format of a stream
+SNIFF_SIZE = 4096
+
+def load(reference):
+    # 'module:attribute' to the attribute
+    module, _, attribute = reference.partition(':')
+
+    return getattr(importlib.import_module(module), attribute)
+
+def _entry_points(group):
+    # only imported when a format is missing, it is slow to import
+    from importlib.metadata import entry_points
+
+    found = entry_points()
+
+    # a dict of groups before python 3.10
+    return list(found.select(group=group) if hasattr(found, 'select') else found.get(group, []))
+
+def split_extension(filename):
+    # 'activity.tcx.gz' gives ('tcx', 'gz'), 'activity.tcx' ('tcx', None)
+    name, extension = os.path.splitext(filename)
+    extension = extension[1:] # remove the leading '.'
+
+    if extension not in COMPRESSIONS:
+        return extension, None
+
+    return os.path.splitext(name)[1][1:], extension
+
+def strip_extension(filename):
+    # 'activity.tcx.gz' gives 'activity'
+    extension, compression = split_extension(filename)
+    suffix = len(extension) + 1 if extension else 0
+    suffix += len(compression) + 1 if compression else 0
+
+    return filename[:len(filename) - suffix]
+
+def open_file(filename, mode='rb'):
+    # opens a file, (de)compressed according to its extension, the text
+    # modes use utf-8
+    _, compression = split_extension(filename)
+    encoding = None if 'b' in mode else 'utf-8'
+
+    if compression is None:
+        return io.open(filename, mode, encoding=encoding)
+
+    return COMPRESSIONS[compression][1](filename, mode if encoding is None else mode + 't', encoding=encoding)
+
+def sniff_compression(head):
+    for compression, (magic, _) in COMPRESSIONS.items():
+        if head.startswith(magic):
+            return compression
+
+    return None
+
+def sniff_format(head):
+    # the format of a decompressed stream from its first bytes
+    if len(head) >= 12 and head[8:12] == b'.FIT':
+        return 'fit'
+    if head.startswith(b'RUNNERAC'):
+        return 'runner'
+    if b'<gpx' in head:
+        return 'gpx'
+    if b'<TrainingCenterDatabase' in head:
+        return 'tcx'
+
+    return None
+
+def is_filename(source):
+    return isinstance(source, str) or hasattr(source, '__fspath__')
+
+class _PeekedStream:
+    # a binary stream whose first bytes are read in advance
+    def __init__(self, stream):
+        self.stream = stream
+        self.head = stream.read(SNIFF_SIZE)
+        self._position = 0
+
+    def read(self, size=-1):
+        if self._position >= len(self.head):
+            return self.stream.read() if size is None or size < 0 else self.stream.read(size)
+
+        if size is None or size < 0:
+            chunk = self.head[self._position:] + self.stream.read()
+        else:
+            # a short read is fine as long as it isn't empty
+            chunk = self.head[self._position:self._position + size]
+
+        self._position += len(chunk)
+
+        return chunk
+
+class Source:
+    # the decompressed content of a filename, bytes, a file object or a mmap
+    # as a binary stream, with its format
+    def __init__(self, source, format=None):
+        self._opened = []
+        compression = None
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            stream = io.BytesIO(source)
+        elif hasattr(source, 'read'):
+            stream = source
+        else:
+            extension, compression = split_extension(source)
+            if format is None and extension in parsers:
+                format = extension
+
+            stream = io.open(source, 'rb')
+            self._opened.append(stream)
+
+        stream = _PeekedStream(stream)
+        compression = compression or sniff_compression(stream.head)
+
+        if compression is not None:
+            decompressed = COMPRESSIONS[compression][1](stream, 'rb')
+            self._opened.append(decompressed)
+            stream = _PeekedStream(decompressed)
+
+        self.stream = stream
+        self.compression = compression
+        self.format = format or sniff_format(stream.head)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def close(self):
+        for stream in reversed(self._opened):
+            stream.close()
+
+        self._opened = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class Registry:
+    def __init__(self, group, backends):
+        self.group = group
+        self._backends = dict(backends)
+        self._plugins_loaded = False
+
+    def register(self, extension, backend):
+        # backend: a class, or a 'module:class' reference to import it lazily
+        self._backends[extension] = backend
+
+    def __contains__(self, extension):
+        if extension not in self._backends:
+            self._load_plugins()
+
+        return extension in self._backends
+
+    def extensions(self):
+        self._load_plugins()
+
+        return sorted(self._backends)
+
+    def get(self, extension):
+        # the entry points are only looked for when needed, as listing them
+        # is slow
+        if extension not in self._backends:
+            self._load_plugins()
+
+        backend = self._backends.get(extension)
+
+        if backend is None:
+            return None
+
+        if isinstance(backend, str):
+            backend = self._backends[extension] = load(backend)
+        elif not isinstance(backend, type) and hasattr(backend, 'load'):
+            # an entry point
+            backend = self._backends[extension] = backend.load()
+
+        return backend
+
+    def _load_plugins(self):
+        if self._plugins_loaded:
+            return
+
+        self._plugins_loaded = True
+
+        for entry_point in _entry_points(self.group):
+            # the built-in formats and the registered ones take precedence
+            if entry_point.name not in self._backends:
+                self._backends[entry_point.name] = entry_point
+
+parsers = Registry('runner.parsers', PARSERS)
+dumpers = Registry('runner.dumpers', DUMPERS)
@@ -1,34 +1,286 @@
 #!/usr/bin/env python
 
-import pandas, time, math
+from datetime import timedelta
+
+import numpy
+
+class OffsetError(RuntimeError):
+    pass
+
+class Offset:
+    def __init__(self, seconds, confidence, signal):
+        self.seconds = seconds # to add to the cardio times
+        self.confidence = confidence # correlation at the offset, from 0 to 1
+        self.signal = signal
+
+    @property
+    def delta(self):
+        return timedelta(seconds=self.seconds)
+
+    def __repr__(self):
+        return '<Offset %+.1fs confidence=%.2f signal=%s>' % (self.seconds, self.confidence, self.signal)
+
+def _correlate(x, y, size):
+    # sum(x[i] * y[i + k]) for every lag k, stored at k % size
+    return numpy.fft.irfft(numpy.conj(numpy.fft.rfft(x, size)) * numpy.fft.rfft(y, size), size)
 
 class Fusion:
+    INTERPOLATIONS = ('linear', 'nearest', 'hold')
+    POLICIES = ('priority', 'weighted')
+    OFFSET_SIGNALS = ('heart_rate', 'speed')
+    OFFSET_MAX_GAP = 30 # in seconds, longer gaps aren't used to estimate offsets
+
+    def __init__(self, interpolation='linear', max_gap=None, policy='priority'):
+        if interpolation not in self.INTERPOLATIONS:
+            raise ValueError('Unknown interpolation: ' + interpolation)
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown policy: ' + policy)
+
+        self.interpolation = interpolation
+        self.max_gap = max_gap # in seconds, None for no limit
+        self.policy = policy
+
     def merge_activities(self, main_activity, cardio_activity):
-        complete_cardio = self._interpolate_cardio(main_activity, cardio_activity)
+        self.merge_sources(main_activity, [cardio_activity])
+
+    def merge_sources(self, main_activity, cardio_activities, weights=None, offsets=None):
+        # cardio_activities are given by decreasing priority, weights are
+        # only used by the weighted policy and offsets (in seconds) are added
+        # to the times of each cardio activity
+        offsets = offsets or [0] * len(cardio_activities)
+        samples = [
+            self._cardio_samples(activity, offset)
+            for activity, offset in zip(cardio_activities, offsets)
+        ]
+        times, heart_rates = self.merge_samples(samples, weights)
 
         # and merge it back into the main activity
-        for trackpoint in main_activity.trackpoints:
-            timestamp = self._date_to_timestamp(trackpoint.time)
+        for lap in main_activity.laps:
+            bpm = self.interpolate(times, heart_rates, lap.trackpoints.column('time'))
+            lap.trackpoints.set_column('heart_rate', bpm)
+
+    def merge_samples(self, samples, weights=None):
+        # merges several sorted (times, values) sources into a single one
+        if weights is None:
+            weights = [1.0] * len(samples)
+        if len(weights) != len(samples):
+            raise ValueError('Expected %d weights, got %d' % (len(samples), len(weights)))
+
+        if len(samples) == 1:
+            return samples[0]
+
+        times = numpy.concatenate([source_times for source_times, _ in samples])
+        values = numpy.concatenate([source_values for _, source_values in samples])
+        sources = numpy.concatenate([
+            numpy.full(len(source_times), i, dtype='int32')
+            for i, (source_times, _) in enumerate(samples)
+        ])
+
+        # a stable sort of the concatenated sorted runs is a k-way merge,
+        # which keeps the samples of the same time by priority
+        order = numpy.argsort(times, kind='mergesort')
+        times, values, sources = times[order], values[order], sources[order]
+
+        if self.policy == 'priority':
+            # each time belongs to the source with the highest priority whose
+            # spans (intervals between two of its samples at most max_gap
+            # apart) contain it, the other samples at that time are dropped.
+            # The lower sources only fill the gaps of the higher ones: the
+            # sources are handed over at the ends of the spans, and isolated
+            # samples don't alternate with the samples of another source.
+            owners = numpy.full(len(times), len(samples), dtype='int32')
+            for i in reversed(range(len(samples))):
+                owners[self._spans(samples[i][0], times)] = i
+
+            keep = (owners == len(samples)) | (owners == sources)
+            times, values = times[keep], values[keep]
+
+            # outside of the spans, the samples of the same time by priority
+            keep = numpy.r_[True, times[1:] != times[:-1]]
+
+            return times[keep], values[keep]
+
+        total = numpy.zeros(len(times), dtype='float64')
+        weight = numpy.zeros(len(times), dtype='float64')
+        for (source_times, source_values), source_weight in zip(samples, weights):
+            interpolated, covered = self._interpolate(source_times, source_values, times)
+            total += source_weight * interpolated
+            weight += source_weight * covered
+
+        # the samples only covered by sources with a weight of 0 are dropped,
+        # like the missing ones
+        keep = weight > 0
+        keep[1:] &= times[1:] != times[:-1]
+
+        return times[keep], total[keep] / weight[keep]
+
+    def estimate_offset(self, main_activity, cardio_activity, max_offset=600, resolution=1.0, min_overlap=60):
+        # cross-correlates the signals of both activities on a grid of
+        # resolution seconds, max_offset and min_overlap are in seconds
+        main, cardio = main_activity.to_arrays(), cardio_activity.to_arrays()
+
+        for signal in self.OFFSET_SIGNALS:
+            main_times, main_values = self._signal(main, signal)
+            cardio_times, cardio_values = self._signal(cardio, signal)
+
+            if len(main_times) > 1 and len(cardio_times) > 1:
+                break
+        else:
+            raise OffsetError('No signal in common between the activities')
+
+        # only the samples that can overlap within max_offset are useful
+        margin = int(max_offset * 1e9)
+        main_kept = (main_times >= cardio_times[0] - margin) & (main_times <= cardio_times[-1] + margin)
+        cardio_kept = (cardio_times >= main_times[0] - margin) & (cardio_times <= main_times[-1] + margin)
+        main_times, main_values = main_times[main_kept], main_values[main_kept]
+        cardio_times, cardio_values = cardio_times[cardio_kept], cardio_values[cardio_kept]
+
+        if len(main_times) < 2 or len(cardio_times) < 2:
+            raise OffsetError('The activities don\'t overlap enough to estimate an offset')
+
+        step = int(resolution * 1e9)
+        start = min(main_times[0], cardio_times[0])
+        end = max(main_times[-1], cardio_times[-1])
+        grid = start + numpy.arange((end - start) // step + 1, dtype='int64') * step
+
+        main_values, main_mask = self._resample(main_times, main_values, grid)
+        cardio_values, cardio_mask = self._resample(cardio_times, cardio_values, grid)
+
+        # normalized cross-correlation, restricted to the overlap of both
+        # signals at each lag
+        size = 1
+        while size < 2 * len(grid):
+            size *= 2
+
+        count = numpy.round(_correlate(main_mask, cardio_mask, size))
+        main_sum = _correlate(main_values, cardio_mask, size)
+        cardio_sum = _correlate(main_mask, cardio_values, size)
+        main_squares = _correlate(main_values ** 2, cardio_mask, size)
+        cardio_squares = _correlate(main_mask, cardio_values ** 2, size)
+        products = _correlate(main_values, cardio_values, size)
+
+        lags = numpy.arange(size)
+        lags[lags >= size // 2] -= size
+        valid = (count >= max(min_overlap / resolution, 2)) & (numpy.abs(lags) * resolution <= max_offset)
+        count[~valid] = 1
+
+        variances = (main_squares - main_sum ** 2 / count) * (cardio_squares - cardio_sum ** 2 / count)
+        valid &= variances > 1e-9 * count ** 2
+        variances[~valid] = 1
+        correlation = (products - main_sum * cardio_sum / count) / numpy.sqrt(variances)
+        correlation[~valid] = -numpy.inf
+
+        best = int(numpy.argmax(correlation))
+        if not valid[best]:
+            raise OffsetError('The activities don\'t overlap enough to estimate an offset')
+
+        # refines the lag between the grid points around the peak
+        lag = float(lags[best])
+        before, after = correlation[best - 1], correlation[(best + 1) % size]
+        if numpy.isfinite(before) and numpy.isfinite(after):
+            curvature = before - 2 * correlation[best] + after
+            if curvature < 0:
+                lag -= 0.5 * (after - before) / curvature
+
+        # the cardio sample recorded at grid[i + lag] matches the main one
+        # recorded at grid[i]
+        confidence = min(max(float(correlation[best]), 0.0), 1.0)
+
+        return Offset(-lag * resolution, confidence, signal)
+
+    def interpolate(self, times, values, at):
+        # times (sorted) and at are in nanoseconds, points that aren't
+        # covered by the samples are set to 0
+        return self._interpolate(times, values, at)[0]
+
+    def _interpolate(self, times, values, at):
+        result = numpy.zeros(len(at), dtype='float64')
+
+        if len(times) == 0 or len(at) == 0:
+            return result, numpy.zeros(len(at), dtype='bool')
+
+        # index of the samples surrounding each point
+        after = numpy.searchsorted(times, at, side='right')
+        before = after - 1
+        covered = (at >= times[0]) & (at <= times[-1])
+        before = numpy.clip(before, 0, len(times) - 1)
+        after = numpy.clip(after, 0, len(times) - 1)
+
+        if self.interpolation == 'linear':
+            # relative times keep the sub-second precision in float64
+            result[:] = numpy.interp((at - times[0]).astype('float64'), (times - times[0]).astype('float64'), values)
+            gap = times[after] - times[before]
+        elif self.interpolation == 'nearest':
+            nearest = numpy.where(at - times[before] <= times[after] - at, before, after)
+            result[:] = values[nearest]
+            gap = numpy.abs(times[nearest] - at)
+        else:
+            result[:] = values[before]
+            gap = at - times[before]
+
+        if self.max_gap is not None:
+            exact = at == times[before]
+            covered &= exact | (gap <= self.max_gap * 1e9)
+
+        result[~covered] = 0
+
+        return result, covered
+
+    def _spans(self, times, at):
+        # whether each point is between two of the (sorted) times at most
+        # max_gap apart
+        if len(times) < 2:
+            return numpy.zeros(len(at), dtype='bool')
+
+        linked = numpy.ones(len(times) - 1, dtype='bool')
+        if self.max_gap is not None:
+            linked = numpy.diff(times) <= self.max_gap * 1e9
+
+        # whether the interval starting/ending at each time is a span
+        starts, ends = numpy.r_[linked, False], numpy.r_[False, linked]
+        before = numpy.searchsorted(times, at, side='right') - 1
+        index = numpy.maximum(before, 0)
+
+        return (before >= 0) & (starts[index] | ((at == times[index]) & ends[index]))
+
+    def _cardio_samples(self, cardio_activity, offset=0):
+        times, heart_rates = self._signal(cardio_activity.to_arrays(), 'heart_rate')
+
+        return times + int(round(offset * 1e9)), heart_rates
+
+    def _signal(self, arrays, signal):
+        order = numpy.argsort(arrays['time'], kind='mergesort')
+        times = arrays['time'][order]
+
+        if signal == 'heart_rate':
+            # a heart rate of 0 is a missing sample (strap without contact...)
+            heart_rates = arrays['heart_rate'][order]
+            present = heart_rates > 0
 
-            try:
-                bpm = float(complete_cardio[timestamp])
-                bpm = 0 if math.isnan(bpm) else int(bpm)
-            except KeyError:
-                bpm = 0
+            return times[present], heart_rates[present].astype('float64')
 
-            trackpoint.heart_rate = bpm
+        # speed between two points with a distance
+        distances = arrays['distance'][order]
+        present = distances > 0
+        times, distances = times[present], distances[present]
+        durations = numpy.diff(times)
+        moving = durations > 0
+        speeds = numpy.diff(distances)[moving] / (durations[moving] / 1e9)
 
-    def _interpolate_cardio(self, main_activity, cardio_activity):
-        # determine the workout bounds
-        main_start = self._date_to_timestamp(main_activity.started_at)
-        main_end = self._date_to_timestamp(main_activity.completed_at)
+        return times[:-1][moving] + durations[moving] // 2, speeds
 
-        # interpolate the cardio data
-        cardio_map = {self._date_to_timestamp(t.time): t.heart_rate for t in cardio_activity.trackpoints}
-        cardio_map_interpolated = pandas.Series(cardio_map, index=range(main_start, main_end + 1))
-        cardio_map_interpolated = cardio_map_interpolated.interpolate()
+    def _resample(self, times, values, grid):
+        # values on the grid, normalized, and 1 where the samples cover it
+        after = numpy.clip(numpy.searchsorted(times, grid, side='right'), 1, len(times) - 1)
+        gap = times[after] - times[after - 1]
+        mask = (grid >= times[0]) & (grid <= times[-1]) & (gap <= self.OFFSET_MAX_GAP * 1e9)
 
-        return cardio_map_interpolated.to_dict()
+        resampled = numpy.interp((grid - times[0]).astype('float64'), (times - times[0]).astype('float64'), values)
+        if mask.any():
+            resampled -= resampled[mask].mean()
+            deviation = resampled[mask].std()
+            if deviation > 0:
+                resampled /= deviation
+        resampled[~mask] = 0
 
-    def _date_to_timestamp(self, date):
-        return int(time.mktime(date.timetuple()))
+        return resampled, mask.astype('float64')
@@ -2,10 +2,51 @@
 
 from datetime import datetime
 
+import numpy
+
+from runner.timestamp import datetime_to_ns, ns_to_datetime, parse_timestamp
+
+# the laps, laps lists and trackpoint columns have a version incremented
+# after each of their changes: the aggregates cached with an older version
+# are stale. Incremented after the change, a reader running meanwhile caches
+# its result under the old version, which is then recomputed.
+def _modifying(method):
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.version += 1
+
+        return result
+
+    return wrapper
+
+class _LapList(list):
+    version = 0
+
+    __setitem__ = _modifying(list.__setitem__)
+    __delitem__ = _modifying(list.__delitem__)
+    __iadd__ = _modifying(list.__iadd__)
+    append = _modifying(list.append)
+    extend = _modifying(list.extend)
+    insert = _modifying(list.insert)
+    pop = _modifying(list.pop)
+    remove = _modifying(list.remove)
+    reverse = _modifying(list.reverse)
+    sort = _modifying(list.sort)
+
 class Activity:
     def __init__(self):
-        self.laps = []
+        self._laps = _LapList()
         self._type = None
+        self._time_bounds = None
+
+    @property
+    def laps(self):
+        return self._laps
+
+    @laps.setter
+    def laps(self, value):
+        self._laps = _LapList(value)
+        self._time_bounds = None
 
     @property
     def identifier(self):
@@ -13,15 +54,40 @@ class Activity:
 
     @property
     def started_at(self):
-        return min(lap.start_time for lap in self.laps)
+        return self._get_time_bounds()[0]
 
     @property
     def completed_at(self):
-        return max(lap.end_time for lap in self.laps)
+        return self._get_time_bounds()[1]
+
+    def _version(self):
+        return (self.laps.version,) + tuple(lap.version for lap in self.laps)
+
+    def _get_time_bounds(self):
+        version = self._version()
+
+        if self._time_bounds is None or self._time_bounds[0] != version:
+            start_times = [lap.start_time for lap in self.laps if lap.start_time is not None]
+            end_times = [lap.end_time for lap in self.laps if lap.end_time is not None]
+
+            self._time_bounds = (
+                version,
+                min(start_times) if start_times else None,
+                max(end_times) if end_times else None,
+            )
+
+        return self._time_bounds[1:]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # only valid in the process that computed it
+        state['_time_bounds'] = None
+
+        return state
 
     @property
     def total_time(self):
-        return sum(lap.total_time for lap in self.laps)
+        return sum(lap.duration for lap in self.laps)
 
     @property
     def calories(self):
@@ -45,6 +111,41 @@ class Activity:
             for trackpoint in lap.trackpoints:
                 yield trackpoint
 
+    def to_arrays(self):
+        columns = [lap.trackpoints.arrays() for lap in self.laps]
+        arrays = {}
+
+        for name, dtype in TrackpointColumns.COLUMNS:
+            arrays[name] = numpy.concatenate([c[name] for c in columns]) if columns else numpy.empty(0, dtype)
+
+        arrays['lap'] = numpy.repeat(
+            numpy.arange(len(self.laps), dtype='int32'),
+            [len(lap.trackpoints) for lap in self.laps]
+        )
+
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        activity = cls()
+        laps = arrays.get('lap')
+
+        if laps is None or len(laps) == 0:
+            bounds = [(0, len(arrays['time']))]
+        else:
+            # the samples of a lap are contiguous
+            starts = numpy.flatnonzero(numpy.diff(laps)) + 1
+            bounds = zip(numpy.r_[0, starts], numpy.r_[starts, len(laps)])
+
+        for start, end in bounds:
+            lap = Lap()
+            lap.trackpoints = TrackpointColumns.from_arrays(dict(
+                (name, arrays[name][start:end]) for name, _ in TrackpointColumns.COLUMNS if name in arrays
+            ))
+            activity.laps.append(lap)
+
+        return activity
+
     def __repr__(self):
         return '<Activity: id "%s" of type "%s" (%d laps)>' % (
             self.identifier,
@@ -54,8 +155,8 @@ class Activity:
 
 class Lap:
     def __init__(self, start_time=None):
-        self._start_time = start_time if start_time is None or type(start_time) is datetime else datetime.strptime(start_time, '%Y-%m-%dT%H:%M:%S.%fZ')
-        self.trackpoints = []
+        self._start_time = start_time if start_time is None or type(start_time) is datetime else parse_timestamp(start_time)
+        self._trackpoints = TrackpointColumns()
 
         self.duration = 0 # in seconds
         self.distance = 0 # in meters
@@ -65,20 +166,35 @@ class Lap:
 
         self._avg_heart_rate = 0 # in bpm
         self._max_heart_rate = 0 # in bpm
+        self._version = 0
+
+    @property
+    def version(self):
+        return (self._version, self._trackpoints.version)
+
+    @property
+    def trackpoints(self):
+        return self._trackpoints
+
+    @trackpoints.setter
+    def trackpoints(self, value):
+        self._trackpoints = value if isinstance(value, TrackpointColumns) else TrackpointColumns(value)
+        self._version += 1
 
     @property
     def end_time(self):
-        return max(trackpoint.time for trackpoint in self.trackpoints)
+        return self.trackpoints.summary.end_time
 
     @property
     def start_time(self):
         return self._start_time if self._start_time is not None else \
-               min(trackpoint.time for trackpoint in self.trackpoints)
+               self.trackpoints.summary.start_time
 
     @start_time.setter
     def start_time(self, value):
         self._start_time = value if value is None or type(value) is datetime \
-                           else datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ')
+                           else parse_timestamp(value)
+        self._version += 1
 
     @property
     def trigger_method(self):
@@ -90,8 +206,8 @@ class Lap:
 
     @property
     def max_heart_rate(self):
-        return self._max_heart_rate if self._max_heart_rate is not 0 else \
-               max(trackpoint.heart_rate for trackpoint in self.trackpoints)
+        return self._max_heart_rate if self._max_heart_rate != 0 else \
+               self.trackpoints.summary.max_heart_rate
 
     @max_heart_rate.setter
     def max_heart_rate(self, value):
@@ -99,8 +215,8 @@ class Lap:
 
     @property
     def avg_heart_rate(self):
-        return self._avg_heart_rate if self._avg_heart_rate is not 0 else \
-               sum(trackpoint.heart_rate for trackpoint in self.trackpoints) / float(len(self.trackpoints))
+        return self._avg_heart_rate if self._avg_heart_rate != 0 else \
+               self.trackpoints.summary.avg_heart_rate
 
     @avg_heart_rate.setter
     def avg_heart_rate(self, value):
@@ -116,7 +232,7 @@ class Lap:
 
 class Trackpoint:
     def __init__(self, time=None):
-        self.time = time if type(time) is datetime else datetime.strptime(time, '%Y-%m-%dT%H:%M:%S.%fZ')
+        self.time = time if time is None or type(time) is datetime else parse_timestamp(time)
         self.distance = 0 # in meters
         self.altitude = 0 # in meters
         self.heart_rate = 0 # in bpm
@@ -129,6 +245,405 @@ class Trackpoint:
             self.heart_rate
         )
 
+class TrackpointsSummary:
+    def __init__(self):
+        self.count = 0
+        self.min_time = self.max_time = None # in nanoseconds since the epoch
+        self.min_distance = self.max_distance = None
+        self.heart_rate_sum = 0
+        self.max_heart_rate = 0
+
+    @classmethod
+    def from_arrays(cls, time, distance, heart_rate):
+        summary = cls()
+        summary.count = len(time)
+
+        if summary.count:
+            summary.min_time = int(time.min())
+            summary.max_time = int(time.max())
+            summary.min_distance = float(distance.min())
+            summary.max_distance = float(distance.max())
+            summary.heart_rate_sum = int(heart_rate.sum(dtype='int64'))
+            summary.max_heart_rate = int(heart_rate.max())
+
+        return summary
+
+    def add(self, time, distance, heart_rate):
+        if self.count == 0:
+            self.min_time = self.max_time = time
+            self.min_distance = self.max_distance = distance
+        else:
+            if time < self.min_time:
+                self.min_time = time
+            elif time > self.max_time:
+                self.max_time = time
+
+            if distance < self.min_distance:
+                self.min_distance = distance
+            elif distance > self.max_distance:
+                self.max_distance = distance
+
+        self.count += 1
+        self.heart_rate_sum += heart_rate
+
+        if heart_rate > self.max_heart_rate:
+            self.max_heart_rate = heart_rate
+
+    def add_trackpoint(self, trackpoint):
+        self.add(datetime_to_ns(trackpoint.time), trackpoint.distance, trackpoint.heart_rate)
+
+    @property
+    def start_time(self):
+        return None if self.count == 0 else ns_to_datetime(self.min_time)
+
+    @property
+    def end_time(self):
+        return None if self.count == 0 else ns_to_datetime(self.max_time)
+
+    @property
+    def duration(self):
+        return 0 if self.count == 0 else (self.max_time - self.min_time) / 1e9
+
+    @property
+    def distance(self):
+        return 0 if self.count == 0 else self.max_distance - self.min_distance
+
+    @property
+    def avg_heart_rate(self):
+        return 0 if self.count == 0 else self.heart_rate_sum / float(self.count)
+
+class TrackpointColumns:
+    # the trackpoints of a lap, stored as one array per field. It behaves as
+    # a list of trackpoints, with two differences: append(), insert()... copy
+    # the values of the given trackpoints (later changes to them are not
+    # seen), and the items are views on a position of the columns, which
+    # write through but follow the position when the trackpoints are
+    # inserted, removed or sorted.
+    COLUMNS = (
+        ('time', 'int64'), # in nanoseconds since the epoch
+        ('distance', 'float64'),
+        ('altitude', 'float64'),
+        ('heart_rate', 'int32'),
+        ('latitude', 'float64'), # NaN when the position is unknown
+        ('longitude', 'float64'),
+    )
+
+    def __init__(self, trackpoints=()):
+        self._size = 0
+        self.version = 0
+        self._columns = dict((name, numpy.empty(0, dtype)) for name, dtype in self.COLUMNS)
+        # the summary and the version it was computed for
+        self._summary = (0, TrackpointsSummary())
+
+        self.extend(trackpoints)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        columns = cls()
+        size = len(arrays['time'])
+
+        # the given arrays are used as is when they have the right type
+        for name, dtype in cls.COLUMNS:
+            if name in arrays:
+                columns._columns[name] = numpy.asarray(arrays[name], dtype=dtype)
+            else:
+                columns._columns[name] = numpy.full(size, numpy.nan if name in ('latitude', 'longitude') else 0, dtype=dtype)
+
+        columns._size = size
+        columns._summary = None
+
+        return columns
+
+    @property
+    def summary(self):
+        version, summary = self._summary or (None, None)
+
+        if version != self.version:
+            version = self.version
+            summary = TrackpointsSummary.from_arrays(
+                self.column('time'), self.column('distance'), self.column('heart_rate')
+            )
+            self._summary = (version, summary)
+
+        return summary
+
+    def column(self, name):
+        # read-only: changes must go through set_column() or the trackpoints
+        # views so that the summary is kept up to date
+        column = self._columns[name][:self._size]
+        column.flags.writeable = False
+
+        return column
+
+    def set_column(self, name, values):
+        self._columns[name][:self._size] = values
+        self._invalidate()
+
+    def arrays(self):
+        return dict((name, self.column(name)) for name, _ in self.COLUMNS)
+
+    def append(self, trackpoint):
+        if self._size == len(self._columns['time']):
+            self._reserve(max(16, 2 * self._size))
+
+        i = self._size
+        columns = self._columns
+        time = datetime_to_ns(trackpoint.time)
+
+        columns['time'][i] = time
+        columns['distance'][i] = trackpoint.distance
+        columns['altitude'][i] = trackpoint.altitude
+        columns['heart_rate'][i] = trackpoint.heart_rate
+
+        if trackpoint.position is None:
+            columns['latitude'][i] = columns['longitude'][i] = numpy.nan
+        else:
+            columns['latitude'][i] = trackpoint.position.latitude
+            columns['longitude'][i] = trackpoint.position.longitude
+
+        self._size += 1
+        version, summary = self._summary or (None, None)
+
+        if version == self.version:
+            summary.add(time, float(columns['distance'][i]), int(columns['heart_rate'][i]))
+            self._summary = (version + 1, summary)
+
+        self.version += 1
+
+    def extend(self, trackpoints):
+        if hasattr(trackpoints, '__len__'):
+            self._reserve(self._size + len(trackpoints))
+
+        for trackpoint in trackpoints:
+            self.append(trackpoint)
+
+    def __iadd__(self, trackpoints):
+        self.extend(trackpoints)
+
+        return self
+
+    def insert(self, index, trackpoint):
+        # same bounds as list.insert()
+        index = min(max(index + self._size if index < 0 else index, 0), self._size)
+        self._splice(index, index, TrackpointColumns([trackpoint]))
+
+    def pop(self, index=-1):
+        index = self._index(index)
+        trackpoint = self[index].copy()
+        self._splice(index, index + 1, TrackpointColumns())
+
+        return trackpoint
+
+    def remove(self, trackpoint):
+        # removes the first trackpoint with the same values
+        values = TrackpointColumns([trackpoint])
+        matches = numpy.ones(self._size, dtype='bool')
+
+        for name, _ in self.COLUMNS:
+            column, value = self.column(name), values.column(name)[0]
+            matches &= (column == value) | (numpy.isnan(column) & numpy.isnan(value) if column.dtype.kind == 'f' else False)
+
+        if not matches.any():
+            raise ValueError('trackpoint not in the lap')
+
+        index = int(numpy.argmax(matches))
+        self._splice(index, index + 1, TrackpointColumns())
+
+    def clear(self):
+        self._splice(0, self._size, TrackpointColumns())
+
+    def reverse(self):
+        self._take(numpy.arange(self._size)[::-1])
+
+    def sort(self, key=None, reverse=False):
+        # by time without key (trackpoints are not comparable)
+        if key is None:
+            keys = self.column('time')
+            order = numpy.argsort(-keys if reverse else keys, kind='mergesort')
+        else:
+            keys = [key(trackpoint) for trackpoint in self]
+            order = sorted(range(self._size), key=keys.__getitem__, reverse=reverse)
+
+        self._take(numpy.asarray(order, dtype='int64'))
+
+    def _index(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('trackpoint index out of range')
+
+        return index
+
+    def _splice(self, start, stop, values):
+        # replaces the trackpoints from start to stop by the given columns
+        for name, _ in self.COLUMNS:
+            column = self._columns[name]
+            self._columns[name] = numpy.concatenate((column[:start], values.column(name), column[stop:self._size]))
+
+        self._size += len(values) - (stop - start)
+        self._invalidate()
+
+    def _take(self, indices):
+        for name, _ in self.COLUMNS:
+            self._columns[name] = self._columns[name][:self._size][indices]
+
+        self._size = len(indices)
+        self._invalidate()
+
+    def _reserve(self, capacity):
+        if capacity <= len(self._columns['time']):
+            return
+
+        for name, column in self._columns.items():
+            grown = numpy.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    def _invalidate(self):
+        self._summary = None
+        self.version += 1
+
+    def __getstate__(self):
+        return {'arrays': self.arrays()}
+
+    def __setstate__(self, state):
+        self._size = len(state['arrays']['time'])
+        self._summary = None
+        self.version = 0
+        # unpickled arrays may be backed by immutable buffers
+        self._columns = dict(
+            (name, numpy.require(array, requirements='W')) for name, array in state['arrays'].items()
+        )
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [TrackpointView(self, i) for i in range(*index.indices(self._size))]
+
+        return TrackpointView(self, self._index(index))
+
+    def __setitem__(self, index, value):
+        if not isinstance(index, slice):
+            index = self._index(index)
+            self._splice(index, index + 1, TrackpointColumns([value]))
+            return
+
+        values = TrackpointColumns(list(value))
+        indices = range(*index.indices(self._size))
+
+        if index.step is None or index.step == 1:
+            self._splice(indices.start, max(indices.start, indices.stop), values)
+            return
+
+        if len(values) != len(indices):
+            raise ValueError('attempt to assign %d trackpoints to an extended slice of size %d' % (len(values), len(indices)))
+
+        for name, _ in self.COLUMNS:
+            self._columns[name][list(indices)] = values.column(name)
+
+        self._invalidate()
+
+    def __delitem__(self, index):
+        if not isinstance(index, slice):
+            index = self._index(index)
+            self._splice(index, index + 1, TrackpointColumns())
+            return
+
+        keep = numpy.ones(self._size, dtype='bool')
+        keep[index] = False
+        self._take(numpy.flatnonzero(keep))
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield TrackpointView(self, i)
+
+    def __repr__(self):
+        return '<TrackpointColumns: %d trackpoints>' % self._size
+
+class TrackpointView:
+    __slots__ = ('_container', '_index')
+
+    def __init__(self, container, index):
+        self._container = container
+        self._index = index
+
+    def _get(self, name):
+        return self._container._columns[name][self._index]
+
+    def _set(self, name, value):
+        self._container._columns[name][self._index] = value
+        self._container._invalidate()
+
+    @property
+    def time(self):
+        return ns_to_datetime(self._get('time'))
+
+    @time.setter
+    def time(self, value):
+        self._set('time', datetime_to_ns(value))
+
+    @property
+    def distance(self):
+        return float(self._get('distance'))
+
+    @distance.setter
+    def distance(self, value):
+        self._set('distance', value)
+
+    @property
+    def altitude(self):
+        return float(self._get('altitude'))
+
+    @altitude.setter
+    def altitude(self, value):
+        self._set('altitude', value)
+
+    @property
+    def heart_rate(self):
+        return int(self._get('heart_rate'))
+
+    @heart_rate.setter
+    def heart_rate(self, value):
+        self._set('heart_rate', value)
+
+    @property
+    def position(self):
+        if self._get('latitude') != self._get('latitude'): # NaN
+            return None
+
+        return PositionView(self._container, self._index)
+
+    @position.setter
+    def position(self, value):
+        if value is None:
+            self._set('latitude', numpy.nan)
+            self._set('longitude', numpy.nan)
+        else:
+            self._set('latitude', value.latitude)
+            self._set('longitude', value.longitude)
+
+    def copy(self):
+        # a Trackpoint with the same values, independent of the columns
+        trackpoint = Trackpoint(self.time)
+        trackpoint.distance = self.distance
+        trackpoint.altitude = self.altitude
+        trackpoint.heart_rate = self.heart_rate
+
+        position = self.position
+        if position is not None:
+            trackpoint.position = Position(position.latitude, position.longitude)
+
+        return trackpoint
+
+    def __repr__(self):
+        return '<Trackpoint: %s; distance %d; heart rate %d>' % (
+            self.time,
+            self.distance,
+            self.heart_rate
+        )
+
 class Position:
     def __init__(self, latitude, longitude):
         self.latitude = latitude
@@ -139,3 +654,29 @@ class Position:
             self.latitude,
             self.longitude
         )
+
+class PositionView(Position):
+    # the position of a TrackpointView, changing it changes the columns
+    __slots__ = ('_container', '_index')
+
+    def __init__(self, container, index):
+        self._container = container
+        self._index = index
+
+    @property
+    def latitude(self):
+        return float(self._container._columns['latitude'][self._index])
+
+    @latitude.setter
+    def latitude(self, value):
+        self._container._columns['latitude'][self._index] = value
+        self._container._invalidate()
+
+    @property
+    def longitude(self):
+        return float(self._container._columns['longitude'][self._index])
+
+    @longitude.setter
+    def longitude(self, value):
+        self._container._columns['longitude'][self._index] = value
+        self._container._invalidate()
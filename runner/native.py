@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Native activity format: a small JSON header describing the activity and
+# its laps, followed by the trackpoints columns of all the laps stored as
+# raw little-endian arrays. The columns are aligned so that the file can be
+# memory-mapped and used without copying them.
+#
+#   magic (8 bytes) | header length (uint32) | JSON header | padding | columns
+
+import json, mmap, struct
+
+import numpy
+
+import runner.model as model
+from runner.timestamp import format_timestamp, parse_timestamp
+
+MAGIC = b'RUNNERAC'
+VERSION = 1
+ALIGNMENT = 64
+
+COLUMNS_DTYPES = {
+    'time': '<i8',
+    'distance': '<f8',
+    'altitude': '<f8',
+    'heart_rate': '<i4',
+    'latitude': '<f8',
+    'longitude': '<f8',
+}
+
+class InvalidNativeFileError(RuntimeError):
+    pass
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def write_activity(activity, stream):
+    count = sum(len(lap.trackpoints) for lap in activity.laps)
+    header = {
+        'version': VERSION,
+        'type': activity.type,
+        'count': count,
+        'laps': [_dump_lap(lap) for lap in activity.laps],
+    }
+
+    # the offsets of the columns depend on the length of the header, which
+    # depends on the offsets: reserve enough room for them first
+    columns = []
+    header['columns'] = columns
+    for name, _ in model.TrackpointColumns.COLUMNS:
+        columns.append({'name': name, 'dtype': COLUMNS_DTYPES[name], 'offset': 10 ** 15})
+
+    start = _align(len(MAGIC) + 4 + len(json.dumps(header).encode('utf-8')))
+    for column in columns:
+        column['offset'] = start
+        start = _align(start + count * numpy.dtype(column['dtype']).itemsize)
+
+    encoded_header = json.dumps(header).encode('utf-8')
+    stream.write(MAGIC + struct.pack('<I', len(encoded_header)) + encoded_header)
+    position = len(MAGIC) + 4 + len(encoded_header)
+
+    for column in columns:
+        stream.write(b'\0' * (column['offset'] - position))
+        position = column['offset']
+
+        for lap in activity.laps:
+            data = lap.trackpoints.column(column['name']).astype(column['dtype'], copy=False).tobytes()
+            stream.write(data)
+            position += len(data)
+
+def _dump_lap(lap):
+    return {
+        'count': len(lap.trackpoints),
+        'start_time': None if lap._start_time is None else format_timestamp(lap._start_time),
+        'duration': lap.duration,
+        'distance': lap.distance,
+        'calories': lap.calories,
+        'max_speed': lap.max_speed,
+        'trigger_method': lap.trigger_method,
+        'avg_heart_rate': lap._avg_heart_rate,
+        'max_heart_rate': lap._max_heart_rate,
+    }
+
+def read_activity(native_file):
+    # native_file is a filename (memory-mapped), a file object or bytes
+    if isinstance(native_file, (bytes, bytearray)):
+        buffer = bytearray(native_file)
+    elif hasattr(native_file, 'read'):
+        buffer = bytearray(native_file.read())
+    else:
+        with open(native_file, 'rb') as source:
+            # copy-on-write: the arrays can be modified without changing the file
+            buffer = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    return _load_activity(buffer)
+
+def _load_activity(buffer):
+    if len(buffer) < len(MAGIC) + 4 or buffer[:len(MAGIC)] != MAGIC:
+        raise InvalidNativeFileError('Not a native activity file')
+
+    header_length, = struct.unpack('<I', buffer[len(MAGIC):len(MAGIC) + 4])
+    header = json.loads(buffer[len(MAGIC) + 4:len(MAGIC) + 4 + header_length].decode('utf-8'))
+
+    if header['version'] > VERSION:
+        raise InvalidNativeFileError('Unsupported native file version: %d' % header['version'])
+
+    count = header['count']
+    arrays = {}
+    for column in header['columns']:
+        arrays[column['name']] = numpy.frombuffer(buffer, dtype=column['dtype'], count=count, offset=column['offset'])
+
+    activity = model.Activity()
+    if header['type'] is not None:
+        activity.type = header['type']
+
+    start = 0
+    for lap_header in header['laps']:
+        end = start + lap_header['count']
+        lap = _load_lap(lap_header)
+        lap.trackpoints = model.TrackpointColumns.from_arrays(
+            dict((name, array[start:end]) for name, array in arrays.items())
+        )
+        activity.laps.append(lap)
+        start = end
+
+    return activity
+
+def _load_lap(lap_header):
+    lap = model.Lap(None if lap_header['start_time'] is None else parse_timestamp(lap_header['start_time']))
+
+    lap.duration = lap_header['duration']
+    lap.distance = lap_header['distance']
+    lap.calories = lap_header['calories']
+    lap.max_speed = lap_header['max_speed']
+    lap.avg_heart_rate = lap_header['avg_heart_rate']
+    lap.max_heart_rate = lap_header['max_heart_rate']
+
+    if lap_header['trigger_method'] is not None:
+        lap.trigger_method = lap_header['trigger_method']
+
+    return lap
@@ -1,43 +1,218 @@
 #!/usr/bin/env python
 
-import fitparse, os
-from lxml import objectify
+import numpy
 
+import runner.formats as formats
 import runner.model as model
+from runner.events import activities_from_events, activity_events
+from runner.timestamp import ns_to_datetime, parse_timestamps
+
+# number of trackpoints whose times are parsed at once in the XML files
+TIMESTAMPS_CHUNK_SIZE = 4096
 
 class ParserNotFoundError(RuntimeError):
     pass
 
-class GPXParser:
-    def parse(self, gpx_file):
-        tree = objectify.parse(gpx_file)
-        root = tree.getroot()
+class InvalidFileError(RuntimeError):
+    pass
 
-        return self._parse_activity(root)
+def iterparse(*args, **kwargs):
+    # lxml is only imported when an XML file is parsed
+    from lxml import etree
 
-    def _parse_activity(self, activity_xml):
-        activity = model.Activity()
+    return etree.iterparse(*args, **kwargs)
 
-        for track in activity_xml.trk:
-            activity.laps.append(self._parse_track(track))
+class XMLParser:
+    def parse(self, xml_file):
+        for activity in self.iter_activities(xml_file):
+            return activity
 
-        return activity
+        raise InvalidFileError('No activity found in the given file')
+
+    def iter_activities(self, xml_file):
+        return activities_from_events(self._iter_events(xml_file))
+
+    def iter_laps(self, xml_file):
+        lap = None
+
+        for event, item in self._iter_events(xml_file):
+            if event == 'trackpoint':
+                lap.trackpoints.append(item)
+            elif event == 'start_lap':
+                lap = item
+            elif event == 'end_lap':
+                yield lap
+
+    def iter_trackpoints(self, xml_file):
+        for event, item in self._iter_events(xml_file):
+            if event == 'trackpoint':
+                yield item
+
+    def iter_events(self, xml_file):
+        # see runner.events for the events given
+        return self._iter_events(xml_file)
+
+    def _iter_events(self, xml_file):
+        # the times of the trackpoints are parsed by chunks, the trackpoints
+        # being held until the next chunk is full or another event comes
+        pending = []
+
+        for event, item in self._iter_element_events(xml_file):
+            if event == 'trackpoint':
+                pending.append(item)
+
+                if len(pending) < TIMESTAMPS_CHUNK_SIZE:
+                    continue
+
+            for trackpoint in self._with_times(pending):
+                yield 'trackpoint', trackpoint
+            pending = []
+
+            if event != 'trackpoint':
+                yield event, item
+
+        for trackpoint in self._with_times(pending):
+            yield 'trackpoint', trackpoint
+
+    def _iter_element_events(self, xml_file):
+        # same events as _iter_events, but the trackpoints are given as
+        # (trackpoint without time, time string) pairs
+        raise NotImplementedError()
+
+    def _with_times(self, pending):
+        times = parse_timestamps([time for _, time in pending]).tolist() if pending else []
+
+        for (trackpoint, _), time in zip(pending, times):
+            trackpoint.time = ns_to_datetime(time)
+
+            yield trackpoint
+
+    def _find_number(self, node, path, default=None):
+        text = node.findtext(path)
+
+        return default if text is None else self._to_number(text)
+
+    def _children(self, node):
+        # a single pass over the children is much faster than one lookup
+        # per field
+        return dict((child.tag, child) for child in node)
+
+    def _child_number(self, children, tag, default=None):
+        child = children.get(tag)
+
+        return default if child is None else self._to_number(child.text)
+
+    def _to_number(self, text):
+        # same conversion as the one done by lxml.objectify
+        if '.' not in text:
+            try:
+                return int(text)
+            except ValueError:
+                pass
+
+        return float(text)
+
+    def _release(self, element):
+        # free the element and the already processed siblings
+        element.clear()
+
+        parent = element.getparent()
+        while element.getprevious() is not None:
+            del parent[0]
+
+class GPXParser(XMLParser):
+    TRACKPOINT_EXTENSION_NS = 'http://www.garmin.com/xmlschemas/TrackPointExtension/v1'
+
+    def iter_segments(self, gpx_file):
+        segment = None
+
+        for event, item in self._iter_events(gpx_file):
+            if event == 'trackpoint':
+                segment.append(item)
+            elif event == 'start_segment':
+                segment = []
+            elif event == 'end_segment':
+                yield segment
+
+    def _iter_events(self, gpx_file):
+        # the duration of a lap is given by the times of its trackpoints
+        first_time = last_time = None
+
+        for event, item in XMLParser._iter_events(self, gpx_file):
+            if event == 'trackpoint':
+                first_time = item.time if first_time is None else min(first_time, item.time)
+                last_time = item.time if last_time is None else max(last_time, item.time)
+            elif event == 'start_lap':
+                first_time = last_time = None
+            elif event == 'end_lap' and first_time is not None:
+                item.duration = (last_time - first_time).total_seconds()
+
+            yield event, item
+
+    def _iter_element_events(self, gpx_file):
+        context = iterparse(
+            gpx_file, events=('start', 'end'),
+            tag=('{*}gpx', '{*}trk', '{*}trkseg', '{*}trkpt')
+        )
+        ns = extension_ns = None
+        activity = lap = None
+
+        for event, element in context:
+            if ns is None:
+                # the namespaces are resolved once for the whole document
+                ns = element.tag[:element.tag.rfind('}') + 1]
+                extension_ns = '{%s}' % element.nsmap.get('gpxtpx', self.TRACKPOINT_EXTENSION_NS)
 
-    def _parse_track(self, track_xml):
-        track = model.Lap()
+            name = element.tag[len(ns):]
 
-        for segment in track_xml.trkseg:
-            for trackpoint in segment.trkpt:
-                track.trackpoints.append(self._parse_trackpoint(trackpoint))
+            if name == 'trkpt':
+                if event == 'end' and lap is not None:
+                    trackpoint = self._parse_trackpoint(element, ns, extension_ns)
+                    self._release(element)
 
-        track.duration = (track.end_time - track.start_time).total_seconds()
+                    yield 'trackpoint', trackpoint
+            elif name == 'trkseg':
+                if lap is None:
+                    continue
 
-        return track
+                if event == 'start':
+                    yield 'start_segment', lap
+                else:
+                    self._release(element)
 
-    def _parse_trackpoint(self, trackpoint_xml):
-        trackpoint = model.Trackpoint(trackpoint_xml.time.pyval)
+                    yield 'end_segment', lap
+            elif name == 'trk':
+                if event == 'start':
+                    lap = model.Lap()
 
-        trackpoint.altitude = self._get_or_else(trackpoint_xml, 'ele', 0)
+                    yield 'start_lap', lap
+                    continue
+
+                self._release(element)
+
+                yield 'end_lap', lap
+                lap = None
+            elif name == 'gpx':
+                if event == 'start':
+                    activity = model.Activity()
+
+                    yield 'start_activity', activity
+                else:
+                    yield 'end_activity', activity
+
+    def _parse_trackpoint(self, trackpoint_xml, ns, extension_ns):
+        values = self._children(trackpoint_xml)
+
+        trackpoint = model.Trackpoint()
+
+        if ns + 'ele' in values:
+            trackpoint.altitude = self._to_number(values[ns + 'ele'].text)
+
+        # older versions of GPXDumper omitted the <extensions> wrapper
+        extension = values.get(ns + 'extensions', trackpoint_xml)
+        extension = extension.find(extension_ns + 'TrackPointExtension')
+        if extension is not None:
+            trackpoint.heart_rate = self._find_number(extension, extension_ns + 'hr', 0)
 
         if trackpoint_xml.get('lat') is not None and trackpoint_xml.get('lon') is not None:
             trackpoint.position = model.Position(
@@ -45,152 +220,277 @@ class GPXParser:
                 float(trackpoint_xml.get('lon'))
             )
 
-        for child in trackpoint_xml.extensions:
-            heart_rate = child.find('.//gpxtpx:hr', namespaces={'gpxtpx': child.nsmap['gpxtpx']})
+        return trackpoint, values[ns + 'time'].text
 
-            if heart_rate is not None:
-                trackpoint.heart_rate = heart_rate
-
-        return trackpoint
+class TCXParser(XMLParser):
+    def _iter_element_events(self, tcx_file):
+        context = iterparse(
+            tcx_file, events=('start', 'end'),
+            tag=('{*}Activity', '{*}Lap', '{*}Track', '{*}Trackpoint')
+        )
+        ns = None
+        activity = lap = None
+        lap_started = False
+
+        for event, element in context:
+            if ns is None:
+                # the namespace is resolved once for the whole document
+                ns = element.tag[:element.tag.rfind('}') + 1]
+
+            name = element.tag[len(ns):]
+
+            if name == 'Trackpoint':
+                if event == 'end' and lap is not None:
+                    trackpoint = self._parse_trackpoint(element, ns)
+                    self._release(element)
+
+                    yield 'trackpoint', trackpoint
+            elif name == 'Track':
+                # the lap summary always precedes its track(s)
+                if event == 'start' and lap is not None and not lap_started:
+                    self._parse_lap_summary(lap, element.getparent(), ns)
+                    lap_started = True
+
+                    yield 'start_lap', lap
+            elif name == 'Lap':
+                if activity is None:
+                    continue
+
+                if event == 'start':
+                    lap = model.Lap(element.get('StartTime'))
+                    lap_started = False
+                    continue
+
+                self._parse_lap_summary(lap, element, ns)
+                self._release(element)
+
+                if not lap_started:
+                    yield 'start_lap', lap
+
+                yield 'end_lap', lap
+                lap = None
+            elif name == 'Activity':
+                if event == 'start':
+                    activity = model.Activity()
+
+                    # try to retrieve the activity type
+                    if element.get('Sport') is not None:
+                        activity.type = element.get('Sport')
+
+                    yield 'start_activity', activity
+                    continue
+
+                self._release(element)
+
+                yield 'end_activity', activity
+                activity = None
+
+    def _parse_lap_summary(self, lap, lap_xml, ns):
+        lap.duration = self._find_number(lap_xml, ns + 'TotalTimeSeconds', 0) # in seconds
+        lap.distance = self._find_number(lap_xml, ns + 'DistanceMeters', 0)  # in meters
+        lap.calories = self._find_number(lap_xml, ns + 'Calories', 0)
+        lap.max_speed = self._find_number(lap_xml, ns + 'MaximumSpeed', 0) # in meters per second
+
+        trigger_method = lap_xml.findtext(ns + 'TriggerMethod')
+        if trigger_method is not None:
+            lap.trigger_method = trigger_method
+
+        lap.avg_heart_rate = self._find_number(lap_xml, ns + 'AverageHeartRateBpm/' + ns + 'Value', 0)
+        lap.max_heart_rate = self._find_number(lap_xml, ns + 'MaximumHeartRateBpm/' + ns + 'Value', 0)
+
+    def _parse_trackpoint(self, trackpoint_xml, ns):
+        values = self._children(trackpoint_xml)
+
+        trackpoint = model.Trackpoint()
+
+        if ns + 'DistanceMeters' in values:
+            trackpoint.distance = self._to_number(values[ns + 'DistanceMeters'].text)
+        if ns + 'AltitudeMeters' in values:
+            trackpoint.altitude = self._to_number(values[ns + 'AltitudeMeters'].text)
+        if ns + 'HeartRateBpm' in values:
+            heart_rate = self._children(values[ns + 'HeartRateBpm'])
+            trackpoint.heart_rate = self._child_number(heart_rate, ns + 'Value', 0)
+
+        if ns + 'Position' in values:
+            position = self._children(values[ns + 'Position'])
+            trackpoint.position = model.Position(
+                self._child_number(position, ns + 'LatitudeDegrees', 0),
+                self._child_number(position, ns + 'LongitudeDegrees', 0)
+            )
 
-    def _get_or_else(self, node, key, default=None):
-        try:
-            return node[key].pyval
-        except AttributeError:
-            return default
+        return trackpoint, values[ns + 'Time'].text
 
-class TCXParser:
-    def parse(self, tcx_file):
-        tree = objectify.parse(tcx_file)
-        root = tree.getroot()
+class FITParser:
+    MESSAGES = {
+        'activity': ['type'],
+        'session': ['sport'],
+        'lap': [
+            'timestamp', 'start_time', 'total_elapsed_time', 'total_distance',
+            'total_calories', 'max_speed', 'enhanced_max_speed', 'avg_heart_rate',
+            'max_heart_rate', 'sport',
+        ],
+        'record': [
+            'timestamp', 'position_lat', 'position_long', 'altitude',
+            'enhanced_altitude', 'heart_rate', 'distance',
+        ],
+    }
 
-        return self._parse_activity(root.Activities.Activity)
+    def parse(self, fit_file):
+        # only the messages and fields used by the model are decoded, the
+        # records directly into columns. The FIT modules are only imported
+        # when a FIT file is read.
+        import runner.fit as fit
 
-    def _parse_activity(self, activity_xml):
-        #activity = model.Activity(activity_xml.Id.pyval)
+        messages = fit.FITDecoder(self.MESSAGES).decode(fit_file)
         activity = model.Activity()
+        trigger_method = None
+
+        for message in messages['activity']:
+            if message['type'] is not None:
+                trigger_method = fit.ACTIVITY_TYPES.get(message['type'])
+
+        for message in messages['lap'] + messages['session']:
+            if message['sport'] in fit.SPORTS:
+                activity.type = fit.SPORTS[message['sport']]
+                break
+
+        laps = [self._parse_lap(message, trigger_method) for message in messages['lap']]
+        records = self._parse_records(messages['record'])
 
-        # try to retrieve the activity type
-        activity.type = activity_xml.get('Sport')
+        if not laps and len(records['time']):
+            laps = [model.Lap()]
 
-        for lap in activity_xml.Lap:
-            activity.laps.append(self._parse_lap(lap))
+        # lap messages are usually written after their records: the records
+        # are assigned to the laps using their start times
+        starts = numpy.array([self._lap_start(message) for message in messages['lap']], dtype='int64')
+        bounds = numpy.searchsorted(records['time'], starts[1:], side='left') if len(starts) else []
+        bounds = numpy.r_[0, bounds, len(records['time'])]
+
+        for lap, start, end in zip(laps, bounds[:-1], bounds[1:]):
+            lap.trackpoints = model.TrackpointColumns.from_arrays(
+                dict((name, column[start:end]) for name, column in records.items())
+            )
+            activity.laps.append(lap)
 
         return activity
 
-    def _parse_lap(self, lap_xml):
-        lap = model.Lap(lap_xml.get('StartTime'))
+    def _parse_lap(self, message, trigger_method):
+        import runner.fit as fit
+
+        start_time = message['start_time']
+        lap = model.Lap(None if start_time is None else fit.fit_timestamp_to_datetime(start_time))
 
-        lap.duration = self._get_or_else(lap_xml, 'TotalTimeSeconds', 0) # in seconds
-        lap.distance = self._get_or_else(lap_xml, 'DistanceMeters', 0)  # in meters
-        lap.calories = self._get_or_else(lap_xml, 'Calories', 0)
-        lap.max_speed = self._get_or_else(lap_xml, 'MaximumSpeed', 0) # in meters per second
-        lap.trigger_method = self._get_or_else(lap_xml, 'TriggerMethod', None)
+        if trigger_method is not None:
+            lap.trigger_method = trigger_method
 
-        lap.avg_heart_rate = self._parse_heart_rate_bpm(lap_xml, 'AverageHeartRateBpm')
-        lap.max_heart_rate = self._parse_heart_rate_bpm(lap_xml, 'MaximumHeartRateBpm')
+        max_speed = message['enhanced_max_speed'] if message['enhanced_max_speed'] is not None else message['max_speed']
 
-        for trackpoint in lap_xml.Track.Trackpoint:
-            lap.trackpoints.append(self._parse_trackpoint(trackpoint))
+        lap.duration = int(message['total_elapsed_time'] or 0)
+        lap.distance = int(message['total_distance'] or 0)
+        lap.calories = int(message['total_calories'] or 0)
+        lap.max_speed = float(max_speed or 0)
+        lap.avg_heart_rate = int(message['avg_heart_rate'] or 0)
+        lap.max_heart_rate = int(message['max_heart_rate'] or 0)
 
         return lap
 
-    def _parse_trackpoint(self, trackpoint_xml):
-        trackpoint = model.Trackpoint(trackpoint_xml.Time.pyval)
+    def _lap_start(self, message):
+        import runner.fit as fit
 
-        trackpoint.distance = self._get_or_else(trackpoint_xml, 'DistanceMeters', 0)
-        trackpoint.altitude = self._get_or_else(trackpoint_xml, 'AltitudeMeters', 0)
-        trackpoint.heart_rate = self._parse_heart_rate_bpm(trackpoint_xml, 'HeartRateBpm')
+        if message['start_time'] is not None:
+            start = message['start_time']
+        elif message['timestamp'] is not None:
+            start = message['timestamp'] - (message['total_elapsed_time'] or 0)
+        else:
+            start = 0
 
-        try:
-            trackpoint.position = self._parse_position(trackpoint_xml.Position)
-        except AttributeError:
-            pass
+        return (int(start) + fit.FIT_EPOCH) * 10 ** 9
 
-        return trackpoint
+    def _parse_records(self, records):
+        import runner.fit as fit
 
-    def _parse_position(self, position_xml):
-        return model.Position(
-            self._get_or_else(position_xml, 'LatitudeDegrees', 0),
-            self._get_or_else(position_xml, 'LongitudeDegrees', 0)
-        )
+        altitude = numpy.where(numpy.isnan(records['enhanced_altitude']), records['altitude'], records['enhanced_altitude'])
 
-    def _parse_heart_rate_bpm(self, node, key, default=0):
-        try:
-            return node[key].Value.pyval
-        except AttributeError:
-            return default
+        return {
+            'time': (records['timestamp'] + fit.FIT_EPOCH) * 10 ** 9,
+            'distance': numpy.nan_to_num(records['distance']),
+            'altitude': numpy.nan_to_num(altitude),
+            'heart_rate': numpy.nan_to_num(records['heart_rate']).astype('int32'),
+            'latitude': records['position_lat'],
+            'longitude': records['position_long'],
+        }
 
-    def _get_or_else(self, node, key, default=None):
-        try:
-            return node[key].pyval
-        except AttributeError:
-            return default
+class NativeParser:
+    def parse(self, native_file):
+        import runner.native as native
 
-class FITParser:
-    def parse(self, fit_file):
-        fitfile = fitparse.FitFile(
-            fit_file,
-            data_processor=fitparse.StandardUnitsDataProcessor(),
-        )
-        activity = model.Activity()
-        data = {}
+        return native.read_activity(native_file)
 
-        for message in fitfile.get_messages():
-            self._handle_message(message, activity, data)
+def parser_for_format(extension):
+    parser = formats.parsers.get(extension)
 
-        return activity
+    if parser is None:
+        raise ParserNotFoundError('Not parser for extension: ' + str(extension))
 
-    def _handle_message(self, message, activity, data):
-        if message.name == 'activity':
-            data['trigger_method'] = message.get('type').value
-        elif message.name == 'lap':
-            self._handle_lap(message, activity, data)
-        elif message.name == 'record':
-            self._handle_record(message, activity, data)
+    return parser()
 
-    def _handle_lap(self, message, activity, data):
-        lap = model.Lap(message.get('start_time').value)
+def parser_for_file(filename):
+    extension, _ = formats.split_extension(filename)
 
-        lap.trigger_method = data['trigger_method']
-        lap.duration = int(self._get_or_else(message, 'total_elapsed_time', 0))
-        lap.distance = int(self._get_or_else(message, 'total_distance', 0))
-        lap.calories = int(self._get_or_else(message, 'total_calories', 0))
-        lap.max_speed = float(self._get_or_else(message, 'max_speed', 0))
-        lap.avg_heart_rate = int(self._get_or_else(message, 'avg_heart_rate', 0))
-        lap.max_heart_rate = int(self._get_or_else(message, 'max_heart_rate', 0))
+    return parser_for_format(extension)
 
-        activity.type = message.get('sport').value
-        activity.laps.append(lap)
+def parse(source, format=None):
+    # source: a filename, bytes, a file object or a mmap, compressed or not.
+    # The format (an extension) is sniffed from the content when it isn't
+    # given nor known from the filename.
+    if formats.is_filename(source):
+        extension, compression = formats.split_extension(source)
 
-    def _handle_record(self, message, activity, data):
-        trackpoint = model.Trackpoint(message.get('timestamp').value)
+        # the parsers read the uncompressed files directly
+        if compression is None and (format or extension) in formats.parsers:
+            return parser_for_format(format or extension).parse(source)
 
-        trackpoint.heart_rate = int(self._get_or_else(message, 'heart_rate', 0))
+    with formats.Source(source, format) as stream:
+        if stream.format is None:
+            raise ParserNotFoundError('Unknown format')
 
-        activity.laps[-1].trackpoints.append(trackpoint)
+        return parser_for_format(stream.format).parse(stream)
 
-    def _get_or_else(self, message, key, default=None):
-        value = message.get(key)
+def parse_from_file(filename, cache=None):
+    # cache: an ActivityCache, None to use the default one (if configured)
+    # or False to disable it
+    if cache is None:
+        from runner.cache import default_cache
 
-        return value.value if value is not None and value.value is not None else default
+        cache = default_cache()
 
-def parser_for_file(filename):
-    parsers_map = {
-        'fit': FITParser,
-        'gpx': GPXParser,
-        'tcx': TCXParser
-    }
+    if cache:
+        activity = cache.get(filename)
+
+        if activity is not None:
+            return activity
 
-    _, extension = os.path.splitext(filename)
-    extension = extension[1:] # remove the leading '.'
+    activity = parse(filename)
 
-    try:
-        return parsers_map[extension]()
-    except KeyError:
-        raise ParserNotFoundError('Not parser for extension: ' + extension)
+    if cache:
+        cache.put(filename, activity)
 
-def parse_from_file(filename):
+    return activity
+
+def iter_events_from_file(filename):
+    # the XML files are streamed, the other ones are read at once
     parser = parser_for_file(filename)
 
-    return parser.parse(filename)
+    if not hasattr(parser, 'iter_events'):
+        return activity_events(parse_from_file(filename))
+
+    if formats.split_extension(filename)[1] is None:
+        return parser.iter_events(filename)
+
+    return _iter_compressed_events(parser, filename)
+
+def _iter_compressed_events(parser, filename):
+    # the file is kept open while the events are consumed
+    with formats.Source(filename) as stream:
+        for event in parser.iter_events(stream):
+            yield event
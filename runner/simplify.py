@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# Simplification of the tracks of an activity, to shrink the files sent to
+# map clients: geometric simplification (Douglas-Peucker or Visvalingam) with
+# a tolerance in meters, and time-based resampling. The positions are
+# projected once on a local plane, and every step of both algorithms handles
+# all the points at once instead of one segment or one triangle at a time.
+
+import numpy
+
+import runner.model as model
+from runner.spatial import EARTH_RADIUS
+
+DOUGLAS_PEUCKER = 'douglas-peucker'
+VISVALINGAM = 'visvalingam'
+METHODS = (DOUGLAS_PEUCKER, VISVALINGAM)
+
+def project(latitude, longitude):
+    # (x, y) in meters on an equirectangular projection centered on the
+    # track, accurate enough at the scale of an activity
+    if not len(latitude):
+        return numpy.empty(0), numpy.empty(0)
+
+    reference = numpy.radians(numpy.mean(latitude))
+    # the longitudes are unwrapped around the first one (antimeridian)
+    longitude = (longitude - longitude[0] + 180) % 360 - 180
+
+    return EARTH_RADIUS * numpy.radians(longitude) * numpy.cos(reference), EARTH_RADIUS * numpy.radians(latitude)
+
+def segment_distances(x, y, x1, y1, x2, y2):
+    # distances from the points to the segments [(x1, y1), (x2, y2)]
+    dx, dy = x2 - x1, y2 - y1
+    lengths = dx * dx + dy * dy
+    ratios = numpy.clip(((x - x1) * dx + (y - y1) * dy) / numpy.where(lengths > 0, lengths, 1), 0, 1)
+
+    return numpy.hypot(x - x1 - ratios * dx, y - y1 - ratios * dy)
+
+def douglas_peucker(x, y, tolerance):
+    # mask of the points kept so that no point is more than tolerance away
+    # from the simplified track. Each pass splits all the segments that are
+    # still too far from their points at their farthest point.
+    keep = numpy.zeros(len(x), dtype='bool')
+    keep[[0, -1] if len(x) else []] = True
+
+    # the points not settled yet, with the ends of their segment
+    active = numpy.arange(1, max(len(x) - 1, 1))
+    first = numpy.zeros(len(active), dtype='int64')
+    last = numpy.full(len(active), len(x) - 1, dtype='int64')
+
+    while len(active):
+        distances = segment_distances(x[active], y[active], x[first], y[first], x[last], y[last])
+
+        # the active points are sorted: the ones of a segment are contiguous
+        starts = numpy.flatnonzero(numpy.r_[True, first[1:] != first[:-1]])
+        counts = numpy.diff(numpy.r_[starts, len(active)])
+        maxima = numpy.repeat(numpy.maximum.reduceat(distances, starts), counts)
+        farthest = numpy.minimum.reduceat(numpy.where(distances == maxima, active, len(x)), starts)
+        farthest = numpy.repeat(farthest, counts)
+
+        split = maxima > tolerance
+        keep[farthest[split]] = True
+
+        first = numpy.where(active > farthest, farthest, first)
+        last = numpy.where(active < farthest, farthest, last)
+        active, first, last = [values[split & (active != farthest)] for values in (active, first, last)]
+
+    return keep
+
+def triangle_areas(x, y, kept):
+    # areas of the triangles formed by each kept point and its neighbours,
+    # infinite for the first and last points
+    areas = numpy.full(len(kept), numpy.inf)
+    a, b, c = kept[:-2], kept[1:-1], kept[2:]
+    areas[1:-1] = numpy.abs((x[b] - x[a]) * (y[c] - y[a]) - (x[c] - x[a]) * (y[b] - y[a])) / 2
+
+    return areas
+
+def visvalingam(x, y, tolerance):
+    # mask of the points kept so that every point left forms with its
+    # neighbours a triangle of at least tolerance^2 square meters. Each pass
+    # removes the points whose triangle is smaller than the ones of their
+    # neighbours, never two neighbours at once.
+    keep = numpy.ones(len(x), dtype='bool')
+    threshold = tolerance * tolerance
+
+    while True:
+        kept = numpy.flatnonzero(keep)
+        areas = triangle_areas(x, y, kept)
+        bounded = numpy.r_[numpy.inf, areas, numpy.inf]
+        candidates = (areas < threshold) & (areas <= bounded[:-2]) & (areas <= bounded[2:])
+
+        if not candidates.any():
+            return keep
+
+        # only every other point of a run of candidates (equal areas)
+        runs = numpy.flatnonzero(numpy.diff(numpy.r_[False, candidates]) > 0)
+        offsets = numpy.arange(len(kept)) - runs[numpy.maximum(numpy.searchsorted(runs, numpy.arange(len(kept)), side='right') - 1, 0)]
+
+        keep[kept[candidates & (offsets % 2 == 0)]] = False
+
+def resample(time, interval):
+    # mask of the first point of each interval (in seconds), and of the last
+    # point
+    if not len(time):
+        return numpy.zeros(0, dtype='bool')
+
+    buckets = (time - time[0]) // int(interval * 1e9)
+    keep = numpy.r_[True, buckets[1:] != buckets[:-1]]
+    keep[-1] = True
+
+    return keep
+
+class Simplifier:
+    def __init__(self, tolerance=None, method=DOUGLAS_PEUCKER, interval=None):
+        if method not in METHODS:
+            raise RuntimeError('Unknown simplification method: %s' % method)
+
+        if tolerance is not None and tolerance < 0:
+            raise RuntimeError('Invalid simplification tolerance given: %s' % tolerance)
+
+        if interval is not None and interval <= 0:
+            raise RuntimeError('Invalid resampling interval given: %s' % interval)
+
+        self.tolerance = tolerance # in meters
+        self.method = method
+        self.interval = interval # in seconds
+
+    def simplify(self, activity):
+        # simplifies the laps in place, their summaries are kept
+        for lap in activity.laps:
+            arrays = lap.trackpoints.arrays()
+            keep = self.keep(arrays)
+
+            if not keep.all():
+                lap.trackpoints = model.TrackpointColumns.from_arrays(
+                    dict((name, values[keep]) for name, values in arrays.items())
+                )
+
+        return activity
+
+    def keep(self, arrays):
+        # mask of the trackpoints kept. The ones without position are only
+        # resampled: the geometry doesn't say anything about them.
+        keep = numpy.ones(len(arrays['time']), dtype='bool')
+
+        if self.interval is not None:
+            keep &= resample(arrays['time'], self.interval)
+
+        if self.tolerance is not None:
+            points = numpy.flatnonzero(keep & ~(numpy.isnan(arrays['latitude']) | numpy.isnan(arrays['longitude'])))
+            x, y = project(arrays['latitude'][points], arrays['longitude'][points])
+            algorithm = douglas_peucker if self.method == DOUGLAS_PEUCKER else visvalingam
+
+            keep[points[~algorithm(x, y, self.tolerance)]] = False
+
+        return keep
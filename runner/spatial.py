@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# Spatial index of the positions of activities, on a grid of cells of
+# CELL_SIZE degrees: a cell is identified by a single integer, and the
+# trackpoints of an activity are sorted by cell so that the ones of a cell
+# are found by a binary search. The catalog stores the cells each activity
+# goes through to query a whole library.
+
+import numpy
+
+EARTH_RADIUS = 6371000.0 # in meters
+CELL_SIZE = 0.01 # in degrees, about 1.1 km of latitude
+COLUMNS = int(round(360 / CELL_SIZE))
+ROWS = int(round(180 / CELL_SIZE))
+
+def _rows(latitude):
+    return numpy.clip(numpy.floor((numpy.asarray(latitude) + 90) / CELL_SIZE).astype('int64'), 0, ROWS - 1)
+
+def _columns(longitude):
+    return numpy.clip(numpy.floor((numpy.asarray(longitude) + 180) / CELL_SIZE).astype('int64'), 0, COLUMNS - 1)
+
+def cell_ids(latitude, longitude):
+    return _rows(latitude) * COLUMNS + _columns(longitude)
+
+def cell_bounds(min_latitude, min_longitude, max_latitude, max_longitude):
+    # (first cell, last cell, [(first column, last column)...]) of the
+    # bounding box: its cells are the ones between the first and last ones
+    # with a column in the ranges. A box with min_longitude > max_longitude
+    # crosses the antimeridian, and has two ranges of columns.
+    first_column, last_column = int(_columns(min_longitude)), int(_columns(max_longitude))
+
+    if min_longitude <= max_longitude:
+        columns = [(first_column, last_column)]
+    else:
+        columns = [(first_column, COLUMNS - 1), (0, last_column)]
+
+    return int(_rows(min_latitude)) * COLUMNS, (int(_rows(max_latitude)) + 1) * COLUMNS - 1, columns
+
+def cell_ranges(min_latitude, min_longitude, max_latitude, max_longitude):
+    # (first, last) cells of each row of the bounding box
+    first_cell, last_cell, columns = cell_bounds(min_latitude, min_longitude, max_latitude, max_longitude)
+
+    return [
+        (row * COLUMNS + first, row * COLUMNS + last)
+        for row in range(first_cell // COLUMNS, last_cell // COLUMNS + 1)
+        for first, last in columns
+    ]
+
+def distances(latitude, longitude, latitudes, longitudes):
+    # distances (in meters) from a point to several ones, haversine formula
+    latitude, longitude = numpy.radians(latitude), numpy.radians(longitude)
+    latitudes, longitudes = numpy.radians(latitudes), numpy.radians(longitudes)
+
+    a = numpy.sin((latitudes - latitude) / 2) ** 2 + \
+        numpy.cos(latitude) * numpy.cos(latitudes) * numpy.sin((longitudes - longitude) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1)))
+
+def track_length(latitude, longitude):
+    # length (in meters) of the track going through the known positions
+    known = ~(numpy.isnan(latitude) | numpy.isnan(longitude))
+    latitude, longitude = latitude[known], longitude[known]
+
+    if len(latitude) < 2:
+        return 0.0
+
+    return float(numpy.sum(distances(latitude[:-1], longitude[:-1], latitude[1:], longitude[1:])))
+
+def circle_bbox(latitude, longitude, radius):
+    # (min_latitude, min_longitude, max_latitude, max_longitude) around a
+    # circle of radius meters
+    delta = numpy.degrees(radius / EARTH_RADIUS)
+    min_latitude, max_latitude = max(latitude - delta, -90.0), min(latitude + delta, 90.0)
+
+    if min_latitude <= -90 or max_latitude >= 90:
+        return min_latitude, -180.0, max_latitude, 180.0
+
+    # the longitudes are closer near the poles
+    delta /= max(numpy.cos(numpy.radians(max(abs(min_latitude), abs(max_latitude)))), 1e-9)
+
+    if delta >= 180:
+        return min_latitude, -180.0, max_latitude, 180.0
+
+    wrap = lambda value: (value + 180) % 360 - 180
+
+    return min_latitude, wrap(longitude - delta), max_latitude, wrap(longitude + delta)
+
+def in_bbox(latitude, longitude, min_latitude, min_longitude, max_latitude, max_longitude):
+    inside = (latitude >= min_latitude) & (latitude <= max_latitude)
+
+    if min_longitude <= max_longitude:
+        return inside & (longitude >= min_longitude) & (longitude <= max_longitude)
+
+    return inside & ((longitude >= min_longitude) | (longitude <= max_longitude))
+
+class TrackIndex:
+    # index of the trackpoints of an activity, the trackpoints are given by
+    # their position in the arrays of the activity (see Activity.to_arrays)
+    def __init__(self, latitude, longitude):
+        self.latitude = numpy.asarray(latitude, dtype='float64')
+        self.longitude = numpy.asarray(longitude, dtype='float64')
+
+        points = numpy.flatnonzero(~(numpy.isnan(self.latitude) | numpy.isnan(self.longitude)))
+        cells = cell_ids(self.latitude[points], self.longitude[points])
+        order = numpy.argsort(cells, kind='mergesort')
+
+        self._points = points[order]
+        self._cells = cells[order]
+
+    @classmethod
+    def from_activity(cls, activity):
+        arrays = activity.to_arrays()
+
+        return cls(arrays['latitude'], arrays['longitude'])
+
+    def cells(self):
+        # the cells the activity goes through, with their number of points
+        return numpy.unique(self._cells, return_counts=True)
+
+    def in_bbox(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        # the sorted indices of the trackpoints in the bounding box
+        candidates = self._candidates(cell_ranges(min_latitude, min_longitude, max_latitude, max_longitude))
+        inside = in_bbox(
+            self.latitude[candidates], self.longitude[candidates],
+            min_latitude, min_longitude, max_latitude, max_longitude
+        )
+
+        return numpy.sort(candidates[inside])
+
+    def near(self, latitude, longitude, radius):
+        # the sorted indices of the trackpoints at most radius meters away
+        candidates = self.in_bbox(*circle_bbox(latitude, longitude, radius))
+        close = distances(latitude, longitude, self.latitude[candidates], self.longitude[candidates]) <= radius
+
+        return candidates[close]
+
+    def _candidates(self, ranges):
+        bounds = [
+            (numpy.searchsorted(self._cells, first, side='left'), numpy.searchsorted(self._cells, last, side='right'))
+            for first, last in ranges
+        ]
+
+        return numpy.concatenate([self._points[start:end] for start, end in bounds] or [numpy.empty(0, dtype='int64')])
+
+    def save(self, path):
+        # the index is stored with the positions, e.g. next to the activity
+        with open(path, 'wb') as output:
+            numpy.savez(output, latitude=self.latitude, longitude=self.longitude, points=self._points, cells=self._cells)
+
+    @classmethod
+    def load(cls, path):
+        with numpy.load(path) as data:
+            index = cls.__new__(cls)
+            index.latitude, index.longitude = data['latitude'], data['longitude']
+            index._points, index._cells = data['points'], data['cells']
+
+        return index
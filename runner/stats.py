@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+# Instrumentation of the processing stages (parse, edit, fuse, dump...): each
+# stage records its elapsed time, the number of trackpoints it handled and the
+# peak memory of the process. The stages are given to callbacks as soon as
+# they end, and can be reported as text or JSON.
+
+import json, sys, time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+def peak_rss():
+    # peak resident set size of the process, in bytes
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # in kilobytes on linux, in bytes on OS X
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+def count_trackpoints(activity):
+    return sum(len(lap.trackpoints) for lap in activity.laps)
+
+def count_trackpoint_events(events, stage):
+    # counts the trackpoints of a stream of events as they flow
+    stage.trackpoints = stage.trackpoints or 0
+
+    for event, item in events:
+        if event == 'trackpoint':
+            stage.trackpoints += 1
+
+        yield event, item
+
+class Stage:
+    def __init__(self, name, **info):
+        self.name = name
+        self.info = info
+        self.trackpoints = None
+        self.elapsed = None # in seconds
+        self.cpu_time = None # in seconds
+        self.peak_rss = None # in bytes
+
+    def to_dict(self):
+        stage = dict(self.info)
+        stage.update({
+            'name': self.name,
+            'trackpoints': self.trackpoints,
+            'elapsed': self.elapsed,
+            'cpu_time': self.cpu_time,
+            'peak_rss': self.peak_rss,
+        })
+
+        return stage
+
+class Stats:
+    def __init__(self, callbacks=None):
+        self.stages = []
+        self.callbacks = list(callbacks or [])
+        self.started_at = time.time()
+
+    @classmethod
+    def configure_args_parser(cls, parser):
+        parser.add_argument(
+            '--profile', action='store_true',
+            help='Print the time and memory used by each stage on stderr.',
+        )
+        parser.add_argument(
+            '--stats-json', type=str, default=None,
+            help='File to write the stages statistics to, as JSON ("-" for stdout).',
+        )
+
+    def add_callback(self, callback):
+        # callback(stage) is called each time a stage ends
+        self.callbacks.append(callback)
+
+    @contextmanager
+    def stage(self, name, **info):
+        stage = Stage(name, **info)
+        start, cpu_start = time.time(), time.process_time()
+
+        try:
+            yield stage
+        finally:
+            stage.elapsed = time.time() - start
+            stage.cpu_time = time.process_time() - cpu_start
+            stage.peak_rss = peak_rss()
+            self.add(stage)
+
+    def add(self, stage):
+        # stages measured elsewhere (in another process for instance) can be
+        # added directly
+        self.stages.append(stage)
+
+        for callback in self.callbacks:
+            callback(stage)
+
+    def to_dict(self):
+        return {
+            'stages': [stage.to_dict() for stage in self.stages],
+            'elapsed': time.time() - self.started_at,
+            'peak_rss': peak_rss(),
+        }
+
+    def report(self, stream=None):
+        stream = stream or sys.stderr
+
+        stream.write('%-10s %12s %10s %10s %10s\n' % ('stage', 'trackpoints', 'elapsed', 'cpu', 'peak rss'))
+
+        for stage in self.stages:
+            stream.write('%-10s %12s %10s %10s %10s\n' % (
+                stage.name,
+                '-' if stage.trackpoints is None else stage.trackpoints,
+                _format_seconds(stage.elapsed),
+                _format_seconds(stage.cpu_time),
+                format_bytes(stage.peak_rss),
+            ))
+
+        stream.write('%-10s %12s %10s %10s %10s\n' % (
+            'total', '', _format_seconds(time.time() - self.started_at), '', format_bytes(peak_rss())
+        ))
+
+    def write_json(self, filename):
+        if filename == '-':
+            json.dump(self.to_dict(), sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write('\n')
+            return
+
+        with open(filename, 'w') as output:
+            json.dump(self.to_dict(), output, indent=2, sort_keys=True)
+
+    def finish(self, options):
+        # reports the statistics as asked by the command line options
+        if options.profile:
+            self.report()
+
+        if options.stats_json is not None:
+            self.write_json(options.stats_json)
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+
+    return '%.3fs' % seconds
+
+def format_bytes(size):
+    if size is None:
+        return '-'
+
+    return '%.1fMB' % (size / 1024.0 / 1024)
+
+def format_duration(seconds):
+    seconds = int(round(seconds or 0))
+
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+from datetime import datetime, timedelta
+
+import numpy
+
+EPOCH = datetime(1970, 1, 1)
+
+def datetime_to_ns(date):
+    if date.tzinfo is not None:
+        date = date.replace(tzinfo=None) - date.utcoffset()
+
+    delta = date - EPOCH
+
+    return ((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds) * 1000
+
+def ns_to_datetime(ns):
+    return EPOCH + timedelta(microseconds=int(ns) // 1000)
+
+def parse_timestamp(string):
+    # fixed layout: YYYY-MM-DDTHH:MM:SS[.ffffff][Z|+HH:MM|-HH:MM]
+    if len(string) < 19 or string[4] != '-' or string[7] != '-' or \
+       string[10] not in 'T ' or string[13] != ':' or string[16] != ':':
+        raise ValueError('Invalid timestamp: ' + string)
+
+    end = len(string)
+    microsecond = 0
+
+    if end > 19 and string[19] in '.,':
+        i = 20
+        while i < end and string[i].isdigit():
+            i += 1
+
+        microsecond = int((string[20:i] + '000000')[:6])
+        suffix = string[i:]
+    else:
+        suffix = string[19:]
+
+    date = datetime(
+        int(string[0:4]), int(string[5:7]), int(string[8:10]),
+        int(string[11:13]), int(string[14:16]), int(string[17:19]),
+        microsecond
+    )
+
+    if suffix == '' or suffix == 'Z':
+        return date
+
+    return date - _parse_utc_offset(suffix, string)
+
+def _parse_utc_offset(suffix, string):
+    digits = suffix[1:].replace(':', '')
+
+    if suffix[0] not in '+-' or len(digits) not in (2, 4) or not digits.isdigit():
+        raise ValueError('Invalid timestamp: ' + string)
+
+    offset = timedelta(hours=int(digits[:2]), minutes=int(digits[2:] or 0))
+
+    return offset if suffix[0] == '+' else -offset
+
+def format_timestamp(date):
+    return '%04d-%02d-%02dT%02d:%02d:%02d.%06dZ' % (
+        date.year, date.month, date.day,
+        date.hour, date.minute, date.second, date.microsecond
+    )
+
+def parse_timestamps(strings):
+    strings = numpy.asarray(strings, dtype='U')
+
+    if len(strings) == 0:
+        return numpy.empty(0, dtype='int64')
+
+    strings = numpy.char.rstrip(strings, 'Z')
+
+    # numpy only parses the timestamps without UTC offset
+    has_offset = (numpy.char.rfind(strings, '+') > 10) | (numpy.char.rfind(strings, '-') > 10)
+
+    try:
+        result = numpy.where(has_offset, '1970-01-01', strings).astype('datetime64[ns]').astype('int64')
+    except ValueError:
+        # the slow path tells which timestamp is invalid
+        return numpy.array([datetime_to_ns(parse_timestamp(s)) for s in strings], dtype='int64')
+
+    for i in numpy.flatnonzero(has_offset):
+        result[i] = datetime_to_ns(parse_timestamp(strings[i]))
+
+    return result
+
+def format_timestamps(times):
+    times = numpy.asarray(times, dtype='int64').astype('datetime64[ns]')
+
+    return numpy.char.add(numpy.datetime_as_string(times.astype('datetime64[us]')), 'Z')
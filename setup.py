@@ -1,5 +1,4 @@
-import sys
-from distutils.core import setup
+from setuptools import setup
 
 import runner
 
@@ -12,6 +11,9 @@ setup(
     author_email='contact@kevingomez.fr',
     license=open('LICENSE').read(),
     packages=['runner'],
+    python_requires='>=3.8',
+    install_requires=['lxml>=4.4.2', 'numpy>=1.17.3'],
     scripts=['scripts/runner-convert', 'scripts/runner-merge',
-             'scripts/runner-edit'],
+             'scripts/runner-edit', 'scripts/runner-catalog',
+             'scripts/runner-analyze'],
 )
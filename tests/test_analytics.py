@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import os, unittest
+
+import numpy
+
+import runner.model as model
+from runner.analytics import analyze, best_averages, best_efforts, best_speeds, cumulative_distance, rolling_average, rolling_speed, time_in_zones, zone_bounds
+from runner.parser import parse_from_file
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+# 10 minutes at 4 m/s, then 10 minutes at 2 m/s, a sample per second
+TIME = numpy.arange(1201, dtype='float64')
+DISTANCE = numpy.where(TIME <= 600, 4 * TIME, 2400 + 2 * (TIME - 600))
+
+class AnalyticsTest(unittest.TestCase):
+    def test_best_efforts(self):
+        one, five, ten = best_efforts(TIME, DISTANCE, (1000, 2500, 10000))
+
+        self.assertEqual((one.elapsed, one.start, one.end), (250, 0, 250))
+        self.assertAlmostEqual(one.pace, 250)
+        # 2400 meters at 4 m/s and 100 at 2 m/s
+        self.assertAlmostEqual(five.elapsed, 650)
+        self.assertIsNone(ten)
+
+    def test_best_speeds(self):
+        minute, twenty, longer = best_speeds(TIME, DISTANCE, (60, 1200, 1300))
+
+        self.assertAlmostEqual(minute.value, 4)
+        self.assertAlmostEqual(twenty.value, 3)
+        self.assertIsNone(longer)
+
+    def test_best_averages(self):
+        heart_rate = numpy.where(TIME < 300, 120.0, 160.0)
+        valid = numpy.ones(len(TIME), dtype='bool')
+        valid[700:] = False
+
+        average, = best_averages(TIME, heart_rate, [300])
+        self.assertAlmostEqual(average.value, 160)
+
+        # the windows need their values to be known for 90% of their time
+        average, = best_averages(TIME, heart_rate, [900], valid)
+        self.assertIsNone(average)
+        average, = best_averages(TIME, heart_rate, [600], valid, coverage=0.5)
+        self.assertAlmostEqual(average.value, 160)
+
+    def test_rolling(self):
+        heart_rate = numpy.where(TIME < 600, 120.0, 160.0)
+        averages = rolling_average(TIME, heart_rate, 60)
+        speeds = rolling_speed(TIME, DISTANCE, 60)
+
+        self.assertEqual((averages[0], averages[599], averages[660], averages[-1]), (120, 120, 160, 160))
+        self.assertAlmostEqual(averages[630], 140)
+        self.assertEqual((speeds[0], speeds[300], speeds[-1]), (0, 4, 2))
+
+    def test_time_in_zones(self):
+        # a pause longer than 30s isn't counted
+        time = numpy.array([0, 10, 20, 30, 100, 110], dtype='float64')
+        heart_rate = numpy.array([100, 150, 0, 170, 180, 180], dtype='float64')
+        zones = time_in_zones(time, heart_rate, zone_bounds(200, (70, 80)))
+
+        self.assertEqual([(zone.low, zone.high) for zone in zones], [(0, 140), (140, 160), (160, None)])
+        self.assertEqual([zone.time for zone in zones], [10, 10, 10])
+
+    def test_cumulative_distance(self):
+        # from the positions without distances, never decreasing
+        latitude = numpy.array([0, 0, 0], dtype='float64')
+        longitude = numpy.array([0, 0.001, 0.002], dtype='float64')
+
+        self.assertAlmostEqual(cumulative_distance(numpy.zeros(3), latitude, longitude)[-1], 222.39, places=2)
+        self.assertEqual(cumulative_distance(numpy.array([0, 10, 8, 12.0]), latitude, longitude).tolist(), [0, 10, 10, 12])
+
+    def test_analyze(self):
+        activity = parse_from_file(os.path.join(DATA, 'main.tcx'), False)
+        report = analyze(activity, efforts=[1000], windows=[60], zones=[150, 170])
+        arrays = activity.to_arrays()
+
+        self.assertAlmostEqual(report['duration'], (arrays['time'][-1] - arrays['time'][0]) / 1e9)
+        self.assertAlmostEqual(report['distance'], arrays['distance'].max())
+        self.assertGreater(report['efforts'][0].elapsed, 0)
+        self.assertEqual(len(report['zones']), 3)
+        self.assertLessEqual(sum(zone.time for zone in report['zones']), report['duration'])
+
+    def test_empty_activity(self):
+        report = analyze(model.Activity())
+
+        self.assertEqual((report['duration'], report['distance'], report['zones']), (0, 0, []))
+        self.assertEqual(report['efforts'], [None] * 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import errno, os, shutil, tempfile, unittest
+from unittest import mock
+
+from runner.cache import ActivityCache
+from runner.parser import parse_from_file
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+class ActivityCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(DATA, 'main.tcx')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def copy(self, name):
+        path = os.path.join(self.directory, name)
+        shutil.copy(self.filename, path)
+
+        return path
+
+    def test_hit(self):
+        cache = ActivityCache(os.path.join(self.directory, 'cache'))
+        activity = parse_from_file(self.filename, cache)
+        cached = cache.get(self.filename)
+
+        self.assertIsNotNone(cached)
+        self.assertEqual(cached.to_arrays()['time'].tolist(), activity.to_arrays()['time'].tolist())
+        self.assertEqual(parse_from_file(self.filename, cache).distance, activity.distance)
+
+    def test_keys(self):
+        cache = ActivityCache(os.path.join(self.directory, 'cache'))
+        first, second = self.copy('first.tcx'), self.copy('second.tcx')
+        cache.put(first, parse_from_file(first, False))
+
+        # by path, size and modification time
+        self.assertIsNone(cache.get(second))
+
+        with open(first, 'a') as output:
+            output.write('\n')
+        self.assertIsNone(cache.get(first))
+
+        # or by content
+        cache = ActivityCache(os.path.join(self.directory, 'cache'), hash_content=True)
+        cache.put(first, parse_from_file(first, False))
+
+        self.assertIsNotNone(cache.get(first))
+        self.assertIsNone(cache.get(second))
+
+        with open(second, 'a') as output:
+            output.write('\n')
+        self.assertIsNotNone(cache.get(second))
+
+    def test_eviction(self):
+        directory = os.path.join(self.directory, 'cache')
+        paths = [self.copy('%d.tcx' % i) for i in range(3)]
+        activity = parse_from_file(self.filename, False)
+
+        cache = ActivityCache(directory)
+        for path in paths[:2]:
+            cache.put(path, activity)
+
+        entries = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+        size = os.path.getsize(entries[0])
+        for entry in entries:
+            os.utime(entry, (1000, 1000))
+
+        # the least recently used entry is evicted
+        cache = ActivityCache(directory, max_size=int(2.5 * size))
+        self.assertIsNotNone(cache.get(paths[0]))
+        cache.put(paths[2], activity)
+
+        self.assertIsNotNone(cache.get(paths[0]))
+        self.assertIsNone(cache.get(paths[1]))
+        self.assertIsNotNone(cache.get(paths[2]))
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+    def test_corrupted_entry(self):
+        directory = os.path.join(self.directory, 'cache')
+        cache = ActivityCache(directory)
+        cache.put(self.filename, parse_from_file(self.filename, False))
+
+        entry = os.path.join(directory, os.listdir(directory)[0])
+        with open(entry, 'r+b') as output:
+            output.write(b'corrupted')
+
+        self.assertIsNone(cache.get(self.filename))
+        self.assertEqual(os.listdir(directory), [])
+
+    def test_failed_write(self):
+        cache = ActivityCache(self.directory)
+
+        with mock.patch('runner.native.write_activity', side_effect=OSError(errno.ENOSPC, 'No space left on device')):
+            activity = parse_from_file(self.filename, cache)
+
+        self.assertEqual(activity.distance, parse_from_file(self.filename, False).distance)
+        # the partial entry is removed
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertIsNone(cache.get(self.filename))
+
+    def test_missing_directory(self):
+        cache = ActivityCache(self.directory)
+        shutil.rmtree(self.directory)
+
+        self.assertFalse(cache.put(self.filename, parse_from_file(self.filename, False)))
+        self.assertEqual(len(parse_from_file(self.filename, cache).laps), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import os, shutil, tempfile, unittest
+from datetime import date
+
+import numpy
+
+import runner.model as model
+from runner.catalog import Catalog, IndexResult
+from runner.dumper import dump_to_file
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+# tracks of 100 trackpoints, one per day, going from a position to another
+TRACKS = {
+    'paris': ((48.855, 2.351), (48.875, 2.371)),
+    'lyon': ((45.757, 4.832), (45.767, 4.842)),
+    # across the antimeridian, in Fiji
+    'taveuni': ((-16.8, 179.98), (-16.79, -179.98)),
+}
+
+def track(day, start, end):
+    latitude = numpy.linspace(start[0], end[0], 100)
+    # the longitudes are interpolated on the short way around
+    longitude = (start[1] + numpy.linspace(0, (end[1] - start[1] + 180) % 360 - 180, 100) + 180) % 360 - 180
+
+    activity = model.Activity.from_arrays({
+        'time': (1413763200 + day * 86400 + numpy.arange(100, dtype='int64') * 10) * 10 ** 9,
+        'distance': numpy.arange(100, dtype='float64') * 30,
+        'heart_rate': numpy.full(100, 140, dtype='int32'),
+        'latitude': latitude,
+        'longitude': longitude,
+    })
+    activity.type = 'running'
+
+    return activity
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = os.path.join(self.directory, 'files')
+        os.makedirs(self.files)
+
+        for day, (name, (start, end)) in enumerate(sorted(TRACKS.items())):
+            dump_to_file(track(day, start, end), os.path.join(self.files, name + '.runner'))
+
+        self.catalog = Catalog(os.path.join(self.directory, 'catalog.sqlite'))
+        self.results = list(self.catalog.index([self.files], jobs=1))
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.directory)
+
+    def names(self, **filters):
+        return sorted(os.path.basename(row['path'])[:-len('.runner')] for row in self.catalog.activities(**filters))
+
+    def test_index(self):
+        self.assertEqual(sorted(result.status for result in self.results), [IndexResult.INDEXED] * 3)
+        self.assertEqual(sum(result.trackpoints for result in self.results), 300)
+
+        # only the changed files are indexed again
+        os.remove(os.path.join(self.files, 'lyon.runner'))
+        shutil.copy(os.path.join(DATA, 'main.tcx'), self.files)
+        statuses = dict((os.path.basename(result.path), result.status) for result in self.catalog.index([self.files], jobs=1))
+
+        self.assertEqual(statuses, {
+            'lyon.runner': IndexResult.REMOVED, 'main.tcx': IndexResult.INDEXED,
+            'paris.runner': IndexResult.UNCHANGED, 'taveuni.runner': IndexResult.UNCHANGED,
+        })
+        self.assertEqual(len(self.catalog.laps(os.path.join(self.files, 'main.tcx'))), 1)
+
+    def test_filters(self):
+        self.assertEqual(self.names(), ['lyon', 'paris', 'taveuni'])
+        # lyon is the first day
+        self.assertEqual(self.names(since=date(2014, 10, 21)), ['paris', 'taveuni'])
+        self.assertEqual(self.names(type='RUNNING', min_distance=2900), ['lyon', 'paris', 'taveuni'])
+        self.assertEqual(self.names(max_distance=1000), [])
+
+    def test_bbox(self):
+        self.assertEqual(self.names(bbox=(48.8, 2.3, 48.9, 2.4)), ['paris'])
+        # a large box, whose query doesn't grow with it
+        self.assertEqual(self.names(bbox=(40, 0, 52, 10)), ['lyon', 'paris'])
+        self.assertEqual(self.names(bbox=(-90, -180, 90, 180)), ['lyon', 'paris', 'taveuni'])
+        self.assertEqual(self.names(bbox=(10, 20, 30, 40)), [])
+
+    def test_antimeridian(self):
+        self.assertEqual(self.names(bbox=(-17, 179.9, -16.5, -179.9)), ['taveuni'])
+        # each side of the antimeridian
+        self.assertEqual(self.names(bbox=(-17, 179.9, -16.5, 180)), ['taveuni'])
+        self.assertEqual(self.names(bbox=(-17, -180, -16.5, -179.9)), ['taveuni'])
+        self.assertEqual(self.names(bbox=(-17, 179, -16.5, 179.5)), [])
+        self.assertEqual(self.names(near=(-16.795, 180, 5000)), ['taveuni'])
+
+    def test_near(self):
+        self.assertEqual(self.names(near=(48.86, 2.36, 3000)), ['paris'])
+        self.assertEqual(self.names(near=(47.3, 3.6, 300000)), ['lyon', 'paris'])
+
+    def test_exact(self):
+        # in a cell of the track, but away from its trackpoints
+        bbox = (48.851, 2.3595, 48.852, 2.3599)
+
+        self.assertEqual(self.names(bbox=bbox), ['paris'])
+        self.assertEqual(self.names(bbox=bbox, exact=True), [])
+        self.assertEqual(self.names(bbox=(48.86, 2.35, 48.87, 2.37), exact=True), ['paris'])
+
+    def test_totals(self):
+        totals = self.catalog.totals(by='day')
+
+        self.assertEqual([row['activities'] for row in totals], [1, 1, 1])
+        self.assertEqual(self.catalog.totals(near=(48.86, 2.36, 3000))[0]['activities'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
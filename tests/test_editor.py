@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import argparse, operator, os, unittest
+from datetime import timedelta
+
+import numpy
+
+from runner.editor import LapEditor, build_laps, parse_time_delta, split_by_distance, split_by_position, split_by_time
+from runner.parser import parse_from_file
+from runner.timestamp import ns_to_datetime
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+def options(distance=None, time=None, position=None, radius=25):
+    return argparse.Namespace(distance=distance, time=time, position=position, radius=radius)
+
+class SplitTest(unittest.TestCase):
+    def test_parse_time_delta(self):
+        self.assertEqual(parse_time_delta('+1hour5m'), (operator.add, timedelta(hours=1, minutes=5)))
+        self.assertEqual(parse_time_delta('-30s'), (operator.sub, timedelta(seconds=30)))
+
+    def test_split_by_distance(self):
+        distance = numpy.array([0, 400, 900, 1000, 1500, 2100, 2500], dtype='float64')
+
+        self.assertEqual(split_by_distance(distance, 1000).tolist(), [0, 3, 5])
+
+    def test_split_by_time(self):
+        time = numpy.array([0, 100, 299, 300, 450, 610], dtype='float64')
+
+        self.assertEqual(split_by_time(time, 300).tolist(), [0, 3, 5])
+
+    def test_split_by_position(self):
+        # three passes going more than 50m away between them, the noise
+        # around the position doesn't start other laps
+        latitude = 45 + numpy.array([0, 0.001, 0.005, 0.0001, 0.0003, 0.00005, 0.004, 0.0002, 0, 0.0002, 0.003])
+        longitude = numpy.full(len(latitude), 3.0)
+
+        self.assertEqual(split_by_position(latitude, longitude, 45, 3, 25).tolist(), [0, 5, 8])
+
+class LapEditorTest(unittest.TestCase):
+    def setUp(self):
+        self.activity = parse_from_file(os.path.join(DATA, 'main.tcx'), False)
+        self.arrays = self.activity.to_arrays()
+
+    def assertSameTrackpoints(self):
+        arrays = self.activity.to_arrays()
+
+        self.assertTrue(numpy.array_equal(arrays['time'], self.arrays['time']))
+        self.assertTrue(numpy.array_equal(arrays['heart_rate'], self.arrays['heart_rate']))
+
+    def test_distance(self):
+        LapEditor().edit(self.activity, options(distance=1))
+        laps = self.activity.laps
+
+        self.assertEqual(len(laps), 4)
+        self.assertTrue(all(lap.trigger_method == 'Distance' for lap in laps))
+        self.assertTrue(all(abs(lap.distance - 1000) < 20 for lap in laps[:-1]))
+        self.assertAlmostEqual(sum(lap.distance for lap in laps), self.arrays['distance'].max() - self.arrays['distance'].min())
+        self.assertSameTrackpoints()
+
+    def test_time(self):
+        calories = self.activity.calories
+        LapEditor().edit(self.activity, options(time='5m'))
+        laps = self.activity.laps
+
+        self.assertEqual(len(laps), 4)
+        self.assertTrue(all(abs(lap.duration - 300) < 5 for lap in laps[:-1]))
+        # the calories are shared between the laps
+        self.assertEqual(sum(lap.calories for lap in laps), calories)
+        self.assertSameTrackpoints()
+
+    def test_position(self):
+        # the activity is a loop going once through its 200th trackpoint
+        position = (self.arrays['latitude'][200], self.arrays['longitude'][200])
+        LapEditor().edit(self.activity, options(position=position))
+        laps = self.activity.laps
+
+        self.assertEqual([len(lap.trackpoints) for lap in laps], [200, len(self.arrays['time']) - 200])
+        self.assertEqual(laps[1].start_time, ns_to_datetime(self.arrays['time'][200]))
+        self.assertTrue(all(lap.trigger_method == 'Location' for lap in laps))
+        self.assertSameTrackpoints()
+
+    def test_invalid_options(self):
+        for invalid in (options(distance=0), options(time='0s')):
+            with self.assertRaises(RuntimeError):
+                LapEditor().edit(self.activity, invalid)
+
+    def test_build_laps(self):
+        arrays = dict((name, values[:10]) for name, values in self.arrays.items())
+        laps = build_laps(arrays, [0, 4], 'Manual', calories=10)
+
+        self.assertEqual([len(lap.trackpoints) for lap in laps], [4, 6])
+        self.assertEqual(sum(lap.calories for lap in laps), 10)
+        self.assertEqual(laps[1].max_heart_rate, arrays['heart_rate'][4:].max())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import argparse, gzip, io, os, shutil, tempfile, unittest
+
+from runner.dumper import GPXDumper, TCXDumper
+from runner.editor import TimeEditor
+from runner.events import activities_from_events, activity_events
+from runner.parser import TCXParser, iter_events_from_file, parse_from_file
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+FILES = ['main.tcx', 'cardio.tcx', 'runtastic_20141020_1947_Running.tcx', 'runtastic_20141020_1947_Running.gpx']
+
+def dump_events(dumper, events):
+    output = io.StringIO()
+    dumper.dump_events(events, output)
+
+    return output.getvalue()
+
+class EventsTest(unittest.TestCase):
+    def test_events_order(self):
+        events = [event for event, _ in TCXParser().iter_events(os.path.join(DATA, 'main.tcx'))]
+        trackpoints = events.count('trackpoint')
+
+        self.assertEqual(events[:2], ['start_activity', 'start_lap'])
+        self.assertEqual(events[-2:], ['end_lap', 'end_activity'])
+        self.assertEqual(trackpoints, len(parse_from_file(os.path.join(DATA, 'main.tcx'), False).laps[0].trackpoints))
+        self.assertEqual(events.count('start_lap'), events.count('end_lap'))
+
+    def test_activity_events(self):
+        activity = parse_from_file(os.path.join(DATA, 'main.tcx'), False)
+        activities = list(activities_from_events(activity_events(activity)))
+
+        self.assertEqual(len(activities), 1)
+        self.assertEqual(TCXDumper().dump(activities[0]), TCXDumper().dump(activity))
+        # the activity given to activity_events is left as is
+        self.assertEqual(len(activity.laps), 1)
+
+    def test_dump_events(self):
+        # streaming a file gives the same output as parsing it at once
+        for filename in FILES:
+            path = os.path.join(DATA, filename)
+
+            for dumper in (GPXDumper(), TCXDumper()):
+                self.assertEqual(dump_events(dumper, iter_events_from_file(path)), dumper.dump(parse_from_file(path, False)))
+
+    def test_compressed_events(self):
+        directory = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(directory, 'main.tcx.gz')
+            with open(os.path.join(DATA, 'main.tcx'), 'rb') as source, gzip.open(path, 'wb') as output:
+                shutil.copyfileobj(source, output)
+
+            self.assertEqual(
+                dump_events(TCXDumper(), iter_events_from_file(path)),
+                TCXDumper().dump(parse_from_file(os.path.join(DATA, 'main.tcx'), False))
+            )
+        finally:
+            shutil.rmtree(directory)
+
+    def test_edit_events(self):
+        path = os.path.join(DATA, 'main.tcx')
+        options = argparse.Namespace(time='+1hour5m')
+
+        activity = parse_from_file(path, False)
+        TimeEditor().edit(activity, options)
+
+        self.assertEqual(
+            dump_events(TCXDumper(), TimeEditor().edit_events(iter_events_from_file(path), options)),
+            TCXDumper().dump(activity)
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import io, os, struct, unittest
+from datetime import datetime
+
+import numpy
+
+import runner.fit as fit
+from runner.dumper import FITDumper
+from runner.parser import FITParser, TCXParser
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+RECORD = 20
+UINT8, UINT32 = 0x02, 0x86
+
+def definition(local_type, number, fields):
+    header = struct.pack('<BBBHB', 0x40 | local_type, 0, 0, number, len(fields))
+
+    return header + b''.join(struct.pack('BBB', field, size, base_type) for field, size, base_type in fields)
+
+def full_record(local_type, timestamp, heart_rate):
+    return struct.pack('<BIB', local_type, timestamp, heart_rate)
+
+def compressed_record(local_type, time_offset, heart_rate):
+    return struct.pack('<BB', 0x80 | local_type << 5 | time_offset, heart_rate)
+
+def fit_file(messages, crc=None):
+    data = b''.join(messages)
+    header = struct.pack('<BBHI4s', 14, 0x10, 2093, len(data), b'.FIT')
+    header += struct.pack('<H', fit.crc16(header))
+
+    return header + data + struct.pack('<H', fit.crc16(header + data) if crc is None else crc)
+
+# records with a full timestamp (local type 0) and with a compressed one
+# (local type 1). 1000030 ends with 30 in its 5 lower bits: the second
+# compressed offset rolls over.
+DEFINITIONS = [
+    definition(0, RECORD, [(253, 4, UINT32), (3, 1, UINT8)]),
+    definition(1, RECORD, [(3, 1, UINT8)]),
+]
+COMPRESSED_MESSAGES = DEFINITIONS + [
+    full_record(0, 1000030, 100),
+    # a run of compressed messages, decoded at once
+    compressed_record(1, 31, 101),
+    compressed_record(1, 1, 102),
+    compressed_record(1, 5, 103),
+    full_record(0, 1000040, 104),
+    # a single compressed message
+    compressed_record(1, 10, 105),
+]
+
+def decode(data):
+    return fit.FITDecoder({'record': ['timestamp', 'heart_rate']}).decode(io.BytesIO(data))
+
+class FITDecoderTest(unittest.TestCase):
+    def test_compressed_timestamps(self):
+        records = decode(fit_file(COMPRESSED_MESSAGES))['record']
+
+        self.assertEqual(records['timestamp'].tolist(), [1000030, 1000031, 1000033, 1000037, 1000040, 1000042])
+        self.assertEqual(records['heart_rate'].tolist(), [100, 101, 102, 103, 104, 105])
+
+    def test_compressed_timestamp_without_reference(self):
+        data = fit_file(DEFINITIONS + [compressed_record(1, 3, 100), full_record(0, 1000040, 104)])
+
+        with self.assertRaises(fit.InvalidFITFileError):
+            decode(data)
+
+    def test_invalid_crc(self):
+        data = fit_file(COMPRESSED_MESSAGES)
+        crc, = struct.unpack('<H', data[-2:])
+
+        with self.assertRaises(fit.InvalidFITFileError):
+            decode(data[:-2] + struct.pack('<H', crc ^ 1))
+
+    def test_invalid_header_crc(self):
+        data = bytearray(fit_file(COMPRESSED_MESSAGES))
+        data[12] ^= 1
+
+        with self.assertRaises(fit.InvalidFITFileError):
+            decode(bytes(data))
+
+    def test_truncated_file(self):
+        with self.assertRaises(fit.InvalidFITFileError):
+            decode(fit_file(COMPRESSED_MESSAGES)[:-3])
+
+    def test_crc16(self):
+        # the CRC of some data followed by its CRC is 0
+        data = os.urandom(1000)
+
+        self.assertEqual(fit.crc16(data + struct.pack('<H', fit.crc16(data))), 0)
+        self.assertEqual(fit.crc16(b''), 0)
+
+class FITFilesTest(unittest.TestCase):
+    FILES = [
+        # file, trackpoints, start, end, calories, max heart rate
+        ('2014-10-21_08-52-05_4_47.fit', 353, datetime(2014, 10, 20, 15, 18, 28), datetime(2014, 10, 20, 15, 47, 49), 522, 203),
+        ('2014-10-23_18-05-54_4_48.fit', 784, datetime(2014, 10, 23, 14, 56, 28), datetime(2014, 10, 23, 16, 1, 43), 979, 189),
+    ]
+
+    def test_records(self):
+        for filename, trackpoints, _, _, _, _ in self.FILES:
+            records = fit.FITDecoder({'record': ['timestamp', 'heart_rate']}).decode(os.path.join(DATA, filename))['record']
+
+            self.assertEqual(len(records['timestamp']), trackpoints)
+            self.assertTrue((numpy.diff(records['timestamp']) >= 0).all())
+
+    def test_activities(self):
+        for filename, trackpoints, start, end, calories, max_heart_rate in self.FILES:
+            activity = FITParser().parse(os.path.join(DATA, filename))
+            arrays = activity.to_arrays()
+
+            self.assertEqual(activity.type, 'Running')
+            self.assertEqual(len(arrays['time']), trackpoints)
+            self.assertEqual(activity.started_at, start)
+            self.assertEqual(activity.completed_at, end)
+            self.assertEqual(activity.calories, calories)
+            self.assertEqual(arrays['heart_rate'].max(), max_heart_rate)
+
+    def test_dumped_activity(self):
+        # a TCX activity written as FIT then decoded, the FIT timestamps
+        # being rounded to the second
+        activity = TCXParser().parse(os.path.join(DATA, 'main.tcx'))
+        decoded = FITParser().parse(io.BytesIO(FITDumper().dump(activity)))
+        expected, arrays = activity.to_arrays(), decoded.to_arrays()
+
+        self.assertEqual(len(decoded.laps), len(activity.laps))
+        self.assertTrue((arrays['time'] // 10 ** 9 == expected['time'] // 10 ** 9).all())
+        self.assertTrue((arrays['heart_rate'] == expected['heart_rate']).all())
+        self.assertTrue(numpy.allclose(arrays['distance'], expected['distance'], atol=0.01))
+        self.assertTrue(numpy.allclose(arrays['latitude'], expected['latitude'], atol=1e-6, equal_nan=True))
+
+if __name__ == '__main__':
+    unittest.main()
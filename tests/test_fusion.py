@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import unittest
+
+import numpy
+
+import runner.model as model
+from runner.fusion import Fusion, OffsetError
+
+def samples(seconds, value):
+    seconds = numpy.asarray(seconds, dtype='int64')
+
+    return seconds * 10 ** 9, numpy.full(len(seconds), value, dtype='float64')
+
+def activity(seconds, heart_rate):
+    return model.Activity.from_arrays({
+        'time': numpy.asarray(seconds, dtype='int64') * 10 ** 9 + 1413818308 * 10 ** 9,
+        'heart_rate': numpy.asarray(heart_rate, dtype='int32'),
+    })
+
+class InterpolateTest(unittest.TestCase):
+    TIMES = numpy.array([0, 10, 40], dtype='int64') * 10 ** 9
+    VALUES = numpy.array([100, 120, 150], dtype='float64')
+    AT = numpy.array([-5, 0, 4, 10, 25, 38, 40, 45], dtype='int64') * 10 ** 9
+
+    def interpolate(self, interpolation, max_gap=None):
+        return Fusion(interpolation, max_gap).interpolate(self.TIMES, self.VALUES, self.AT).tolist()
+
+    def test_modes(self):
+        # 0 outside of the samples
+        self.assertEqual(self.interpolate('linear'), [0, 100, 108, 120, 135, 148, 150, 0])
+        self.assertEqual(self.interpolate('nearest'), [0, 100, 100, 120, 120, 150, 150, 0])
+        self.assertEqual(self.interpolate('hold'), [0, 100, 100, 120, 120, 120, 150, 0])
+
+    def test_max_gap(self):
+        # the gap from 10 to 40s isn't filled, but its ends are kept
+        self.assertEqual(self.interpolate('linear', 15), [0, 100, 108, 120, 0, 0, 150, 0])
+        self.assertEqual(self.interpolate('nearest', 5), [0, 100, 100, 120, 0, 150, 150, 0])
+        self.assertEqual(self.interpolate('hold', 15), [0, 100, 100, 120, 120, 0, 150, 0])
+
+    def test_merge_activities(self):
+        main = activity(range(0, 50, 5), [0] * 10)
+        Fusion('linear', max_gap=15).merge_activities(main, activity([0, 10, 40], [100, 120, 150]))
+
+        self.assertEqual(main.laps[0].trackpoints.column('heart_rate').tolist(), [100, 110, 120, 0, 0, 0, 0, 0, 150, 0])
+
+class MergeSamplesTest(unittest.TestCase):
+    def test_priority_handover(self):
+        # the first source has spans from 0 to 20s and from 80 to 90s, and
+        # an isolated sample at 50s, the second one covers everything
+        first = samples([0, 10, 20, 50, 80, 90], 150)
+        second = samples(range(0, 101, 2), 100)
+
+        for interpolation in Fusion.INTERPOLATIONS:
+            times, values = Fusion(interpolation, max_gap=15).merge_samples([first, second])
+            seconds = times // 10 ** 9
+            spans = ((seconds >= 0) & (seconds <= 20)) | ((seconds >= 80) & (seconds <= 90))
+
+            self.assertTrue((numpy.diff(times) > 0).all())
+            self.assertEqual(values.tolist(), numpy.where(spans, 150, 100).tolist())
+            # a single handover at each end of the spans
+            self.assertEqual(numpy.count_nonzero(numpy.diff(values)), 3)
+
+    def test_priority_without_max_gap(self):
+        first = samples([10, 20, 30], 150)
+        second = samples([0, 5, 10, 15, 35], 100)
+
+        times, values = Fusion().merge_samples([first, second])
+
+        self.assertEqual((times // 10 ** 9).tolist(), [0, 5, 10, 20, 30, 35])
+        self.assertEqual(values.tolist(), [100, 100, 150, 150, 150, 100])
+
+    def test_weighted(self):
+        first = samples([0, 10, 20], 150)
+        second = samples([5, 15, 25, 30], 100)
+
+        times, values = Fusion(policy='weighted').merge_samples([first, second], [3, 1])
+
+        # averaged where both sources cover the samples
+        self.assertEqual((times // 10 ** 9).tolist(), [0, 5, 10, 15, 20, 25, 30])
+        self.assertEqual(values.tolist(), [150, 137.5, 137.5, 137.5, 137.5, 100, 100])
+
+        # the samples only covered by sources with a weight of 0 are dropped
+        times, values = Fusion(policy='weighted').merge_samples([first, second], [0, 1])
+        self.assertEqual((times // 10 ** 9).tolist(), [5, 10, 15, 20, 25, 30])
+        self.assertEqual(values.tolist(), [100] * 6)
+
+        with self.assertRaises(ValueError):
+            Fusion(policy='weighted').merge_samples([first, second], [1])
+
+class EstimateOffsetTest(unittest.TestCase):
+    def test_offset(self):
+        # the clock of the cardio device is 7s late
+        random = numpy.random.RandomState(42)
+        seconds = numpy.arange(0, 1200)
+        heart_rate = numpy.round(140 + numpy.cumsum(random.normal(0, 1, len(seconds))))
+
+        main = activity(seconds, heart_rate)
+        cardio = activity(seconds[100:1000:2] - 7, heart_rate[100:1000:2])
+        offset = Fusion().estimate_offset(main, cardio, max_offset=60)
+
+        self.assertAlmostEqual(offset.seconds, 7, delta=0.5)
+        self.assertGreater(offset.confidence, 0.9)
+        self.assertEqual(offset.signal, 'heart_rate')
+
+    def test_no_overlap(self):
+        main = activity(range(0, 100), [120] * 100)
+
+        with self.assertRaises(OffsetError):
+            Fusion().estimate_offset(main, activity(range(5000, 5100), [120] * 100), max_offset=60)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import unittest
+from datetime import datetime, timedelta
+
+import runner.model as model
+
+START = datetime(2014, 10, 20, 15, 18, 28)
+
+def trackpoint(seconds, heart_rate=120, position=(48.85, 2.35)):
+    trackpoint = model.Trackpoint(START + timedelta(seconds=seconds))
+    trackpoint.distance = 3.0 * seconds
+    trackpoint.heart_rate = heart_rate
+
+    if position is not None:
+        trackpoint.position = model.Position(*position)
+
+    return trackpoint
+
+def seconds(trackpoints):
+    return [int((trackpoint.time - START).total_seconds()) for trackpoint in trackpoints]
+
+class TrackpointColumnsTest(unittest.TestCase):
+    def setUp(self):
+        self.lap = model.Lap()
+        self.lap.trackpoints.extend(trackpoint(i) for i in range(5))
+
+    def test_append_copies(self):
+        appended = trackpoint(5)
+        self.lap.trackpoints.append(appended)
+        appended.heart_rate = 180
+
+        self.assertEqual(self.lap.trackpoints[-1].heart_rate, 120)
+
+    def test_position_writes_through(self):
+        max_heart_rate = self.lap.max_heart_rate
+        self.lap.trackpoints[2].position.latitude = 40.5
+        self.lap.trackpoints[3].heart_rate = 190
+
+        self.assertEqual(self.lap.trackpoints[2].position.latitude, 40.5)
+        self.assertEqual(self.lap.trackpoints.column('latitude')[2], 40.5)
+        self.assertEqual((max_heart_rate, self.lap.max_heart_rate), (120, 190))
+
+    def test_unknown_position(self):
+        self.lap.trackpoints.append(trackpoint(5, position=None))
+
+        self.assertIsNone(self.lap.trackpoints[5].position)
+
+    def test_mutators(self):
+        trackpoints = self.lap.trackpoints
+
+        trackpoints.insert(0, trackpoint(10))
+        self.assertEqual(seconds(trackpoints), [10, 0, 1, 2, 3, 4])
+
+        trackpoints.sort()
+        self.assertEqual(seconds(trackpoints), [0, 1, 2, 3, 4, 10])
+        self.assertEqual(self.lap.end_time, START + timedelta(seconds=10))
+
+        trackpoints.sort(key=lambda trackpoint: trackpoint.distance, reverse=True)
+        self.assertEqual(seconds(trackpoints), [10, 4, 3, 2, 1, 0])
+
+        del trackpoints[0]
+        del trackpoints[::2]
+        self.assertEqual(seconds(trackpoints), [3, 1])
+        self.assertEqual(self.lap.end_time, START + timedelta(seconds=3))
+
+        trackpoints[1:1] = [trackpoint(7), trackpoint(8)]
+        trackpoints[0] = trackpoint(6)
+        self.assertEqual(seconds(trackpoints), [6, 7, 8, 1])
+
+        trackpoints.remove(trackpoint(7))
+        popped = trackpoints.pop()
+        self.assertEqual(seconds(trackpoints), [6, 8])
+        self.assertEqual((seconds([popped]), popped.position.latitude), ([1], 48.85))
+
+        with self.assertRaises(ValueError):
+            trackpoints.remove(trackpoint(7))
+
+        trackpoints += [trackpoint(9)]
+        trackpoints.reverse()
+        self.assertEqual(seconds(trackpoints), [9, 8, 6])
+        self.assertEqual(self.lap.avg_heart_rate, 120)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import io, os, shutil, tempfile, unittest
+
+import numpy
+
+import runner.native as native
+from runner.dumper import FITDumper, NativeDumper, TCXDumper, dump_to_file
+from runner.parser import parse, parse_from_file
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+FILES = ['main.tcx', 'runtastic_20141020_1947_Running.gpx', '2014-10-21_08-52-05_4_47.fit']
+
+class NativeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameActivity(self, activity, expected):
+        self.assertEqual(activity.type, expected.type)
+        self.assertEqual(len(activity.laps), len(expected.laps))
+
+        for lap, expected_lap in zip(activity.laps, expected.laps):
+            self.assertEqual(lap.start_time, expected_lap.start_time)
+            self.assertEqual((lap.duration, lap.distance, lap.calories), (expected_lap.duration, expected_lap.distance, expected_lap.calories))
+            self.assertEqual(lap.avg_heart_rate, expected_lap.avg_heart_rate)
+
+        arrays, expected_arrays = activity.to_arrays(), expected.to_arrays()
+        for name, values in expected_arrays.items():
+            self.assertTrue(numpy.array_equal(arrays[name], values, equal_nan=values.dtype.kind == 'f'), name)
+
+    def test_round_trip(self):
+        for filename in FILES:
+            activity = parse_from_file(os.path.join(DATA, filename), False)
+            data = NativeDumper().dump(activity)
+
+            self.assertSameActivity(native.read_activity(data), activity)
+            self.assertSameActivity(native.read_activity(io.BytesIO(data)), activity)
+            # sniffed from the content
+            self.assertSameActivity(parse(data), activity)
+
+    def test_memory_mapped_file(self):
+        activity = parse_from_file(os.path.join(DATA, 'main.tcx'), False)
+        path = os.path.join(self.directory, 'main.runner')
+        dump_to_file(activity, path)
+
+        loaded = parse_from_file(path, False)
+        self.assertSameActivity(loaded, activity)
+        self.assertEqual(TCXDumper().dump(loaded), TCXDumper().dump(activity))
+
+        # the mapping is copy-on-write: the file isn't changed
+        loaded.laps[0].trackpoints[0].heart_rate = 42
+        self.assertSameActivity(parse_from_file(path, False), activity)
+
+    def test_invalid_file(self):
+        data = NativeDumper().dump(parse_from_file(os.path.join(DATA, 'main.tcx'), False))
+
+        with self.assertRaises(native.InvalidNativeFileError):
+            native.read_activity(b'RUNNERAX' + data[8:])
+
+    def test_precision(self):
+        # the coordinates are written at the precision of the binary formats
+        for dumper in (NativeDumper, FITDumper):
+            with self.assertRaises(ValueError):
+                dumper(precision=5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import os, unittest
+
+import numpy
+
+from runner.parser import parse_from_file
+from runner.simplify import DOUGLAS_PEUCKER, VISVALINGAM, Simplifier, douglas_peucker, project, resample, segment_distances, visvalingam
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+def max_distance(x, y, keep):
+    # the farthest point from the simplified track
+    kept = numpy.flatnonzero(keep)
+    segments = numpy.clip(numpy.searchsorted(kept, numpy.arange(len(x)), side='right') - 1, 0, len(kept) - 2)
+    first, last = kept[segments], kept[segments + 1]
+
+    return segment_distances(x, y, x[first], y[first], x[last], y[last]).max()
+
+class SimplifyTest(unittest.TestCase):
+    def setUp(self):
+        self.activity = parse_from_file(os.path.join(DATA, 'main.tcx'), False)
+        self.arrays = self.activity.to_arrays()
+
+    def test_douglas_peucker(self):
+        x, y = project(self.arrays['latitude'], self.arrays['longitude'])
+
+        for tolerance in (1, 5, 20):
+            keep = douglas_peucker(x, y, tolerance)
+
+            self.assertTrue(keep[0] and keep[-1])
+            self.assertLess(keep.sum(), len(x))
+            self.assertLessEqual(max_distance(x, y, keep), tolerance)
+
+    def test_straight_line(self):
+        x, y = numpy.arange(10, dtype='float64'), numpy.zeros(10)
+
+        self.assertEqual(numpy.flatnonzero(douglas_peucker(x, y, 0.1)).tolist(), [0, 9])
+        self.assertEqual(numpy.flatnonzero(visvalingam(x, y, 0.1)).tolist(), [0, 9])
+
+    def test_visvalingam(self):
+        x, y = project(self.arrays['latitude'], self.arrays['longitude'])
+        keep = visvalingam(x, y, 5)
+        kept = numpy.flatnonzero(keep)
+
+        # the triangles left are at least as large as the tolerance squared
+        a, b, c = kept[:-2], kept[1:-1], kept[2:]
+        areas = numpy.abs((x[b] - x[a]) * (y[c] - y[a]) - (x[c] - x[a]) * (y[b] - y[a])) / 2
+        self.assertTrue(keep[0] and keep[-1])
+        self.assertTrue((areas >= 25).all())
+
+    def test_resample(self):
+        times = numpy.array([0, 1, 2, 5, 9, 10, 11, 25], dtype='int64') * 10 ** 9
+
+        self.assertEqual(numpy.flatnonzero(resample(times, 5)).tolist(), [0, 3, 5, 7])
+
+    def test_simplify(self):
+        laps = [(lap.duration, lap.distance) for lap in self.activity.laps]
+        Simplifier(tolerance=5, method=VISVALINGAM, interval=10).simplify(self.activity)
+        arrays = self.activity.to_arrays()
+
+        self.assertLess(len(arrays['time']), len(self.arrays['time']))
+        # at most one trackpoint every 10s, and the last one
+        buckets = (arrays['time'][:-1] - self.arrays['time'][0]) // (10 * 10 ** 9)
+        self.assertEqual(len(numpy.unique(buckets)), len(buckets))
+        self.assertEqual(arrays['time'][-1], self.arrays['time'][-1])
+        # the lap summaries are kept
+        self.assertEqual([(lap.duration, lap.distance) for lap in self.activity.laps], laps)
+
+    def test_unknown_positions(self):
+        # the trackpoints without position are only resampled
+        time = numpy.arange(6, dtype='int64') * 10 ** 9
+        latitude = numpy.array([45.0, numpy.nan, 45.0, 45.0, numpy.nan, 45.0])
+        arrays = {'time': time, 'latitude': latitude, 'longitude': numpy.array([3.0, numpy.nan, 3.001, 3.002, numpy.nan, 3.003])}
+
+        keep = Simplifier(tolerance=1, method=DOUGLAS_PEUCKER).keep(arrays)
+        self.assertEqual(numpy.flatnonzero(keep).tolist(), [0, 1, 4, 5])
+
+    def test_invalid_options(self):
+        for options in ({'method': 'unknown'}, {'tolerance': -1}, {'interval': 0}):
+            with self.assertRaises(RuntimeError):
+                Simplifier(**options)
+
+if __name__ == '__main__':
+    unittest.main()
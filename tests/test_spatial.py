@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import unittest
+
+import numpy
+
+from runner.spatial import COLUMNS, TrackIndex, cell_bounds, cell_ids, cell_ranges, circle_bbox, distances, in_bbox, track_length
+
+class SpatialTest(unittest.TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(1)
+        self.latitude = random.uniform(-60, 60, 5000)
+        self.longitude = random.uniform(-180, 180, 5000)
+        self.latitude[::50] = numpy.nan
+
+    def test_cells(self):
+        self.assertEqual(cell_ids(-90, -180), 0)
+        self.assertEqual(cell_ids(90, 180), 18000 * COLUMNS - 1)
+        self.assertEqual(cell_ids(0.005, 0.005).tolist(), 9000 * COLUMNS + 18000)
+
+    def test_cell_bounds(self):
+        first, last, columns = cell_bounds(40, 0, 52, 10)
+
+        self.assertEqual((first, last), (13000 * COLUMNS, 14201 * COLUMNS - 1))
+        self.assertEqual(columns, [(18000, 19000)])
+        self.assertEqual(len(cell_ranges(40, 0, 52, 10)), 1201)
+
+        # across the antimeridian
+        self.assertEqual(cell_bounds(-20, 179, -15, -179)[2], [(35900, COLUMNS - 1), (0, 100)])
+
+    def test_in_bbox(self):
+        index = TrackIndex(self.latitude, self.longitude)
+
+        for bbox in ((10, -20, 30, 40), (-50, 170, 50, -170), (-90, -180, 90, 180)):
+            expected = numpy.flatnonzero(in_bbox(self.latitude, self.longitude, *bbox))
+
+            self.assertEqual(index.in_bbox(*bbox).tolist(), expected.tolist())
+
+    def test_near(self):
+        index = TrackIndex(self.latitude, self.longitude)
+
+        for latitude, longitude, radius in ((10, 20, 500000), (0, 179.5, 300000), (59, -10, 1000000)):
+            close = distances(latitude, longitude, self.latitude, self.longitude) <= radius
+
+            self.assertEqual(index.near(latitude, longitude, radius).tolist(), numpy.flatnonzero(close).tolist())
+
+    def test_circle_bbox(self):
+        min_latitude, min_longitude, max_latitude, max_longitude = circle_bbox(0, 179.9, 50000)
+
+        self.assertAlmostEqual(max_latitude, 0.45, places=2)
+        # across the antimeridian
+        self.assertTrue(min_longitude > max_longitude)
+        # around a pole, every longitude
+        self.assertEqual(circle_bbox(89.9, 0, 50000)[1::2], (-180.0, 180.0))
+
+    def test_track_length(self):
+        latitude = numpy.array([0, 0, numpy.nan, 0])
+        longitude = numpy.array([0, 1, 5, 2])
+
+        self.assertAlmostEqual(track_length(latitude, longitude), 2 * numpy.radians(1) * 6371000.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import numpy
+
+from runner.timestamp import datetime_to_ns, format_timestamp, format_timestamps, ns_to_datetime, parse_timestamp, parse_timestamps
+
+class TimestampTest(unittest.TestCase):
+    def test_parse_timestamp(self):
+        self.assertEqual(parse_timestamp('2014-10-20T15:18:28Z'), datetime(2014, 10, 20, 15, 18, 28))
+        self.assertEqual(parse_timestamp('2014-10-20T15:18:28.5Z'), datetime(2014, 10, 20, 15, 18, 28, 500000))
+        self.assertEqual(parse_timestamp('2014-10-20 15:18:28.123456'), datetime(2014, 10, 20, 15, 18, 28, 123456))
+        # in UTC
+        self.assertEqual(parse_timestamp('2014-10-20T17:18:28+02:00'), datetime(2014, 10, 20, 15, 18, 28))
+        self.assertEqual(parse_timestamp('2014-10-20T10:48:28-0430'), datetime(2014, 10, 20, 15, 18, 28))
+
+    def test_invalid_timestamp(self):
+        for string in ('2014-10-20', '2014/10/20T15:18:28Z', '2014-10-20T15:18:28+2'):
+            with self.assertRaises(ValueError):
+                parse_timestamp(string)
+
+    def test_nanoseconds(self):
+        date = datetime(2014, 10, 20, 15, 18, 28, 123456)
+
+        self.assertEqual(datetime_to_ns(date), 1413818308123456000)
+        self.assertEqual(ns_to_datetime(datetime_to_ns(date)), date)
+        self.assertEqual(datetime_to_ns(date.replace(tzinfo=timezone(timedelta(hours=2)))), datetime_to_ns(date - timedelta(hours=2)))
+
+    def test_parse_timestamps(self):
+        strings = ['2014-10-20T15:18:28Z', '2014-10-20T15:18:28.250Z', '2014-10-20T17:18:29+02:00']
+        times = parse_timestamps(strings)
+
+        self.assertEqual(times.dtype, numpy.dtype('int64'))
+        self.assertEqual(times.tolist(), [datetime_to_ns(parse_timestamp(string)) for string in strings])
+        self.assertEqual(len(parse_timestamps([])), 0)
+
+        with self.assertRaises(ValueError):
+            parse_timestamps(['2014-10-20T15:18:28Z', 'not a timestamp'])
+
+    def test_format_timestamps(self):
+        dates = [datetime(2014, 10, 20, 15, 18, 28), datetime(2014, 10, 20, 15, 18, 28, 5)]
+        formatted = format_timestamps([datetime_to_ns(date) for date in dates])
+
+        self.assertEqual(list(formatted), [format_timestamp(date) for date in dates])
+        self.assertEqual(formatted[0], '2014-10-20T15:18:28.000000Z')
+        self.assertEqual([parse_timestamp(string) for string in formatted], dates)
+
+if __name__ == '__main__':
+    unittest.main()